@@ -0,0 +1,101 @@
+import time
+from typing import Dict, Any, Tuple
+
+import numpy as np
+
+from benches.parallel import main
+from environ.components import Zone
+from environ.core import Environ
+from mappo.algorithms.algorithm.inference import load_actor
+
+
+def observations(samples: int, *, seed=0) -> np.ndarray:
+    """
+    collect realistic observations by running random scenarios with free fly zones
+    :param samples: number of observations to collect
+    :param seed: random seed of the scenarios
+    :return: numpy array of shape (samples, 77)
+    """
+    rng_state = np.random.get_state()
+    np.random.seed(seed)
+
+    result = []
+    scenario = Environ()
+    while len(result) < samples:
+        result.extend(scenario.reset(np.random.randint(1, 8), np.random.randint(0, 7)))
+        for _ in range(np.random.randint(0, 20)):
+            zones = (Zone((1.4, 1.4), (1.4, 1.4), (1.4, 1.4)) for _ in range(7))
+            result.extend(info for info, _, _, _ in scenario.step(zones))
+
+    np.random.set_state(rng_state)
+    return np.array(result[:samples], dtype=np.float32)
+
+
+def latency(model: Any, obs: np.ndarray, batch: int, *, rounds=200) -> float:
+    """
+    measure the average time the model takes for a batch
+    :param model: the loaded actor
+    :param obs: observations to draw the batches from
+    :param batch: batch size
+    :param rounds: number of timed batches
+    :return: seconds per batch
+    """
+    model(obs[:batch])  # warm up
+    start = time.perf_counter()
+    for i in range(rounds):
+        j = i * batch % (len(obs) - batch + 1)
+        model(obs[j:j + batch])
+    return (time.perf_counter() - start) / rounds
+
+
+def tables(result: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    summarize the benchmark result
+    :param result: numpy array returned by benches.parallel.main
+    :return: tables of average crashes and average completion
+    """
+    return np.mean(result[:, :, :, 0], axis=2), np.mean(result[:, :, :, 2], axis=2)
+
+
+def report(path: str, backends=("float16", "int8"), *, samples=10000, batch=7, limit=900, rep=100,
+           seed=0) -> Dict[str, Dict[str, Any]]:
+    """
+    compare the reduced precision actors against the float32 actor
+    :param path: path of actor model, must be actor.pt
+    :param backends: backends to compare, see benches.core.Benchmark
+    :param samples: number of observations for the zone comparison
+    :param batch: batch size of the latency measurement, 7 is a full scenario
+    :param limit: episode length of the benchmark, zero skips the benchmark
+    :param rep: repetition of each episode of the benchmark
+    :param seed: random seed shared by all runs
+    :return: a dictionary of metrics for each backend, including the float32 reference named "torch"
+    """
+    obs = observations(samples, seed=seed)
+    reference = load_actor(path, "torch")
+    reference_zones = 0.7 * (np.tanh(reference(obs)) + 1)
+    reference_tables = tables(main(path, limit=limit, rep=rep, backend="torch", seed=seed)) if limit else None
+
+    result = {}
+    for backend in ("torch", *backends):
+        model = reference if backend == "torch" else load_actor(path, backend)
+        zones = 0.7 * (np.tanh(model(obs)) + 1)
+        error = np.abs(zones - reference_zones)
+        metrics = {
+            "nbytes": model.nbytes,
+            "latency": latency(model, obs, batch),
+            "zone_max_error": float(error.max()),
+            "zone_mean_error": float(error.mean()),
+        }
+
+        if reference_tables is not None:
+            if backend == "torch":
+                crashes, dones = reference_tables
+            else:
+                crashes, dones = tables(main(path, limit=limit, rep=rep, backend=backend, seed=seed))
+            metrics["crashes"] = crashes
+            metrics["dones"] = dones
+            metrics["crashes_diff"] = crashes - reference_tables[0]
+            metrics["dones_diff"] = dones - reference_tables[1]
+
+        result[backend] = metrics
+    return result
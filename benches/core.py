@@ -1,33 +1,22 @@
 from typing import Any, Tuple, List, Generator
 
-import gymnasium as gym
 import numpy as np
-import torch as th
 
 from environ.components import Zone
 from environ.core import Environ
-from mappo.algorithms.algorithm.r_actor_critic import R_Actor
-from mappo.config import get_config
+from mappo.algorithms.algorithm.inference import load_actor
 
 
 class Benchmark:
-    def __init__(self, path: str, limit: int, rep: int):
+    def __init__(self, path: str, limit: int, rep: int, backend: str = "numpy"):
         """
         init a bench
-        :param path: path of actor model, usually named actor.pt
+        :param path: path of actor model, usually named actor.npz or actor.pt
         :param limit: episode length, exceeding this limit leads to failure of episode
         :param rep: repetition of each episode
+        :param backend: inference backend, one of "numpy", "torch", "float16" and "int8"
         """
-        model = R_Actor(
-            get_config().parse_known_args()[0],
-            gym.spaces.Box(-np.inf, np.inf, [77], dtype=np.float32),
-            gym.spaces.Box(0, 1.4, [6], dtype=np.float32),
-        )
-
-        policy_actor_state_dict = th.load(path, weights_only=True)
-        model.load_state_dict(policy_actor_state_dict)
-
-        self.model = model
+        self.model = load_actor(path, backend)
         self.limit = limit
         self.rep = rep
 
@@ -37,11 +26,10 @@ class Benchmark:
         :param obs: collection of observation of all agents
         :return: a generator that yields predicted zones
         """
-        for each in obs:
-            # np.zeros(0) are used to fill rnn states which is not used
-            action, _, _ = self.model(np.array(each), np.zeros(0), np.zeros(0), deterministic=True)
-            action = action.detach().cpu().numpy()[0, 0, 0]
-            action = 0.7 * (np.tanh(action) + 1)
+        # all agents are evaluated in a single batch
+        actions = self.model(np.array(obs, dtype=np.float32))
+        actions = 0.7 * (np.tanh(actions) + 1)
+        for action in actions:
             yield Zone(action[:2], action[2:4], action[4:6])
 
     def onetime(self, vehicles: int, humans: int) -> Tuple[int, int, bool]:
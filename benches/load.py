@@ -0,0 +1,125 @@
+import asyncio
+import time
+from contextlib import AsyncExitStack
+from typing import List, Dict, Any, Optional, Iterable
+
+import httpx
+import numpy as np
+
+from environ.components import Zone
+from environ.core import Environ
+
+
+def stream(vehicles: int, ticks: int, *, humans: Optional[int] = None) -> List[List[List[float]]]:
+    """
+    record the observations a coordinator of one site sends in every tick
+    :param vehicles: number of vehicles of the site
+    :param ticks: number of ticks to record, the episode restarts when all vehicles are offline
+    :param humans: number of humans of the site, random if None
+    :return: observations of the online vehicles of each tick
+    """
+    assert 1 <= vehicles <= 7
+
+    scenario = Environ()
+    result = []
+    obs = []
+    while len(result) < ticks:
+        if not obs:
+            obs = list(scenario.reset(vehicles, np.random.randint(0, 7) if humans is None else humans))
+        online = [o for o, vehicle in zip(obs, scenario.vehicles) if not vehicle.offline]
+        if not online:
+            obs = []
+            continue
+        result.append(online)
+        zones = (Zone((0.7, 0.7), (0.7, 0.7), (0.7, 0.7)) for _ in range(7))
+        obs = [info for info, _, _, _ in scenario.step(zones)]
+    return result
+
+
+async def site(client: httpx.AsyncClient, observations: List[List[List[float]]], tick: float, start: float,
+               model_name: str, latencies: List[float]) -> int:
+    """
+    replay the observations of a site, one request per tick
+    :param client: http client connected to the server
+    :param observations: observations of each tick, see stream
+    :param tick: the unit time in seconds
+    :param start: the time of the first tick
+    :param model_name: the model to request
+    :param latencies: latencies of all finished requests, appended inplace
+    :return: number of dropped ticks, i.e. ticks whose zones did not arrive before the next tick
+    """
+    dropped = 0
+    for i, obs in enumerate(observations):
+        scheduled = start + i * tick
+        delay = scheduled - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        elif -delay > tick:
+            # still waiting for an earlier tick, the coordinator has to skip this one
+            dropped += 1
+            continue
+
+        sent = time.perf_counter()
+        response = await client.post("/predict", json={"model_name": model_name, "obs": obs})
+        response.raise_for_status()
+        received = time.perf_counter()
+
+        latencies.append(received - sent)
+        if received > scheduled + tick:
+            dropped += 1
+    return dropped
+
+
+async def run(vehicles: int, *, ticks=100, tick=0.1, url: Optional[str] = None, model_name="mappo",
+              seed=0) -> Dict[str, Any]:
+    """
+    simulate a fleet polling the server in every tick
+    :param vehicles: size of the fleet, split into sites of at most 7 vehicles with one coordinator each
+    :param ticks: number of ticks to simulate
+    :param tick: the unit time in seconds
+    :param url: url of a running server, None starts server.main in process, where the client shares the event
+                loop with the server, so prefer a url for absolute numbers and in process for comparisons
+    :param model_name: the model to request
+    :param seed: random seed of the observation streams
+    :return: latency percentiles in seconds, achieved requests per second and dropped ticks
+    """
+    np.random.seed(seed)
+    sizes = [7] * (vehicles // 7) + ([vehicles % 7] if vehicles % 7 else [])
+    streams = [stream(size, ticks) for size in sizes]
+
+    async with AsyncExitStack() as stack:
+        if url is None:
+            from server.main import app
+
+            await stack.enter_async_context(app.router.lifespan_context(app))
+            transport = httpx.ASGITransport(app=app)
+            client = httpx.AsyncClient(transport=transport, base_url="http://pharos")
+        else:
+            client = httpx.AsyncClient(base_url=url, limits=httpx.Limits(max_connections=len(sizes)))
+        await stack.enter_async_context(client)
+
+        latencies: List[float] = []
+        start = time.perf_counter() + tick
+        dropped = await asyncio.gather(*(site(client, each, tick, start, model_name, latencies) for each in streams))
+        elapsed = time.perf_counter() - start
+
+    return {
+        "vehicles": vehicles,
+        "sites": len(sizes),
+        "requests": len(latencies),
+        "p50": float(np.percentile(latencies, 50)) if latencies else float("nan"),
+        "p99": float(np.percentile(latencies, 99)) if latencies else float("nan"),
+        "qps": len(latencies) / elapsed,
+        "dropped": int(sum(dropped)),
+        "dropped_ratio": sum(dropped) / (len(sizes) * ticks),
+    }
+
+
+def sweep(fleets: Iterable[int] = (7, 70, 350, 700, 1400), **kwargs) -> List[Dict[str, Any]]:
+    """
+    run the load test with growing fleet sizes
+    :param fleets: sizes of the fleet
+    :param kwargs: keyword arguments of run
+    :return: a list of results of run
+    """
+    return [asyncio.run(run(vehicles, **kwargs)) for vehicles in fleets]
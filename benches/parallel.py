@@ -1,37 +1,44 @@
 import multiprocessing as mp
-from typing import List, Any
+from typing import List, Any, Optional
 
 import numpy as np
 
 from benches.core import Benchmark
 
 
-def worker(path: str, v: int, limit: int, rep: int, table: List[List[Any]]):
+def worker(path: str, v: int, limit: int, rep: int, table: List[List[Any]], backend: str = "numpy",
+           seed: Optional[int] = None):
     """
     bench all scenarios of give number of vehicles
-    :param path: path of actor model, usually named actor.pt
+    :param path: path of actor model, usually named actor.npz or actor.pt
     :param v: number of vehicles
     :param limit: episode length, exceeding this limit leads to failure of episode
     :param rep: repetition of each episode
     :param table: the two-dimensional result table
+    :param backend: inference backend, see benches.core.Benchmark
+    :param seed: seed of this worker, so that different models face the same scenarios
     :return: nothing, all changes are inplace
     """
-    bench = Benchmark(path, limit, rep)
+    if seed is not None:
+        np.random.seed(seed + v)
+    bench = Benchmark(path, limit, rep, backend)
     for h in range(7):
         table[v - 1][h] = bench.repetition(v, h)
 
 
-def main(path: str, *, limit=900, rep=100) -> np.array:
+def main(path: str, *, limit=900, rep=100, backend="numpy", seed=None) -> np.array:
     """
     entry point of multiprocessing benchmark
-    :param path: path of actor model, usually named actor.pt
+    :param path: path of actor model, usually named actor.npz or actor.pt
     :param limit: episode length, exceeding this limit leads to failure of episode
     :param rep: repetition of each episode
+    :param backend: inference backend, see benches.core.Benchmark
+    :param seed: random seed of the scenarios, None for a fresh random run
     :return: numpy array of all data
     """
     with mp.Manager() as manager:
         table = manager.list([manager.list([None for _ in range(7)]) for _ in range(7)])
-        workers = [mp.Process(target=worker, args=(path, v, limit, rep, table)) for v in range(1, 8)]
+        workers = [mp.Process(target=worker, args=(path, v, limit, rep, table, backend, seed)) for v in range(1, 8)]
 
         for each in workers:
             each.start()
@@ -0,0 +1,71 @@
+import json
+import os
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List, Sequence
+
+import numpy as np
+import torch
+
+from mappo.config import get_config
+from mappo.runner.env_runner import EnvRunner
+from mappo.train import make_train_env, parse_args
+
+
+def train(args: Sequence[str] = (), *, episodes=20, steps=400, threads=5, seed=1) -> Dict[str, List[float]]:
+    """
+    train from scratch and record the statistics logged after every update
+    :param args: extra command line arguments of mappo.train, e.g. ["--use_bf16"]
+    :param episodes: number of episodes, i.e. updates
+    :param steps: episode length
+    :param threads: number of rollout threads
+    :param seed: seed of torch, numpy and the envs
+    :return: series of each logged statistic, e.g. average_episode_rewards and value_loss, and the seconds of each
+             episode as seconds
+    """
+    all_args = parse_args(["--episode_length", str(steps), "--n_rollout_threads", str(threads),
+                           "--num_env_steps", str(episodes * steps * threads), "--log_interval", "1",
+                           "--save_interval", str(episodes), "--seed", str(seed), *args], get_config())
+    torch.manual_seed(seed)
+    np.random.seed(seed)
+    torch.set_num_threads(all_args.n_training_threads)
+
+    envs = make_train_env(all_args)
+    with tempfile.TemporaryDirectory() as run_dir:
+        runner = EnvRunner({
+            "all_args": all_args,
+            "envs": envs,
+            "eval_envs": None,
+            "num_agents": all_args.num_agents,
+            "device": torch.device("cpu"),
+            "run_dir": Path(run_dir),
+        })
+        # the wall times of the scalars are time.time() stamps, the first episode is timed from here
+        start = time.time()
+        runner.run()
+        summary = os.path.join(run_dir, "summary.json")
+        runner.writer.export_scalars_to_json(summary)
+        runner.writer.close()
+        with open(summary) as f:
+            # tag -> [[wall time, step, value], ...], the tags end with the name of the statistic
+            scalars = json.load(f)
+    envs.close()
+
+    result = {tag.rsplit("/", 1)[-1]: [value for _, _, value in entries] for tag, entries in scalars.items()}
+    wall_times = [wall_time for wall_time, _, _ in next(iter(scalars.values()))]
+    result["seconds"] = np.diff(wall_times, prepend=start).tolist()
+    return result
+
+
+def compare(args: Sequence[str] = (), **kwargs) -> Dict[str, Dict[str, List[float]]]:
+    """
+    train with float32 and with bfloat16 autocast from the same seed, see train
+    :param args: extra command line arguments of mappo.train shared by both runs
+    :param kwargs: keyword arguments of train
+    :return: the statistics of both runs keyed by float32 and bfloat16
+    """
+    return {
+        "float32": train(args, **kwargs),
+        "bfloat16": train([*args, "--use_bf16"], **kwargs),
+    }
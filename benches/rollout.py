@@ -0,0 +1,56 @@
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, Sequence
+
+import numpy as np
+import torch
+
+from mappo.config import get_config
+from mappo.runner.env_runner import EnvRunner
+from mappo.train import make_train_env, parse_args
+
+
+def rollout(args: Sequence[str] = (), *, steps=400, threads=5, seed=1) -> Dict[str, float]:
+    """
+    time the steps of a training rollout, split into EnvRunner.collect, the env step and EnvRunner.insert
+    the feed-forward fast path is taken unless args select a recurrent policy
+    :param args: extra command line arguments of mappo.train, e.g. ["--use_naive_recurrent_policy"]
+    :param steps: number of timed steps, i.e. the episode length
+    :param threads: number of rollout threads
+    :param seed: seed of torch and numpy
+    :return: mean milliseconds per step of each part
+    """
+    all_args = parse_args(["--episode_length", str(steps), "--n_rollout_threads", str(threads), *args], get_config())
+    torch.manual_seed(seed)
+    np.random.seed(seed)
+    torch.set_num_threads(all_args.n_training_threads)
+
+    envs = make_train_env(all_args)
+    timings = {"collect": 0.0, "step": 0.0, "insert": 0.0}
+    with tempfile.TemporaryDirectory() as run_dir:
+        runner = EnvRunner({
+            "all_args": all_args,
+            "envs": envs,
+            "eval_envs": None,
+            "num_agents": all_args.num_agents,
+            "device": torch.device("cpu"),
+            "run_dir": Path(run_dir),
+        })
+        runner.warmup()
+        for step in range(steps):
+            start = time.perf_counter()
+            values, actions, action_log_probs, rnn_states, rnn_states_critic, actions_env = runner.collect(step)
+            collected = time.perf_counter()
+            obs, rewards, dones, infos = envs.step(actions_env)
+            stepped = time.perf_counter()
+            runner.insert((obs, rewards, dones, infos, values, actions, action_log_probs, rnn_states,
+                           rnn_states_critic))
+            inserted = time.perf_counter()
+
+            timings["collect"] += collected - start
+            timings["step"] += stepped - collected
+            timings["insert"] += inserted - stepped
+        runner.writer.close()
+    envs.close()
+    return {k: 1000 * v / steps for k, v in timings.items()}
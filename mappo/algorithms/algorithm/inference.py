@@ -0,0 +1,228 @@
+import io
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from mappo.algorithms.algorithm.numpy_actor import NumpyActor, accepts_obs_dim, export_npz, read_meta
+
+# backends evaluated by torch, the original float32 R_Actor and its post-training quantized variants
+TORCH_BACKENDS = ("torch", "float16", "int8")
+BACKENDS = ("numpy", *TORCH_BACKENDS)
+
+
+class TorchActor:
+    """
+    Deterministic inference wrapper of R_Actor with the same call convention as NumpyActor.
+    :param model: (R_Actor) actor network, possibly quantized.
+    :param meta: (dict) description of the actor, see actor_meta.
+    """
+
+    def __init__(self, model, meta):
+        self.model = model.eval()
+        self.meta = meta
+
+    def accepts(self, obs_dim):
+        """Whether the actor takes observations of a dimension, see accepts_obs_dim."""
+        return accepts_obs_dim(self.meta, obs_dim)
+
+    @property
+    def nbytes(self):
+        """Serialized size of the weights in bytes, which also covers packed quantized weights."""
+        import torch
+
+        buffer = io.BytesIO()
+        torch.save(self.model.state_dict(), buffer)
+        return buffer.getbuffer().nbytes
+
+    def __call__(self, obs):
+        """
+        Compute deterministic actions.
+        :param obs: (np.ndarray) observations of shape (N, obs_dim).
+
+        :return actions: (np.ndarray) raw float32 actions of shape (N, action_dim).
+        """
+        import torch
+
+        with torch.no_grad():
+            # a feed-forward actor does not read rnn states and masks
+            action, _, _ = self.model(np.asarray(obs, dtype=np.float32), None, None, deterministic=True)
+        return action.float().cpu().numpy()
+
+
+class CachedActor:
+    """
+    Bounded LRU cache in front of an actor, keyed on observations rounded to a fixed precision. Identical scenes,
+    e.g. parked vehicles without neighbours, are answered without evaluating the model.
+    :param model: (NumpyActor / TorchActor) the actor to cache.
+    :param maxsize: (int) maximum number of cached observations.
+    :param ttl: (float) seconds a cached action stays valid, None for no expiry.
+    :param precision: (int) number of decimals kept when rounding observations into keys.
+    """
+
+    def __init__(self, model, maxsize=4096, ttl=None, precision=3):
+        self.model = model
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.precision = precision
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def nbytes(self):
+        return self.model.nbytes
+
+    def accepts(self, obs_dim):
+        return self.model.accepts(obs_dim)
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def keys(self, obs):
+        """Rounded observation rows as hashable keys, -0.0 is folded into 0.0."""
+        rounded = np.round(np.asarray(obs, dtype=np.float32), self.precision) + np.float32(0.0)
+        return [row.tobytes() for row in rounded]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __call__(self, obs):
+        """
+        Compute deterministic actions, evaluating the model only on the rows missing from the cache.
+        :param obs: (np.ndarray) observations of shape (N, obs_dim).
+
+        :return actions: (np.ndarray) raw actions of shape (N, action_dim).
+        """
+        return self.evaluate(obs)[0]
+
+    def evaluate(self, obs):
+        """
+        Compute deterministic actions like __call__, and count the rows the model evaluated.
+        :param obs: (np.ndarray) observations of shape (N, obs_dim).
+
+        :return actions: (np.ndarray) raw actions of shape (N, action_dim).
+        :return evaluated: (int) number of rows missing from the cache, the model did not run if zero.
+        """
+        obs = np.asarray(obs, dtype=np.float32)
+        keys = self.keys(obs)
+        now = time.monotonic()
+        expiry = None if self.ttl is None else now - self.ttl
+
+        found = [None] * len(keys)
+        with self._lock:
+            for i, key in enumerate(keys):
+                entry = self._entries.get(key)
+                if entry is None:
+                    continue
+                if expiry is not None and entry[0] < expiry:
+                    del self._entries[key]
+                    continue
+                self._entries.move_to_end(key)
+                found[i] = entry[1]
+
+        missing = [i for i, action in enumerate(found) if action is None]
+        if missing:
+            computed = self.model(obs[missing])
+            for i, action in zip(missing, computed):
+                found[i] = action
+
+        with self._lock:
+            self.hits += len(keys) - len(missing)
+            self.misses += len(missing)
+            for i in missing:
+                self._entries[keys[i]] = (now, found[i])
+                self._entries.move_to_end(keys[i])
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+        return (np.stack(found) if found else np.zeros((0, 0), dtype=np.float32)), len(missing)
+
+
+def quantize_actor(model, backend):
+    """
+    Convert a float32 R_Actor for cheaper CPU inference.
+    :param model: (R_Actor) actor network with loaded weights.
+    :param backend: (str) "int8" for dynamic quantized nn.Linear layers, "float16" for half precision.
+
+    :return model: (R_Actor) converted actor network.
+    """
+    import torch
+    import torch.nn as nn
+
+    model.eval()
+    if backend == "int8":
+        # weights are stored in int8, activations are quantized on the fly per batch
+        return torch.ao.quantization.quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8)
+    elif backend == "float16":
+        model.half()
+        model.tpdv = dict(dtype=torch.float16, device=model.tpdv["device"])
+        return model
+    raise ValueError("unknown backend {!r}, expected one of {}".format(backend, ", ".join(TORCH_BACKENDS[1:])))
+
+
+def load_actor(path, backend="numpy"):
+    """
+    Load the actor as a function mapping a batch of observations to raw actions.
+    :param path: (str) path of actor.npz for the numpy backend, or actor.pt for every backend.
+    :param backend: (str) "numpy" evaluates without torch, "torch" uses the original R_Actor,
+                          "float16" and "int8" use a quantized R_Actor.
+
+    :return actor: (NumpyActor / TorchActor) the loaded actor.
+    """
+    if backend == "numpy":
+        return NumpyActor.load(path)
+    elif backend not in TORCH_BACKENDS:
+        raise ValueError("unknown backend {!r}, expected one of {}".format(backend, ", ".join(BACKENDS)))
+
+    import gymnasium as gym
+    import torch
+
+    from mappo.algorithms.algorithm.r_actor_critic import R_Actor
+    from mappo.config import get_config
+
+    # the actor is rebuilt from its description, the defaults of the other arguments do not affect inference
+    meta = read_meta(path)
+    args = get_config().parse_known_args([])[0]
+    args.use_entity_encoder = meta["encoder"] == "entity"
+    args.hidden_size = meta["hidden_size"]
+    args.layer_N = meta["layer_N"]
+    args.use_ReLU = meta["use_ReLU"]
+    args.use_feature_normalization = meta["use_feature_normalization"]
+    model = R_Actor(
+        args,
+        gym.spaces.Box(-np.inf, np.inf, [meta["obs_dim"]], dtype=np.float32),
+        gym.spaces.Box(0, 1.4, [meta["action_dim"]], dtype=np.float32),
+    )
+    model.load_state_dict(torch.load(path, weights_only=True))
+
+    if backend != "torch":
+        model = quantize_actor(model, backend)
+    return TorchActor(model, meta)
+
+
+def save_actor(actor, directory, meta):
+    """
+    Save an actor for training and inference: actor.pt with its weights, actor.npz with its weights and
+    description for the numpy backend, and actor.json with its description for the torch backends.
+    :param actor: (R_Actor) the actor.
+    :param directory: (str) destination directory.
+    :param meta: (dict) description of the actor, see actor_meta.
+    """
+    import torch
+
+    state_dict = actor.state_dict()
+    torch.save(state_dict, os.path.join(directory, "actor.pt"))
+    export_npz(state_dict, os.path.join(directory, "actor.npz"), meta)
+    with open(os.path.join(directory, "actor.json"), "w") as f:
+        json.dump(meta, f, indent=2)
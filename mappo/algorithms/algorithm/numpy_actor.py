@@ -0,0 +1,223 @@
+import json
+
+import numpy as np
+
+# the observation layout of EntityBase, see mappo.algorithms.utils.entity, repeated here to stay torch-free
+OWN_DIM = 5
+VEHICLE_DIM = 8
+HUMAN_DIM = 4
+
+# key of the description of the actor in an exported .npz, see actor_meta
+META_KEY = "__meta__"
+
+# description of the actors exported before it was stored, an MLPBase over the 77 floats of an observation
+DEFAULT_META = {
+    "encoder": "mlp",
+    "obs_dim": 77,
+    "action_dim": 6,
+    "num_humans": 6,
+    "hidden_size": 128,
+    "layer_N": 2,
+    "use_ReLU": True,
+    "use_feature_normalization": True,
+}
+
+
+def _layer_norm(x, weight, bias, eps=1e-5):
+    mean = x.mean(axis=-1, keepdims=True)
+    var = x.var(axis=-1, keepdims=True)
+    return (x - mean) / np.sqrt(var + eps) * weight + bias
+
+
+def _relu(x):
+    return np.maximum(x, 0.0, out=x)
+
+
+def _tanh(x):
+    return np.tanh(x, out=x)
+
+
+def actor_meta(args, obs_dim, action_dim):
+    """
+    Description of an actor, from which it is rebuilt for inference, see NumpyActor and load_actor.
+    :param args: (argparse.Namespace) arguments the actor was built with.
+    :param obs_dim: (int) dimension of the observations of training.
+    :param action_dim: (int) dimension of the actions.
+
+    :return meta: (dict) the encoder, "mlp" or "entity", the observation layout and the network options.
+    """
+    return {
+        "encoder": "entity" if args.use_entity_encoder else "mlp",
+        "obs_dim": int(obs_dim),
+        "action_dim": int(action_dim),
+        "num_humans": DEFAULT_META["num_humans"],
+        "hidden_size": args.hidden_size,
+        "layer_N": args.layer_N,
+        "use_ReLU": args.use_ReLU,
+        "use_feature_normalization": args.use_feature_normalization,
+    }
+
+
+def accepts_obs_dim(meta, obs_dim):
+    """
+    Whether an actor takes observations of a dimension, an entity encoder takes any number of vehicle slots.
+    :param meta: (dict) description of the actor, see actor_meta.
+    :param obs_dim: (int) dimension of the observations.
+    """
+    if meta["encoder"] == "entity":
+        vehicles = obs_dim - OWN_DIM - HUMAN_DIM * meta["num_humans"]
+        return vehicles >= 0 and vehicles % VEHICLE_DIM == 0
+    return obs_dim == meta["obs_dim"]
+
+
+class NumpyActor:
+    """
+    Torch-free actor for deterministic inference. Mirrors the forward pass of R_Actor with a DiagGaussian head and
+    an MLPBase, i.e. feature LayerNorm and (Linear, activation, LayerNorm) blocks, or an EntityBase, i.e. such
+    blocks per entity type, mean pooled over the present vehicles and humans.
+    :param state_dict: (dict) actor weights as numpy arrays, keyed like R_Actor.state_dict().
+    :param use_ReLU: (bool) whether the hidden layers use ReLU, otherwise Tanh.
+    :param meta: (dict) description of the actor, see actor_meta, the legacy MLPBase actor if None.
+    """
+
+    def __init__(self, state_dict, use_ReLU=True, meta=None):
+        self.meta = dict(DEFAULT_META, use_ReLU=use_ReLU) if meta is None else meta
+        self.activation = _relu if self.meta["use_ReLU"] else _tanh
+        self.arrays = []
+
+        def get(key):
+            array = np.ascontiguousarray(state_dict[key], dtype=np.float32)
+            self.arrays.append(array)
+            return array
+
+        def norm(prefix):
+            return (get(prefix + ".weight"), get(prefix + ".bias")) if prefix + ".weight" in state_dict else None
+
+        def mlp(prefix):
+            # weights are stored transposed so that a batch is evaluated as x @ w + b
+            prefixes = [prefix + ".fc1"]
+            i = 0
+            while "{}.fc2.{}.0.weight".format(prefix, i) in state_dict:
+                prefixes.append("{}.fc2.{}".format(prefix, i))
+                i += 1
+            return [(get(p + ".0.weight").T.copy(), get(p + ".0.bias"), get(p + ".2.weight"), get(p + ".2.bias"))
+                    for p in prefixes]
+
+        if self.meta["encoder"] == "entity":
+            self.own = (norm("base.own_norm"), mlp("base.own"))
+            self.vehicle = (norm("base.vehicle_norm"), mlp("base.vehicle"))
+            self.human = (norm("base.human_norm"), mlp("base.human"))
+        else:
+            self.feature_norm = norm("base.feature_norm")
+        self.layers = mlp("base.mlp")
+
+        self.mean_weight = get("act.action_out.fc_mean.weight").T.copy()
+        self.mean_bias = get("act.action_out.fc_mean.bias")
+
+    @classmethod
+    def load(cls, path, use_ReLU=True):
+        """
+        Load actor weights from an exported .npz file, or from a torch actor.pt as a fallback.
+        :param path: (str) path of actor.npz or actor.pt.
+        :param use_ReLU: (bool) whether the hidden layers use ReLU, otherwise Tanh, for files without description.
+
+        :return actor: (NumpyActor) loaded actor.
+        """
+        if str(path).endswith(".npz"):
+            with np.load(path) as data:
+                state_dict = dict(data)
+            meta = state_dict.pop(META_KEY, None)
+            meta = None if meta is None else json.loads(str(meta))
+        else:
+            # only the legacy format needs torch, prefer exporting to .npz once
+            import torch
+            state_dict = {k: v.cpu().numpy() for k, v in torch.load(path, map_location="cpu",
+                                                                    weights_only=True).items()}
+            meta = read_meta(path)
+        return cls(state_dict, use_ReLU, meta)
+
+    @property
+    def nbytes(self):
+        """Memory held by the weights in bytes."""
+        return sum(a.nbytes for a in self.arrays)
+
+    def accepts(self, obs_dim):
+        """Whether the actor takes observations of a dimension, see accepts_obs_dim."""
+        return accepts_obs_dim(self.meta, obs_dim)
+
+    def _mlp(self, x, layers):
+        for weight, bias, norm_weight, norm_bias in layers:
+            x = _layer_norm(self.activation(x @ weight + bias), norm_weight, norm_bias)
+        return x
+
+    def _pool(self, entities, encoder):
+        """mean of the features of the present entities of each observation, zeros without entities"""
+        norm, layers = encoder
+        present = (entities != 0).any(axis=-1)
+        x = entities[present]
+        if norm is not None:
+            x = _layer_norm(x, *norm)
+        features = np.zeros((*present.shape, layers[-1][1].shape[0]), dtype=np.float32)
+        features[present] = self._mlp(x, layers)
+        return features.sum(axis=1) / np.maximum(present.sum(axis=1), 1)[:, None]
+
+    def _entity_features(self, x):
+        n = x.shape[0]
+        split = x.shape[-1] - HUMAN_DIM * self.meta["num_humans"]
+        own = x[:, :OWN_DIM]
+        if self.own[0] is not None:
+            own = _layer_norm(own, *self.own[0])
+        return np.concatenate([
+            self._mlp(own, self.own[1]),
+            self._pool(x[:, OWN_DIM:split].reshape(n, -1, VEHICLE_DIM), self.vehicle),
+            self._pool(x[:, split:].reshape(n, -1, HUMAN_DIM), self.human),
+        ], axis=-1)
+
+    def __call__(self, obs):
+        """
+        Compute deterministic actions, i.e. the mean of the Gaussian head.
+        :param obs: (np.ndarray) observations of shape (N, obs_dim) or (obs_dim,).
+
+        :return actions: (np.ndarray) raw actions of shape (N, action_dim) or (action_dim,).
+        """
+        x = np.asarray(obs, dtype=np.float32)
+        if self.meta["encoder"] == "entity":
+            x = self._entity_features(x.reshape(-1, x.shape[-1])).reshape(*x.shape[:-1], -1)
+        elif self.feature_norm is not None:
+            x = _layer_norm(x, *self.feature_norm)
+        x = self._mlp(x, self.layers)
+        return x @ self.mean_weight + self.mean_bias
+
+
+def read_meta(path):
+    """
+    Description of a saved actor, see save_actor, stored in the .npz or next to the file as .json.
+    :param path: (str) path of actor.npz or actor.pt.
+
+    :return meta: (dict) the description, DEFAULT_META for actors saved without it.
+    """
+    path = str(path)
+    if path.endswith(".npz"):
+        with np.load(path) as data:
+            if META_KEY in data:
+                return json.loads(str(data[META_KEY]))
+    else:
+        try:
+            with open(path.rsplit(".", 1)[0] + ".json") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            pass
+    return dict(DEFAULT_META)
+
+
+def export_npz(state_dict, path, meta=None):
+    """
+    Save actor weights in the .npz format read by NumpyActor.
+    :param state_dict: (dict) actor state dict, tensors or numpy arrays.
+    :param path: (str) destination file path.
+    :param meta: (dict) description of the actor, see actor_meta.
+    """
+    arrays = {k: v.detach().cpu().numpy() if hasattr(v, "detach") else np.asarray(v) for k, v in state_dict.items()}
+    if meta is not None:
+        arrays[META_KEY] = np.array(json.dumps(meta))
+    np.savez(path, **arrays)
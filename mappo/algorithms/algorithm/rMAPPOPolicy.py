@@ -26,6 +26,13 @@ class RMAPPOPolicy:
         self.share_obs_space = cent_obs_space
         self.act_space = act_space
 
+        # the centralized observations of the agents of a thread are identical, and so are the values of a
+        # feed-forward critic, with a shared critic cent_obs holds one row per group of critic_group agents
+        self.critic_group = args.num_agents if args.use_shared_critic else 1
+        assert self.critic_group == 1 or (args.use_centralized_V and not (args.use_recurrent_policy or
+                                                                          args.use_naive_recurrent_policy)), (
+            "use_shared_critic requires use_centralized_V and a feed-forward policy")
+
         self.actor = R_Actor(args, self.obs_space, self.act_space, self.device)
         self.critic = R_Critic(args, self.share_obs_space, self.device)
 
@@ -50,7 +57,7 @@ class RMAPPOPolicy:
                     deterministic=False):
         """
         Compute actions and value function predictions for the given inputs.
-        :param cent_obs: (np.ndarray) centralized input to the critic.
+        :param cent_obs: (np.ndarray) centralized input to the critic, see critic_values.
         :param obs: (np.ndarray) local agent inputs to the actor.
         :param rnn_states_actor: (np.ndarray) if actor is RNN, RNN states for actor.
         :param rnn_states_critic: (np.ndarray) if critic is RNN, RNN states for critic.
@@ -71,26 +78,45 @@ class RMAPPOPolicy:
                                                                  available_actions,
                                                                  deterministic)
 
-        values, rnn_states_critic = self.critic(cent_obs, rnn_states_critic, masks)
+        values, rnn_states_critic = self.critic_values(cent_obs, rnn_states_critic, masks)
         return values, actions, action_log_probs, rnn_states_actor, rnn_states_critic
 
     def get_values(self, cent_obs, rnn_states_critic, masks):
         """
         Get value function predictions.
-        :param cent_obs: (np.ndarray) centralized input to the critic.
+        :param cent_obs: (np.ndarray) centralized input to the critic, see critic_values.
         :param rnn_states_critic: (np.ndarray) if critic is RNN, RNN states for critic.
         :param masks: (np.ndarray) denotes points at which RNN states should be reset.
 
         :return values: (torch.Tensor) value function predictions.
         """
-        values, _ = self.critic(cent_obs, rnn_states_critic, masks)
+        values, _ = self.critic_values(cent_obs, rnn_states_critic, masks)
         return values
 
+    def critic_values(self, cent_obs, rnn_states_critic, masks, critic=None):
+        """
+        Evaluate the critic, once per group of agents with a shared critic.
+        :param cent_obs: (np.ndarray / torch.Tensor) centralized input to the critic, one row per group of
+                         critic_group agents.
+        :param rnn_states_critic: (np.ndarray / torch.Tensor) if critic is RNN, RNN states for critic.
+        :param masks: (np.ndarray / torch.Tensor) denotes points at which RNN states should be reset.
+        :param critic: (nn.Module) the critic to evaluate, e.g. a compiled one, self.critic if None.
+
+        :return values: (torch.Tensor) value function predictions, one row per agent.
+        :return rnn_states_critic: (torch.Tensor) updated critic network RNN states.
+        """
+        critic = self.critic if critic is None else critic
+        # a feed-forward critic passes the rnn states through, so they keep one row per agent
+        values, rnn_states_critic = critic(cent_obs, rnn_states_critic, masks)
+        if self.critic_group > 1:
+            values = values.repeat_interleave(self.critic_group, dim=0)
+        return values, rnn_states_critic
+
     def evaluate_actions(self, cent_obs, obs, rnn_states_actor, rnn_states_critic, action, masks,
                          available_actions=None, active_masks=None):
         """
         Get action logprobs / entropy and value function predictions for actor update.
-        :param cent_obs: (np.ndarray) centralized input to the critic.
+        :param cent_obs: (np.ndarray) centralized input to the critic, see critic_values.
         :param obs: (np.ndarray) local agent inputs to the actor.
         :param rnn_states_actor: (np.ndarray) if actor is RNN, RNN states for actor.
         :param rnn_states_critic: (np.ndarray) if critic is RNN, RNN states for critic.
@@ -111,7 +137,7 @@ class RMAPPOPolicy:
                                                                      available_actions,
                                                                      active_masks)
 
-        values, _ = self.critic(cent_obs, rnn_states_critic, masks)
+        values, _ = self.critic_values(cent_obs, rnn_states_critic, masks)
         return values, action_log_probs, dist_entropy
 
     def act(self, obs, rnn_states_actor, masks, available_actions=None, deterministic=False):
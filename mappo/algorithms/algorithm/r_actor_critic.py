@@ -3,6 +3,7 @@ import torch.nn as nn
 
 from mappo.algorithms.utils.act import ACTLayer
 from mappo.algorithms.utils.cnn import CNNBase
+from mappo.algorithms.utils.entity import EntityBase
 from mappo.algorithms.utils.mlp import MLPBase
 from mappo.algorithms.utils.popart import PopArt
 from mappo.algorithms.utils.rnn import RNNLayer
@@ -32,7 +33,10 @@ class R_Actor(nn.Module):
         self.tpdv = dict(dtype=torch.float32, device=device)
 
         obs_shape = get_shape_from_obs_space(obs_space)
-        base = CNNBase if len(obs_shape) == 3 else MLPBase
+        if len(obs_shape) == 3:
+            base = CNNBase
+        else:
+            base = EntityBase if args.use_entity_encoder else MLPBase
         self.base = base(args, obs_shape)
 
         if self._use_naive_recurrent_policy or self._use_recurrent_policy:
@@ -46,7 +50,7 @@ class R_Actor(nn.Module):
         """
         Compute actions from the given inputs.
         :param obs: (np.ndarray / torch.Tensor) observation inputs into network.
-        :param rnn_states: (np.ndarray / torch.Tensor) if RNN network, hidden states for RNN.
+        :param rnn_states: (np.ndarray / torch.Tensor) if RNN network, hidden states for RNN, otherwise unused.
         :param masks: (np.ndarray / torch.Tensor) mask tensor denoting if hidden states should be reinitialized to zeros.
         :param available_actions: (np.ndarray / torch.Tensor) denotes which actions are available to agent
                                                               (if None, all actions available)
@@ -57,14 +61,15 @@ class R_Actor(nn.Module):
         :return rnn_states: (torch.Tensor) updated RNN hidden states.
         """
         obs = check(obs).to(**self.tpdv)
-        rnn_states = check(rnn_states).to(**self.tpdv)
-        masks = check(masks).to(**self.tpdv)
         if available_actions is not None:
             available_actions = check(available_actions).to(**self.tpdv)
 
         actor_features = self.base(obs)
 
+        # a feed-forward actor returns the rnn states it is given, they may be None
         if self._use_naive_recurrent_policy or self._use_recurrent_policy:
+            rnn_states = check(rnn_states).to(**self.tpdv)
+            masks = check(masks).to(**self.tpdv)
             actor_features, rnn_states = self.rnn(actor_features, rnn_states, masks)
 
         actions, action_log_probs = self.act(actor_features, available_actions, deterministic)
@@ -86,9 +91,7 @@ class R_Actor(nn.Module):
         :return dist_entropy: (torch.Tensor) action distribution entropy for the given inputs.
         """
         obs = check(obs).to(**self.tpdv)
-        rnn_states = check(rnn_states).to(**self.tpdv)
         action = check(action).to(**self.tpdv)
-        masks = check(masks).to(**self.tpdv)
         if available_actions is not None:
             available_actions = check(available_actions).to(**self.tpdv)
 
@@ -98,6 +101,8 @@ class R_Actor(nn.Module):
         actor_features = self.base(obs)
 
         if self._use_naive_recurrent_policy or self._use_recurrent_policy:
+            rnn_states = check(rnn_states).to(**self.tpdv)
+            masks = check(masks).to(**self.tpdv)
             actor_features, rnn_states = self.rnn(actor_features, rnn_states, masks)
 
         action_log_probs, dist_entropy = self.act.evaluate_actions(actor_features,
@@ -150,18 +155,19 @@ class R_Critic(nn.Module):
         """
         Compute actions from the given inputs.
         :param cent_obs: (np.ndarray / torch.Tensor) observation inputs into network.
-        :param rnn_states: (np.ndarray / torch.Tensor) if RNN network, hidden states for RNN.
+        :param rnn_states: (np.ndarray / torch.Tensor) if RNN network, hidden states for RNN, otherwise unused.
         :param masks: (np.ndarray / torch.Tensor) mask tensor denoting if RNN states should be reinitialized to zeros.
 
         :return values: (torch.Tensor) value function predictions.
         :return rnn_states: (torch.Tensor) updated RNN hidden states.
         """
         cent_obs = check(cent_obs).to(**self.tpdv)
-        rnn_states = check(rnn_states).to(**self.tpdv)
-        masks = check(masks).to(**self.tpdv)
 
         critic_features = self.base(cent_obs)
+        # a feed-forward critic returns the rnn states it is given, they may be None
         if self._use_naive_recurrent_policy or self._use_recurrent_policy:
+            rnn_states = check(rnn_states).to(**self.tpdv)
+            masks = check(masks).to(**self.tpdv)
             critic_features, rnn_states = self.rnn(critic_features, rnn_states, masks)
         values = self.v_out(critic_features)
 
@@ -1,9 +1,10 @@
-import numpy as np
 import torch
 import torch.nn as nn
 
 from mappo.algorithms.utils.util import check
-from mappo.utils.util import get_gard_norm, huber_loss, mse_loss
+from mappo.utils.distributed import all_reduce_gradients
+from mappo.utils.profiler import PhaseTimer
+from mappo.utils.util import get_gard_norm, huber_loss, masked_mean_std, mse_loss
 from mappo.utils.valuenorm import ValueNorm
 
 
@@ -38,10 +39,19 @@ class RMAPPO:
         self._use_valuenorm = args.use_valuenorm
         self._use_value_active_masks = args.use_value_active_masks
         self._use_policy_active_masks = args.use_policy_active_masks
+        self._use_bf16 = args.use_bf16
 
         assert (self._use_popart and self._use_valuenorm) == False, (
             "self._use_popart and self._use_valuenorm can not be set True simultaneously")
 
+        # the compiled functions share the parameters of the policy
+        if args.use_compile:
+            self._policy_loss = torch.compile(self.cal_policy_loss)
+            self._critic = torch.compile(self.policy.critic)
+        else:
+            self._policy_loss = self.cal_policy_loss
+            self._critic = self.policy.critic
+
         if self._use_popart:
             self.value_normalizer = self.policy.critic.v_out
         elif self._use_valuenorm:
@@ -49,6 +59,16 @@ class RMAPPO:
         else:
             self.value_normalizer = None
 
+        # times the forward, backward and optimizer phases of the updates with use_timing, shared with the runner
+        self.timer = PhaseTimer(args.use_timing, device)
+
+    def autocast(self):
+        """
+        Context of the network evaluations, bfloat16 autocast with use_bf16, otherwise it does nothing.
+        The gradients are computed in the precision of the forward pass, so backward can be outside of it.
+        """
+        return torch.autocast(self.device.type, dtype=torch.bfloat16, enabled=self._use_bf16)
+
     def cal_value_loss(self, values, value_preds_batch, return_batch, active_masks_batch):
         """
         Calculate value function loss.
@@ -62,9 +82,9 @@ class RMAPPO:
         value_pred_clipped = value_preds_batch + (values - value_preds_batch).clamp(-self.clip_param,
                                                                                     self.clip_param)
         if self._use_popart or self._use_valuenorm:
-            self.value_normalizer.update(return_batch)
-            error_clipped = self.value_normalizer.normalize(return_batch) - value_pred_clipped
-            error_original = self.value_normalizer.normalize(return_batch) - values
+            normalized_returns = self.value_normalizer.update_and_normalize(return_batch)
+            error_clipped = normalized_returns - value_pred_clipped
+            error_original = normalized_returns - values
         else:
             error_clipped = return_batch - value_pred_clipped
             error_original = return_batch - values
@@ -88,39 +108,30 @@ class RMAPPO:
 
         return value_loss
 
-    def ppo_update(self, sample, update_actor=True):
+    def cal_policy_loss(self, obs_batch, rnn_states_batch, actions_batch, masks_batch, available_actions_batch,
+                        active_masks_batch, old_action_log_probs_batch, adv_targ):
         """
-        Update actor and critic networks.
-        :param sample: (Tuple) contains data batch with which to update networks.
-        :param update_actor: (bool) whether to update actor network.
+        Evaluate the actor and calculate the clipped surrogate loss.
+        :param obs_batch: (torch.Tensor) local agent inputs to the actor.
+        :param rnn_states_batch: (torch.Tensor) if actor is RNN, RNN states for actor.
+        :param actions_batch: (torch.Tensor) actions whose log probabilities and entropy to compute.
+        :param masks_batch: (torch.Tensor) denotes points at which RNN states should be reset.
+        :param available_actions_batch: (torch.Tensor) denotes which actions are available to agent
+                                        (if None, all actions available)
+        :param active_masks_batch: (torch.Tensor) denotes if agent is active or dead at a given timesep.
+        :param old_action_log_probs_batch: (torch.Tensor) log probabilities of the actions when collected.
+        :param adv_targ: (torch.Tensor) advantage estimates.
 
-        :return value_loss: (torch.Tensor) value function loss.
-        :return critic_grad_norm: (torch.Tensor) gradient norm from critic up9date.
         :return policy_loss: (torch.Tensor) actor(policy) loss value.
         :return dist_entropy: (torch.Tensor) action entropies.
-        :return actor_grad_norm: (torch.Tensor) gradient norm from actor update.
         :return imp_weights: (torch.Tensor) importance sampling weights.
         """
-        share_obs_batch, obs_batch, rnn_states_batch, rnn_states_critic_batch, actions_batch, \
-            value_preds_batch, return_batch, masks_batch, active_masks_batch, old_action_log_probs_batch, \
-            adv_targ, available_actions_batch = sample
-
-        old_action_log_probs_batch = check(old_action_log_probs_batch).to(**self.tpdv)
-        adv_targ = check(adv_targ).to(**self.tpdv)
-        value_preds_batch = check(value_preds_batch).to(**self.tpdv)
-        return_batch = check(return_batch).to(**self.tpdv)
-        active_masks_batch = check(active_masks_batch).to(**self.tpdv)
-
-        # Reshape to do in a single forward pass for all steps
-        values, action_log_probs, dist_entropy = self.policy.evaluate_actions(share_obs_batch,
-                                                                              obs_batch,
-                                                                              rnn_states_batch,
-                                                                              rnn_states_critic_batch,
-                                                                              actions_batch,
-                                                                              masks_batch,
-                                                                              available_actions_batch,
-                                                                              active_masks_batch)
-        # actor update
+        action_log_probs, dist_entropy = self.policy.actor.evaluate_actions(obs_batch,
+                                                                            rnn_states_batch,
+                                                                            actions_batch,
+                                                                            masks_batch,
+                                                                            available_actions_batch,
+                                                                            active_masks_batch)
         imp_weights = torch.exp(action_log_probs - old_action_log_probs_batch)
 
         surr1 = imp_weights * adv_targ
@@ -133,33 +144,75 @@ class RMAPPO:
         else:
             policy_action_loss = -torch.sum(torch.min(surr1, surr2), dim=-1, keepdim=True).mean()
 
-        policy_loss = policy_action_loss
+        return policy_action_loss, dist_entropy, imp_weights
+
+    def ppo_update(self, sample, update_actor=True):
+        """
+        Update actor and critic networks.
+        :param sample: (Tuple) contains data batch with which to update networks.
+        :param update_actor: (bool) whether to update actor network.
+
+        :return value_loss: (torch.Tensor) value function loss.
+        :return critic_grad_norm: (torch.Tensor) gradient norm from critic up9date.
+        :return policy_loss: (torch.Tensor) actor(policy) loss value.
+        :return dist_entropy: (torch.Tensor) action entropies.
+        :return actor_grad_norm: (torch.Tensor) gradient norm from actor update.
+        :return imp_weights: (torch.Tensor) importance sampling weights.
+        """
+        # every field is converted once, the compiled functions only see tensors
+        share_obs_batch, obs_batch, rnn_states_batch, rnn_states_critic_batch, actions_batch, \
+            value_preds_batch, return_batch, masks_batch, active_masks_batch, old_action_log_probs_batch, \
+            adv_targ, available_actions_batch = (None if x is None else check(x).to(**self.tpdv) for x in sample)
+
+        # Reshape to do in a single forward pass for all steps
+        with self.timer.phase("forward"), self.autocast():
+            policy_loss, dist_entropy, imp_weights = self._policy_loss(obs_batch,
+                                                                       rnn_states_batch,
+                                                                       actions_batch,
+                                                                       masks_batch,
+                                                                       available_actions_batch,
+                                                                       active_masks_batch,
+                                                                       old_action_log_probs_batch,
+                                                                       adv_targ)
+            values, _ = self.policy.critic_values(share_obs_batch, rnn_states_critic_batch, masks_batch,
+                                                  self._critic)
+        # the value loss and the value normalization are computed in float32
+        values = values.float()
 
-        self.policy.actor_optimizer.zero_grad()
+        # actor update
+        with self.timer.phase("backward"):
+            self.policy.actor_optimizer.zero_grad()
 
-        if update_actor:
-            (policy_loss - dist_entropy * self.entropy_coef).backward()
+            if update_actor:
+                (policy_loss - dist_entropy * self.entropy_coef).backward()
+                # with distributed training, the gradients of the shards of all ranks are averaged before clipping
+                all_reduce_gradients(self.policy.actor.parameters())
 
-        if self._use_max_grad_norm:
-            actor_grad_norm = nn.utils.clip_grad_norm_(self.policy.actor.parameters(), self.max_grad_norm)
-        else:
-            actor_grad_norm = get_gard_norm(self.policy.actor.parameters())
+        with self.timer.phase("optimizer"):
+            if self._use_max_grad_norm:
+                actor_grad_norm = nn.utils.clip_grad_norm_(self.policy.actor.parameters(), self.max_grad_norm)
+            else:
+                actor_grad_norm = get_gard_norm(self.policy.actor.parameters())
 
-        self.policy.actor_optimizer.step()
+            self.policy.actor_optimizer.step()
 
         # critic update
-        value_loss = self.cal_value_loss(values, value_preds_batch, return_batch, active_masks_batch)
+        with self.timer.phase("forward"):
+            value_loss = self.cal_value_loss(values, value_preds_batch, return_batch, active_masks_batch)
 
-        self.policy.critic_optimizer.zero_grad()
+        with self.timer.phase("backward"):
+            self.policy.critic_optimizer.zero_grad()
 
-        (value_loss * self.value_loss_coef).backward()
+            (value_loss * self.value_loss_coef).backward()
+            all_reduce_gradients(self.policy.critic.parameters())
 
-        if self._use_max_grad_norm:
-            critic_grad_norm = nn.utils.clip_grad_norm_(self.policy.critic.parameters(), self.max_grad_norm)
-        else:
-            critic_grad_norm = get_gard_norm(self.policy.critic.parameters())
+        with self.timer.phase("optimizer"):
+            if self._use_max_grad_norm:
+                critic_grad_norm = nn.utils.clip_grad_norm_(self.policy.critic.parameters(), self.max_grad_norm)
+            else:
+                critic_grad_norm = get_gard_norm(self.policy.critic.parameters())
 
-        self.policy.critic_optimizer.step()
+            self.policy.critic_optimizer.step()
 
         return value_loss, critic_grad_norm, policy_loss, dist_entropy, actor_grad_norm, imp_weights
 
@@ -175,20 +228,13 @@ class RMAPPO:
             advantages = buffer.returns[:-1] - self.value_normalizer.denormalize(buffer.value_preds[:-1])
         else:
             advantages = buffer.returns[:-1] - buffer.value_preds[:-1]
-        advantages_copy = advantages.copy()
-        advantages_copy[buffer.active_masks[:-1] == 0.0] = np.nan
-        mean_advantages = np.nanmean(advantages_copy)
-        std_advantages = np.nanstd(advantages_copy)
+        # statistics of the active steps only
+        mean_advantages, std_advantages = masked_mean_std(advantages, buffer.active_masks[:-1])
         advantages = (advantages - mean_advantages) / (std_advantages + 1e-5)
 
-        train_info = {}
-
-        train_info['value_loss'] = 0
-        train_info['policy_loss'] = 0
-        train_info['dist_entropy'] = 0
-        train_info['actor_grad_norm'] = 0
-        train_info['critic_grad_norm'] = 0
-        train_info['ratio'] = 0
+        # the statistics stay on the device until the end of the update, so the minibatches do not synchronize
+        train_info = {key: torch.zeros((), **self.tpdv) for key in
+                      ('value_loss', 'policy_loss', 'dist_entropy', 'actor_grad_norm', 'critic_grad_norm', 'ratio')}
 
         for _ in range(self.ppo_epoch):
             if self._use_recurrent_policy:
@@ -202,17 +248,17 @@ class RMAPPO:
                 value_loss, critic_grad_norm, policy_loss, dist_entropy, actor_grad_norm, imp_weights \
                     = self.ppo_update(sample, update_actor)
 
-                train_info['value_loss'] += value_loss.item()
-                train_info['policy_loss'] += policy_loss.item()
-                train_info['dist_entropy'] += dist_entropy.item()
+                train_info['value_loss'] += value_loss.detach()
+                train_info['policy_loss'] += policy_loss.detach()
+                train_info['dist_entropy'] += dist_entropy.detach()
                 train_info['actor_grad_norm'] += actor_grad_norm
                 train_info['critic_grad_norm'] += critic_grad_norm
-                train_info['ratio'] += imp_weights.mean()
+                train_info['ratio'] += imp_weights.detach().mean()
 
         num_updates = self.ppo_epoch * self.num_mini_batch
 
-        for k in train_info.keys():
-            train_info[k] /= num_updates
+        values = (torch.stack(list(train_info.values())) / num_updates).tolist()
+        train_info = dict(zip(train_info.keys(), values))
 
         return train_info
 
@@ -81,15 +81,10 @@ class ACTLayer(nn.Module):
             actions = torch.cat(actions, -1)
             action_log_probs = torch.cat(action_log_probs, -1)
         elif self.continuous_action:
-            # actions = []
-            # action_log_probs = []
-            action_logit = self.action_out(x)
-            actions = action_logit.mode() if deterministic else action_logit.sample()
-            action_log_probs = action_logit.log_probs(actions)
-            # actions.append(action.float())
-            # action_log_probs.append(action_log_prob)
-            # actions = torch.cat(actions, -1)
-            # action_log_probs = torch.sum(torch.cat(action_log_probs, -1), -1, keepdim=True)
+            # raw tensors of the Gaussian, no distribution object is built
+            action_mean = self.action_out.mode(x)
+            actions = action_mean if deterministic else self.action_out.sample(action_mean)
+            action_log_probs = self.action_out.log_probs(action_mean, actions)
         else:
             action_logits = self.action_out(x, available_actions)
             actions = action_logits.mode() if deterministic else action_logits.sample()
@@ -168,25 +163,17 @@ class ACTLayer(nn.Module):
             dist_entropy = torch.tensor(dist_entropy).mean()
 
         elif self.continuous_action:
-            # a, b = action.split((2, 1), -1)
-            # b = b.long()
-            # action = [a, b]
-            action_log_probs = []
-            dist_entropy = []
-            # for action_out, act in zip(self.action_outs, action):
-            action_logit = self.action_out(x)
-            action_log_probs.append(action_logit.log_probs(action))
+            action_mean = self.action_out.mode(x)
+            action_log_probs = self.action_out.log_probs(action_mean, action)
+            # the entropy does not depend on the input, it is a broadcast view of the log std
+            entropy = self.action_out.entropy(action_mean)
             if active_masks is not None:
-                if len(action_logit.entropy().shape) == len(active_masks.shape):
-                    dist_entropy.append((action_logit.entropy() * active_masks).sum() / active_masks.sum())
+                if len(entropy.shape) == len(active_masks.shape):
+                    dist_entropy = (entropy * active_masks).sum() / active_masks.sum()
                 else:
-                    dist_entropy.append(
-                        (action_logit.entropy() * active_masks.squeeze(-1)).sum() / active_masks.sum())
+                    dist_entropy = (entropy * active_masks.squeeze(-1)).sum() / active_masks.sum()
             else:
-                dist_entropy.append(action_logit.entropy().mean())
-
-            action_log_probs = torch.sum(torch.cat(action_log_probs, -1), -1, keepdim=True)
-            dist_entropy = dist_entropy[0]  # / 2.0 + dist_entropy[1] / 0.98  # ! doesn't make sense
+                dist_entropy = entropy.mean()
 
         else:
             action_logits = self.action_out(x, available_actions)
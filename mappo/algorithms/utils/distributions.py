@@ -1,3 +1,5 @@
+import math
+
 import torch
 import torch.nn as nn
 
@@ -21,6 +23,9 @@ class FixedCategorical(torch.distributions.Categorical):
         return self.probs.argmax(dim=-1, keepdim=True)
 
 
+LOG_SQRT_2PI = math.log(math.sqrt(2 * math.pi))
+
+
 # Normal
 class FixedNormal(torch.distributions.Normal):
     def log_probs(self, actions):
@@ -76,14 +81,29 @@ class DiagGaussian(nn.Module):
 
     def forward(self, x):
         action_mean = self.fc_mean(x)
+        return FixedNormal(action_mean, self.log_std.exp().expand_as(action_mean))
+
+    # the functions below work on raw tensors without building a FixedNormal, see ACTLayer
+
+    @property
+    def log_std(self):
+        """log standard deviation of shape (num_outputs,), a view of the AddBias parameter kept for checkpoints"""
+        return self.logstd._bias.view(-1)
+
+    def mode(self, x):
+        # float32 under autocast as well, so the log probs and their reductions keep full precision
+        return self.fc_mean(x).float()
+
+    def sample(self, action_mean):
+        return torch.normal(action_mean, self.log_std.exp().expand_as(action_mean))
 
-        #  An ugly hack for my KFAC implementation.
-        zeros = torch.zeros(action_mean.size())
-        if x.is_cuda:
-            zeros = zeros.cuda()
+    def log_probs(self, action_mean, actions):
+        log_std = self.log_std
+        return (-((actions - action_mean) ** 2) / (2 * torch.exp(2 * log_std)) - log_std - LOG_SQRT_2PI).sum(
+            -1, keepdim=True)
 
-        action_logstd = self.logstd(zeros)
-        return FixedNormal(action_mean, action_logstd.exp())
+    def entropy(self, action_mean):
+        return (0.5 + LOG_SQRT_2PI + self.log_std).expand_as(action_mean)
 
 
 class Bernoulli(nn.Module):
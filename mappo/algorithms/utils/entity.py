@@ -0,0 +1,96 @@
+import torch
+import torch.nn as nn
+
+from mappo.algorithms.utils.mlp import MLPLayer
+
+# the observation of a vehicle, see environ.core.Environ: its own slot, a slot per other vehicle, a slot per human
+# offline vehicles and humans are zero filled slots
+OWN_DIM = 5
+VEHICLE_DIM = 8
+HUMAN_DIM = 4
+
+
+def split_entities(obs, num_humans):
+    """
+    Split flat observations into their entities, and pack the present ones of all observations together.
+    :param obs: (torch.Tensor) observations of shape (N, 5 + 8 * other vehicles + 4 * num_humans).
+    :param num_humans: (int) number of human slots, the remaining slots are vehicles.
+
+    :return own: (torch.Tensor) own slots of shape (N, 5).
+    :return vehicles: (torch.Tensor) present vehicles of shape (V, 8).
+    :return vehicle_index: (torch.Tensor) observation of each present vehicle, of shape (V,).
+    :return humans: (torch.Tensor) present humans of shape (H, 4).
+    :return human_index: (torch.Tensor) observation of each present human, of shape (H,).
+    """
+    n = obs.shape[0]
+    num_vehicles, remainder = divmod(obs.shape[-1] - OWN_DIM - HUMAN_DIM * num_humans, VEHICLE_DIM)
+    assert num_vehicles >= 0 and remainder == 0, (
+        "observations of dimension {} do not hold {} humans".format(obs.shape[-1], num_humans))
+
+    split = OWN_DIM + VEHICLE_DIM * num_vehicles
+    vehicles = obs[:, OWN_DIM:split].reshape(n, num_vehicles, VEHICLE_DIM)
+    humans = obs[:, split:].reshape(n, num_humans, HUMAN_DIM)
+    vehicle_index, vehicle_slot = (vehicles != 0).any(dim=-1).nonzero(as_tuple=True)
+    human_index, human_slot = (humans != 0).any(dim=-1).nonzero(as_tuple=True)
+    return obs[:, :OWN_DIM], vehicles[vehicle_index, vehicle_slot], vehicle_index, \
+        humans[human_index, human_slot], human_index
+
+
+class EntityBase(nn.Module):
+    """
+    Permutation invariant base network over the entities of an observation, an alternative to MLPBase.
+    The own slot, every present vehicle and every present human are encoded by a MLP per entity type, the vehicles
+    and the humans are mean pooled, and the pooled features are mixed by a MLP. The absent entities are dropped
+    before encoding, so the cost follows the entities in the scene, and the observations may hold any number of
+    vehicle slots.
+    :param args: (argparse.Namespace) arguments containing relevant model information.
+    :param obs_shape: (tuple) shape of the flat observations used for training.
+    :param num_humans: (int) number of human slots of the flat observations, see forward.
+    """
+
+    def __init__(self, args, obs_shape, num_humans=6):
+        super(EntityBase, self).__init__()
+
+        self._use_feature_normalization = args.use_feature_normalization
+        self._use_orthogonal = args.use_orthogonal
+        self._use_ReLU = args.use_ReLU
+        self._layer_N = args.layer_N
+        self.hidden_size = args.hidden_size
+        self.num_humans = num_humans
+
+        if self._use_feature_normalization:
+            self.own_norm = nn.LayerNorm(OWN_DIM)
+            self.vehicle_norm = nn.LayerNorm(VEHICLE_DIM)
+            self.human_norm = nn.LayerNorm(HUMAN_DIM)
+
+        self.own = MLPLayer(OWN_DIM, self.hidden_size, 0, self._use_orthogonal, self._use_ReLU)
+        self.vehicle = MLPLayer(VEHICLE_DIM, self.hidden_size, 1, self._use_orthogonal, self._use_ReLU)
+        self.human = MLPLayer(HUMAN_DIM, self.hidden_size, 1, self._use_orthogonal, self._use_ReLU)
+        self.mlp = MLPLayer(3 * self.hidden_size, self.hidden_size,
+                            self._layer_N, self._use_orthogonal, self._use_ReLU)
+
+    @staticmethod
+    def _pool(features, index, n):
+        """mean of the features of the entities of each observation, zeros for an observation without entities"""
+        total = features.new_zeros(n, features.shape[-1]).index_add_(0, index, features)
+        count = torch.bincount(index, minlength=n).clamp(min=1).to(features.dtype)
+        return total / count[:, None]
+
+    def encode(self, own, vehicles, vehicle_index, humans, human_index):
+        """
+        Compute features from packed entities, see split_entities.
+
+        :return x: (torch.Tensor) features of shape (N, hidden_size).
+        """
+        if self._use_feature_normalization:
+            own, vehicles, humans = self.own_norm(own), self.vehicle_norm(vehicles), self.human_norm(humans)
+
+        n = own.shape[0]
+        x = torch.cat([self.own(own),
+                       self._pool(self.vehicle(vehicles), vehicle_index, n),
+                       self._pool(self.human(humans), human_index, n)], dim=-1)
+        return self.mlp(x)
+
+    def forward(self, x):
+        # the number of vehicles follows from the dimension, set num_humans to serve other sites
+        return self.encode(*split_entities(x, self.num_humans))
@@ -5,6 +5,9 @@ import torch
 import torch.nn as nn
 import torch.nn.functional as F
 
+from mappo.utils.distributed import all_reduce_moments
+from mappo.utils.util import masked_moments
+
 
 class PopArt(torch.nn.Module):
 
@@ -41,31 +44,41 @@ class PopArt(torch.nn.Module):
         self.debiasing_term.zero_()
 
     def forward(self, input_vector):
-        if type(input_vector) == np.ndarray:
+        if isinstance(input_vector, np.ndarray):
             input_vector = torch.from_numpy(input_vector)
         input_vector = input_vector.to(**self.tpdv)
 
         return F.linear(input_vector, self.weight, self.bias)
 
     @torch.no_grad()
-    def update(self, input_vector):
-        if type(input_vector) == np.ndarray:
+    def update(self, input_vector, mask=None):
+        if isinstance(input_vector, np.ndarray):
             input_vector = torch.from_numpy(input_vector)
         input_vector = input_vector.to(**self.tpdv)
 
-        old_mean, old_stddev = self.mean, self.stddev
+        old_mean, old_stddev = self.mean.clone(), self.stddev.clone()
+
+        if isinstance(mask, np.ndarray):
+            mask = torch.from_numpy(mask)
+        if mask is not None:
+            mask = mask.to(**self.tpdv)
 
-        batch_mean = input_vector.mean(dim=tuple(range(self.norm_axes)))
-        batch_sq_mean = (input_vector ** 2).mean(dim=tuple(range(self.norm_axes)))
+        # the excluded entries, e.g. of inactive agents, do not contribute to the statistics
+        axes = tuple(range(self.norm_axes))
+        batch_mean, batch_sq_mean = masked_moments(input_vector, mask, axes)
+        # with distributed training, every rank keeps the statistics of the batches of all ranks
+        batch_mean, batch_sq_mean = all_reduce_moments(input_vector, mask, batch_mean, batch_sq_mean, axes)
 
         self.mean.mul_(self.beta).add_(batch_mean * (1.0 - self.beta))
         self.mean_sq.mul_(self.beta).add_(batch_sq_mean * (1.0 - self.beta))
         self.debiasing_term.mul_(self.beta).add_(1.0 * (1.0 - self.beta))
 
-        self.stddev = (self.mean_sq - self.mean ** 2).sqrt().clamp(min=1e-4)
+        # the statistics are updated in place, they stay registered parameters on the device
+        self.stddev.copy_((self.mean_sq - self.mean ** 2).sqrt().clamp(min=1e-4))
 
-        self.weight = self.weight * old_stddev / self.stddev
-        self.bias = (old_stddev * self.bias + old_mean - self.mean) / self.stddev
+        # the output layer gets new storage, a pending backward pass still sees the weights of its forward pass
+        self.weight.data = self.weight.data * (old_stddev / self.stddev)[:, None]
+        self.bias.data = (old_stddev * self.bias.data + old_mean - self.mean) / self.stddev
 
     def debiased_mean_var(self):
         debiased_mean = self.mean / self.debiasing_term.clamp(min=self.epsilon)
@@ -73,8 +86,23 @@ class PopArt(torch.nn.Module):
         debiased_var = (debiased_mean_sq - debiased_mean ** 2).clamp(min=1e-2)
         return debiased_mean, debiased_var
 
+    def update_and_normalize(self, input_vector, mask=None):
+        """
+        Update the statistics with a batch, then normalize the batch with the updated statistics.
+        :param input_vector: (np.ndarray or torch.Tensor) the batch.
+        :param mask: (np.ndarray or torch.Tensor) zero for the entries excluded from the statistics, None includes all.
+
+        :return out: (torch.Tensor) the normalized batch, on the device of the statistics.
+        """
+        if isinstance(input_vector, np.ndarray):
+            input_vector = torch.from_numpy(input_vector)
+        input_vector = input_vector.to(**self.tpdv)
+
+        self.update(input_vector, mask)
+        return self.normalize(input_vector)
+
     def normalize(self, input_vector):
-        if type(input_vector) == np.ndarray:
+        if isinstance(input_vector, np.ndarray):
             input_vector = torch.from_numpy(input_vector)
         input_vector = input_vector.to(**self.tpdv)
 
@@ -84,13 +112,13 @@ class PopArt(torch.nn.Module):
         return out
 
     def denormalize(self, input_vector):
-        if type(input_vector) == np.ndarray:
+        from_numpy = isinstance(input_vector, np.ndarray)
+        if from_numpy:
             input_vector = torch.from_numpy(input_vector)
         input_vector = input_vector.to(**self.tpdv)
 
         mean, var = self.debiased_mean_var()
         out = input_vector * torch.sqrt(var)[(None,) * self.norm_axes] + mean[(None,) * self.norm_axes]
 
-        out = out.cpu().numpy()
-
-        return out
+        # tensors stay on the device, numpy arrays are returned as numpy arrays
+        return out.cpu().numpy() if from_numpy else out
@@ -63,6 +63,26 @@ def get_config():
         default=1,
         help="Number of parallel envs for rendering rollouts",
     )
+    parser.add_argument(
+        "--num_rollout_workers",
+        type=int,
+        default=0,
+        help="by default 0, rollouts are collected by the training process. If positive, number of worker "
+             "processes collecting rollouts of n_rollout_threads envs each, decoupled from the updates.",
+    )
+    parser.add_argument(
+        "--max_policy_lag",
+        type=int,
+        default=4,
+        help="with num_rollout_workers, the rollouts collected more than max_policy_lag updates ago are dropped.",
+    )
+    parser.add_argument(
+        "--use_distributed",
+        action="store_true",
+        default=False,
+        help="by default False. If True, train data parallel with torch.distributed gloo in processes launched by "
+             "torchrun, every process collects its own rollouts and the gradients are averaged.",
+    )
     parser.add_argument(
         "--num_env_steps",
         type=int,
@@ -97,6 +117,26 @@ def get_config():
         default=400,
         help="Max length for any episode"
     )
+    parser.add_argument(
+        "--use_tensor_buffer",
+        action="store_true",
+        default=False,
+        help="by default False. If True, sample the minibatches on the training device from torch tensors that "
+             "insert keeps in sync with the rollout. Collection still goes through numpy.",
+    )
+    parser.add_argument(
+        "--buffer_dir",
+        type=str,
+        default=None,
+        help="by default None. set the directory to keep the rollout in a memory-mapped file instead of RAM.",
+    )
+    parser.add_argument(
+        "--use_compact_obs",
+        action="store_true",
+        default=False,
+        help="by default False. If True, the buffer stores only the slots of online vehicles and humans of the "
+             "observations.",
+    )
 
     # network parameters
     parser.add_argument(
@@ -111,6 +151,13 @@ def get_config():
         default=True,
         help="Whether to use centralized V function",
     )
+    parser.add_argument(
+        "--use_shared_critic",
+        action="store_true",
+        default=False,
+        help="by default False. If True, the centralized critic of a feed-forward policy is evaluated once per "
+             "thread and shared by its agents, and the minibatches sample all agents of a thread together.",
+    )
     parser.add_argument(
         "--stacked_frames",
         type=int,
@@ -159,6 +206,13 @@ def get_config():
         default=True,
         help="Whether to apply layernorm to the inputs",
     )
+    parser.add_argument(
+        "--use_entity_encoder",
+        action="store_true",
+        default=False,
+        help="by default False. If True, the actor encodes the vehicles and humans of an observation as sets "
+             "with EntityBase instead of a flat MLPBase.",
+    )
     parser.add_argument(
         "--use_orthogonal",
         action="store_false",
@@ -320,6 +374,19 @@ def get_config():
         default=10.0,
         help=" coefficience of huber loss."
     )
+    parser.add_argument(
+        "--use_compile",
+        action="store_true",
+        default=False,
+        help="by default False. If True, compile the actor and critic evaluation of ppo updates with torch.compile.",
+    )
+    parser.add_argument(
+        "--use_bf16",
+        action="store_true",
+        default=False,
+        help="by default False. If True, evaluate the actor and critic with bfloat16 autocast in ppo updates and "
+             "rollouts, the losses and value normalization stay in float32.",
+    )
 
     # run parameters
     parser.add_argument(
@@ -335,6 +402,13 @@ def get_config():
         default=1,
         help="time duration between continuous twice models saving.",
     )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        default=False,
+        help="by default False. If True, continue the latest run of the experiment from its checkpoint, which is "
+             "written with the models.",
+    )
 
     # log parameters
     parser.add_argument(
@@ -343,6 +417,28 @@ def get_config():
         default=5,
         help="time duration between continuous twice log printing.",
     )
+    parser.add_argument(
+        "--use_timing",
+        action="store_true",
+        default=False,
+        help="by default False. If True, time the phases of every episode, i.e. collect, env step, insert, compute "
+             "and the forward, backward and optimizer steps of the update, log them and write timings.json.",
+    )
+    parser.add_argument(
+        "--profile_episodes",
+        type=int,
+        nargs=2,
+        default=None,
+        metavar=("START", "STOP"),
+        help="by default None. If set, capture a profile of the episodes from START to STOP included.",
+    )
+    parser.add_argument(
+        "--profiler",
+        type=str,
+        default="torch",
+        choices=["torch", "cprofile"],
+        help="profiler of --profile_episodes, torch writes a chrome trace, cprofile writes pstats.",
+    )
 
     # eval parameters
     parser.add_argument(
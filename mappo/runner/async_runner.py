@@ -0,0 +1,227 @@
+import queue
+import time
+
+import numpy as np
+import torch
+import torch.multiprocessing as mp
+
+from mappo.runner.env_runner import EnvRunner
+
+
+def rollout_worker(rank, all_args, weights, version, lock, chunks, stop):
+    """
+    Collect rollouts with a CPU copy of the actor in a worker process of AsyncEnvRunner, until stop is set.
+    The actor loads the published weights before every rollout, so a rollout is collected by a single policy version.
+    :param rank: (int) index of the worker, it seeds the worker.
+    :param all_args: (argparse.Namespace) arguments of the run.
+    :param weights: (dict) state dict of the actor in shared memory, published by the learner.
+    :param version: (mp.Value) number of updates of the published weights.
+    :param lock: (mp.Lock) guards weights and version.
+    :param chunks: (mp.Queue) the collected rollouts are put there, see AsyncEnvRunner.load_chunk.
+    :param stop: (mp.Event) set by the learner to stop the worker.
+    """
+    from mappo.algorithms.algorithm.r_actor_critic import R_Actor
+    from mappo.train import make_train_env
+
+    torch.set_num_threads(1)
+    seed = all_args.seed + 10000 * (rank + 1)
+    torch.manual_seed(seed)
+    np.random.seed(seed)
+
+    envs = make_train_env(all_args)
+    actor = R_Actor(all_args, envs.observation_space[0], envs.action_space[0])
+    actor.eval()
+    # the queue may hold rollouts the learner never reads once it stops, they must not block the exit
+    chunks.cancel_join_thread()
+
+    obs = envs.reset()
+    masks = np.ones((*obs.shape[:2], 1), dtype=np.float32)
+    episode_length = all_args.episode_length
+    while not stop.is_set():
+        with lock:
+            actor.load_state_dict(weights)
+            policy_version = version.value
+
+        chunk = {
+            "obs": np.empty((episode_length + 1, *obs.shape), dtype=np.float32),
+            "masks": np.empty((episode_length + 1, *masks.shape), dtype=np.float32),
+            "actions": [],
+            "action_log_probs": [],
+            "rewards": [],
+            "version": policy_version,
+            "worker": rank,
+        }
+        chunk["obs"][0] = obs
+        chunk["masks"][0] = masks
+        for step in range(episode_length):
+            with torch.no_grad():
+                action, action_log_prob, _ = actor(obs.reshape(-1, obs.shape[-1]), None, None)
+            actions = action.numpy().reshape(*obs.shape[:2], -1)
+            obs, rewards, dones, infos = envs.step(0.7 * (np.tanh(actions) + 1))
+
+            masks = np.ones_like(masks)
+            masks[dones == True] = 0.0
+            chunk["obs"][step + 1] = obs
+            chunk["masks"][step + 1] = masks
+            chunk["actions"].append(actions)
+            chunk["action_log_probs"].append(action_log_prob.numpy().reshape(*obs.shape[:2], -1))
+            chunk["rewards"].append(rewards)
+
+        for name in ("actions", "action_log_probs", "rewards"):
+            chunk[name] = np.stack(chunk[name]).astype(np.float32)
+        while not stop.is_set():
+            try:
+                chunks.put(chunk, timeout=0.1)
+                break
+            except queue.Full:
+                pass
+    envs.close()
+
+
+class AsyncEnvRunner(EnvRunner):
+    """
+    Runner with a decoupled actor and learner. num_rollout_workers worker processes collect rollouts with their own
+    envs and a CPU copy of the actor, see rollout_worker, while this process only updates the networks. A rollout is
+    one episode of n_rollout_threads envs, the learner updates once per rollout and publishes the actor weights to
+    the workers through shared memory after every update.
+    The policy lag of a rollout is the number of updates since the weights it was collected with, the rollouts with
+    a lag above max_policy_lag are dropped. The critic is evaluated by the learner for a whole rollout at once, so
+    the policy must be feed-forward. See parent class for details.
+    """
+
+    def __init__(self, config):
+        super(AsyncEnvRunner, self).__init__(config)
+        assert not self.recurrent, "the decoupled actor and learner need a feed-forward policy"
+        assert self.envs.action_space[0].__class__.__name__ == "Box", "the rollout workers take continuous actions"
+        self.num_rollout_workers = self.all_args.num_rollout_workers
+        self.max_policy_lag = self.all_args.max_policy_lag
+
+        self.ctx = mp.get_context("spawn")
+        self.lock = self.ctx.Lock()
+        self.version = self.ctx.Value("l", 0)
+        self.weights = {k: v.detach().to("cpu", copy=True).share_memory_()
+                        for k, v in self.trainer.policy.actor.state_dict().items()}
+        self.chunks = self.ctx.Queue(maxsize=self.num_rollout_workers)
+        self.stop = self.ctx.Event()
+        self.workers = []
+        self.dropped_chunks = 0
+
+    def run(self):
+        self.start_workers()
+        try:
+            self._run()
+        finally:
+            self.stop_workers()
+        self.finish()
+
+    def _run(self):
+        start = time.time()
+        episodes = int(self.num_env_steps) // self.episode_env_steps
+        start_steps = self.start_episode * self.episode_env_steps
+
+        for episode in range(self.start_episode, episodes):
+            self.profiler.begin(episode)
+            if self.use_linear_lr_decay:
+                self.trainer.policy.lr_decay(episode, episodes)
+
+            # the learner waits for the workers instead of collecting
+            with self.timer.phase("wait"):
+                chunk, policy_lag = self.next_chunk()
+            with self.timer.phase("compute"):
+                self.load_chunk(chunk)
+            with self.timer.phase("train"):
+                train_infos = self.train()
+            with self.timer.phase("publish"):
+                self.publish()
+            self.profiler.end(episode)
+
+            train_infos["policy_lag"] = policy_lag
+            train_infos["dropped_chunks"] = self.dropped_chunks
+            self.post_process(episode, episodes, train_infos, start, start_steps)
+
+    def start_workers(self):
+        """Publish the actor weights and start the rollout workers."""
+        self.publish()
+        for rank in range(self.num_rollout_workers):
+            worker = self.ctx.Process(target=rollout_worker,
+                                      args=(rank, self.all_args, self.weights, self.version, self.lock, self.chunks,
+                                            self.stop),
+                                      name="rollout-worker-{}".format(rank), daemon=True)
+            worker.start()
+            self.workers.append(worker)
+
+    def stop_workers(self):
+        """Stop the rollout workers, the rollouts they still hold are dropped."""
+        self.stop.set()
+        for worker in self.workers:
+            worker.join(timeout=10)
+            if worker.is_alive():
+                worker.terminate()
+        self.workers = []
+
+    def publish(self):
+        """Copy the actor weights to the shared memory of the workers, and count the update."""
+        state_dict = self.trainer.policy.actor.state_dict()
+        with self.lock:
+            for k, v in self.weights.items():
+                v.copy_(state_dict[k])
+            self.version.value += 1
+
+    def next_chunk(self):
+        """
+        Wait for a rollout within the policy lag bound, the older ones are dropped.
+
+        :return chunk: (dict) the rollout, see rollout_worker.
+        :return policy_lag: (int) number of updates since the weights of the rollout.
+        """
+        while True:
+            try:
+                chunk = self.chunks.get(timeout=1.0)
+            except queue.Empty:
+                for worker in self.workers:
+                    if not worker.is_alive():
+                        raise RuntimeError("{} exited with code {}".format(worker.name, worker.exitcode))
+                continue
+            policy_lag = self.version.value - chunk["version"]
+            if policy_lag <= self.max_policy_lag:
+                return chunk, policy_lag
+            self.dropped_chunks += 1
+
+    @torch.no_grad()
+    def load_chunk(self, chunk):
+        """
+        Insert a rollout into the buffer and compute its returns, the values of all its steps are evaluated at once.
+        :param chunk: (dict) the rollout, see rollout_worker.
+        """
+        obs = chunk["obs"]  # [episode_length + 1, env_num, agent_num, obs_dim]
+        if self.use_centralized_V:
+            share_obs = obs.reshape(*obs.shape[:2], 1, -1)
+        else:
+            share_obs = obs
+
+        if self.policy.critic_group > 1:
+            critic_obs = share_obs.reshape(-1, share_obs.shape[-1])
+        else:
+            critic_obs = np.broadcast_to(share_obs, (*obs.shape[:3], share_obs.shape[-1])).reshape(
+                -1, share_obs.shape[-1])
+        self.trainer.prep_rollout()
+        with self.trainer.autocast():
+            values = self.trainer.policy.get_values(critic_obs, None, None)
+        values = values.detach().float().cpu().numpy().reshape(*obs.shape[:3], 1)
+
+        self.buffer.share_obs[0] = share_obs[0]
+        self.buffer.obs[0] = obs[0]
+        self.buffer.masks[0] = chunk["masks"][0]
+        for step in range(self.episode_length):
+            self.buffer.insert(
+                share_obs[step + 1],
+                obs[step + 1],
+                None,
+                None,
+                chunk["actions"][step],
+                chunk["action_log_probs"][step],
+                values[step],
+                chunk["rewards"][step],
+                chunk["masks"][step + 1],
+            )
+        self.buffer.compute_returns(values[-1], self.trainer.value_normalizer)
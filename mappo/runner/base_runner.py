@@ -1,15 +1,29 @@
 import os
+import random
 
 import numpy as np
 import torch
 from tensorboardX import SummaryWriter
 
+from mappo.algorithms.algorithm.inference import save_actor
+from mappo.algorithms.algorithm.numpy_actor import actor_meta
+from mappo.utils.checkpoint import CheckpointWriter
+from mappo.utils.compact_buffer import CompactReplayBuffer
+from mappo.utils.distributed import broadcast_module, gather_object, get_rank, get_world_size
+from mappo.utils.memmap_buffer import MemmapReplayBuffer
+from mappo.utils.profiler import EpisodeProfiler
 from mappo.utils.shared_buffer import SharedReplayBuffer
+from mappo.utils.tensor_buffer import TensorReplayBuffer
+
+
+# fields of the buffer whose first slot carries over to the next rollout, see SharedReplayBuffer.after_update
+CARRIED_FIELDS = ("share_obs", "obs", "rnn_states", "rnn_states_critic", "masks", "bad_masks", "active_masks",
+                  "available_actions")
 
 
 def _t2n(x):
-    """Convert torch tensor to a numpy array."""
-    return x.detach().cpu().numpy()
+    """Convert torch tensor to a float32 numpy array."""
+    return x.detach().float().cpu().numpy()
 
 
 class Runner(object):
@@ -21,6 +35,13 @@ class Runner(object):
     def __init__(self, config):
 
         self.all_args = config['all_args']
+        # the buffer options select different buffer classes, which do not combine
+        buffer_options = [option for option, enabled in (("--buffer_dir", self.all_args.buffer_dir is not None),
+                                                          ("--use_tensor_buffer", self.all_args.use_tensor_buffer),
+                                                          ("--use_compact_obs", self.all_args.use_compact_obs))
+                          if enabled]
+        if len(buffer_options) > 1:
+            raise ValueError("the buffer options {} can not be combined, choose one".format(", ".join(buffer_options)))
         self.envs = config['envs']
         self.eval_envs = config['eval_envs']
         self.device = config['device']
@@ -43,6 +64,12 @@ class Runner(object):
         self.hidden_size = self.all_args.hidden_size
         self.use_render = self.all_args.use_render
         self.recurrent_N = self.all_args.recurrent_N
+        # feed-forward policies neither read nor update rnn states and masks, so they are not passed to them
+        self.recurrent = self.all_args.use_recurrent_policy or self.all_args.use_naive_recurrent_policy
+        # with distributed training every rank collects its own rollouts, rank 0 logs and saves for all of them
+        self.rank = get_rank()
+        self.world_size = get_world_size()
+        self.episode_env_steps = self.episode_length * self.n_rollout_threads * self.world_size
 
         # interval
         self.save_interval = self.all_args.save_interval
@@ -55,12 +82,13 @@ class Runner(object):
 
         self.run_dir = config["run_dir"]
         self.log_dir = str(self.run_dir / 'logs')
-        if not os.path.exists(self.log_dir):
-            os.makedirs(self.log_dir)
-        self.writer = SummaryWriter(self.log_dir)
         self.save_dir = str(self.run_dir / 'models')
-        if not os.path.exists(self.save_dir):
-            os.makedirs(self.save_dir)
+        if self.rank == 0:
+            if not os.path.exists(self.log_dir):
+                os.makedirs(self.log_dir)
+            if not os.path.exists(self.save_dir):
+                os.makedirs(self.save_dir)
+        self.writer = SummaryWriter(self.log_dir) if self.rank == 0 else None
 
         from mappo.algorithms.algorithm.r_mappo import RMAPPO as TrainAlgo
         from mappo.algorithms.algorithm.rMAPPOPolicy import RMAPPOPolicy as Policy
@@ -77,16 +105,57 @@ class Runner(object):
 
         if self.model_dir is not None:
             self.restore()
+        # the ranks start from the networks of rank 0
+        broadcast_module(self.policy.actor)
+        broadcast_module(self.policy.critic)
 
         # algorithm
         self.trainer = TrainAlgo(self.all_args, self.policy, device=self.device)
 
+        # phase timings with use_timing and a profile of profile_episodes, rank 0 only profiles
+        self.timer = self.trainer.timer
+        self.profiler = EpisodeProfiler(self.all_args.profiler,
+                                        self.all_args.profile_episodes if self.rank == 0 else None,
+                                        self.log_dir, self.timer)
+
         # buffer
-        self.buffer = SharedReplayBuffer(self.all_args,
-                                         self.num_agents,
-                                         self.envs.observation_space[0],
-                                         share_observation_space,
-                                         self.envs.action_space[0])
+        if self.all_args.buffer_dir is not None:
+            self.buffer = MemmapReplayBuffer(self.all_args,
+                                             self.num_agents,
+                                             self.envs.observation_space[0],
+                                             share_observation_space,
+                                             self.envs.action_space[0],
+                                             directory=self.all_args.buffer_dir)
+        elif self.all_args.use_tensor_buffer:
+            self.buffer = TensorReplayBuffer(self.all_args,
+                                             self.num_agents,
+                                             self.envs.observation_space[0],
+                                             share_observation_space,
+                                             self.envs.action_space[0],
+                                             device=self.device)
+        elif self.all_args.use_compact_obs:
+            self.buffer = CompactReplayBuffer(self.all_args,
+                                              self.num_agents,
+                                              self.envs.observation_space[0],
+                                              share_observation_space,
+                                              self.envs.action_space[0])
+        else:
+            self.buffer = SharedReplayBuffer(self.all_args,
+                                             self.num_agents,
+                                             self.envs.observation_space[0],
+                                             share_observation_space,
+                                             self.envs.action_space[0])
+
+        # full checkpoints of the run, written in the background, see checkpoint_state
+        self.checkpoint_path = os.path.join(self.save_dir, "checkpoint.pt")
+        self.checkpoints = CheckpointWriter(self.checkpoint_path)
+        self.start_episode = 0
+        if self.all_args.resume:
+            if os.path.exists(self.checkpoint_path):
+                self.load_checkpoint(torch.load(self.checkpoint_path, weights_only=False))
+                print("resume from episode {} of {}".format(self.start_episode, self.checkpoint_path))
+            else:
+                print("no checkpoint in {}, start from scratch".format(self.save_dir))
 
     def run(self):
         """Collect training data, perform training updates, and evaluate policy."""
@@ -107,13 +176,29 @@ class Runner(object):
         """
         raise NotImplementedError
 
+    def critic_obs(self, step):
+        """
+        Centralized observations of a step as the input of the critic, see RMAPPOPolicy.critic_values.
+        :param step: (int) index of the step.
+
+        :return share_obs: (np.ndarray) one row per thread with a shared critic, otherwise one row per agent.
+        """
+        if self.policy.critic_group > 1:
+            # stored once per thread already
+            return self.buffer.share_obs[step].reshape(-1, *self.buffer.share_obs.shape[3:])
+        return np.concatenate(self.buffer.agent_share_obs(step))
+
     @torch.no_grad()
     def compute(self):
         """Calculate returns for the collected data."""
         self.trainer.prep_rollout()
-        next_values = self.trainer.policy.get_values(np.concatenate(self.buffer.share_obs[-1]),
-                                                     np.concatenate(self.buffer.rnn_states_critic[-1]),
-                                                     np.concatenate(self.buffer.masks[-1]))
+        if self.recurrent:
+            rnn_states_critic = np.concatenate(self.buffer.rnn_states_critic[-1])
+            masks = np.concatenate(self.buffer.masks[-1])
+        else:
+            rnn_states_critic = masks = None
+        with self.trainer.autocast():
+            next_values = self.trainer.policy.get_values(self.critic_obs(-1), rnn_states_critic, masks)
         next_values = np.array(np.split(_t2n(next_values), self.n_rollout_threads))
         self.buffer.compute_returns(next_values, self.trainer.value_normalizer)
 
@@ -126,8 +211,9 @@ class Runner(object):
 
     def save(self):
         """Save policy's actor and critic networks."""
-        policy_actor = self.trainer.policy.actor
-        torch.save(policy_actor.state_dict(), str(self.save_dir) + "/actor.pt")
+        # the actor is saved with its description, e.g. its encoder, so that it can be rebuilt for serving
+        meta = actor_meta(self.all_args, self.envs.observation_space[0].shape[0], self.envs.action_space[0].shape[0])
+        save_actor(self.trainer.policy.actor, str(self.save_dir), meta)
         policy_critic = self.trainer.policy.critic
         torch.save(policy_critic.state_dict(), str(self.save_dir) + "/critic.pt")
 
@@ -139,6 +225,74 @@ class Runner(object):
             policy_critic_state_dict = torch.load(str(self.model_dir) + '/critic.pt')
             self.policy.critic.load_state_dict(policy_critic_state_dict)
 
+    def checkpoint_state(self, episode):
+        """
+        Full state of the run after an episode, from which training continues exactly as without interruption.
+        :param episode: (int) the episode that just finished.
+
+        :return state: (dict) networks, optimizers, value normalizer, the carried over slot of the buffer, envs and
+                       random number generators. With distributed training, every rank has to call it, and the
+                       buffers, envs and random number generators of all ranks are listed by rank under "ranks" of
+                       the state of rank 0.
+        """
+        policy = self.trainer.policy
+        state = {
+            "episode": episode,
+            "actor": policy.actor.state_dict(),
+            "critic": policy.critic.state_dict(),
+            "actor_optimizer": policy.actor_optimizer.state_dict(),
+            "critic_optimizer": policy.critic_optimizer.state_dict(),
+        }
+        if self.trainer.value_normalizer is not None:
+            state["value_normalizer"] = self.trainer.value_normalizer.state_dict()
+
+        local_state = {
+            "buffer": {name: getattr(self.buffer, name)[0] for name in CARRIED_FIELDS
+                       if getattr(self.buffer, name) is not None},
+            "envs": self.envs.envs,
+            "rng": {
+                "python": random.getstate(),
+                "numpy": np.random.get_state(),
+                "torch": torch.get_rng_state(),
+                "cuda": torch.cuda.get_rng_state_all() if torch.cuda.is_available() else None,
+            },
+        }
+        if self.world_size > 1:
+            state["ranks"] = gather_object(local_state)
+        else:
+            state.update(local_state)
+        return state
+
+    def load_checkpoint(self, state):
+        """
+        Restore the state of a run, see checkpoint_state. A distributed run resumes with the same number of ranks.
+        :param state: (dict) the loaded checkpoint.
+        """
+        ranks = len(state["ranks"]) if "ranks" in state else 1
+        if ranks != self.world_size:
+            raise ValueError("the checkpoint was written by {} ranks, it cannot be resumed by {}".format(
+                ranks, self.world_size))
+        policy = self.trainer.policy
+        policy.actor.load_state_dict(state["actor"])
+        policy.critic.load_state_dict(state["critic"])
+        policy.actor_optimizer.load_state_dict(state["actor_optimizer"])
+        policy.critic_optimizer.load_state_dict(state["critic_optimizer"])
+        if "value_normalizer" in state:
+            self.trainer.value_normalizer.load_state_dict(state["value_normalizer"])
+
+        local_state = state["ranks"][self.rank] if "ranks" in state else state
+        for name, value in local_state["buffer"].items():
+            getattr(self.buffer, name)[0] = value
+        self.envs.envs = local_state["envs"]
+
+        rng = local_state["rng"]
+        random.setstate(rng["python"])
+        np.random.set_state(rng["numpy"])
+        torch.set_rng_state(rng["torch"])
+        if rng["cuda"] is not None and torch.cuda.is_available():
+            torch.cuda.set_rng_state_all(rng["cuda"])
+        self.start_episode = state["episode"] + 1
+
     def log_train(self, train_infos, total_num_steps):
         """
         Log training info.
@@ -1,3 +1,5 @@
+import json
+import os
 import time
 
 import numpy as np
@@ -7,7 +9,18 @@ from mappo.runner.base_runner import Runner
 
 
 def _t2n(x):
-    return x.detach().cpu().numpy()
+    # float32 for the buffer, the outputs are bfloat16 with use_bf16
+    return x.detach().float().cpu().numpy()
+
+
+def _merge(x):
+    """same as np.concatenate(x), but a view of x instead of a copy when x is contiguous"""
+    return x.reshape(-1, *x.shape[2:])
+
+
+def _split(x, n):
+    """same as np.array(np.split(x, n)), but a view of x instead of a copy"""
+    return x.reshape(n, x.shape[0] // n, *x.shape[1:])
 
 
 class EnvRunner(Runner):
@@ -17,28 +30,34 @@ class EnvRunner(Runner):
         super(EnvRunner, self).__init__(config)
 
     def run(self):
-        self.warmup()
+        # a resumed run continues from the envs and the buffer of its checkpoint
+        if self.start_episode == 0:
+            self.warmup()
 
         start = time.time()
-        episodes = int(self.num_env_steps) // self.episode_length // self.n_rollout_threads
+        episodes = int(self.num_env_steps) // self.episode_env_steps
+        start_steps = self.start_episode * self.episode_env_steps
 
-        for episode in range(episodes):
+        for episode in range(self.start_episode, episodes):
+            self.profiler.begin(episode)
             if self.use_linear_lr_decay:
                 self.trainer.policy.lr_decay(episode, episodes)
 
             for step in range(self.episode_length):
                 # Sample actions
-                (
-                    values,
-                    actions,
-                    action_log_probs,
-                    rnn_states,
-                    rnn_states_critic,
-                    actions_env,
-                ) = self.collect(step)
+                with self.timer.phase("collect"):
+                    (
+                        values,
+                        actions,
+                        action_log_probs,
+                        rnn_states,
+                        rnn_states_critic,
+                        actions_env,
+                    ) = self.collect(step)
 
                 # Obser reward and next obs
-                obs, rewards, dones, infos = self.envs.step(actions_env)
+                with self.timer.phase("env_step"):
+                    obs, rewards, dones, infos = self.envs.step(actions_env)
 
                 data = (
                     obs,
@@ -53,43 +72,77 @@ class EnvRunner(Runner):
                 )
 
                 # insert data into buffer
-                self.insert(data)
+                with self.timer.phase("insert"):
+                    self.insert(data)
 
             # compute return and update network
-            self.compute()
-            train_infos = self.train()
-
-            # post process
-            total_num_steps = (episode + 1) * self.episode_length * self.n_rollout_threads
-
-            # save model
-            if episode % self.save_interval == 0 or episode == episodes - 1:
+            with self.timer.phase("compute"):
+                self.compute()
+            with self.timer.phase("train"):
+                train_infos = self.train()
+            self.profiler.end(episode)
+
+            self.post_process(episode, episodes, train_infos, start, start_steps)
+
+        self.finish()
+
+    def post_process(self, episode, episodes, train_infos, start, start_steps):
+        """
+        Save, log and evaluate after the update of an episode.
+        :param episode: (int) the episode that just finished.
+        :param episodes: (int) number of episodes of the run.
+        :param train_infos: (dict) information about the training update.
+        :param start: (float) time the run started.
+        :param start_steps: (int) env steps done before the run started, e.g. by a resumed run.
+        """
+        total_num_steps = (episode + 1) * self.episode_env_steps
+        self.timer.step()
+
+        # save model
+        if episode % self.save_interval == 0 or episode == episodes - 1:
+            # every rank contributes its envs to the checkpoint of rank 0
+            state = self.checkpoint_state(episode)
+            if self.rank == 0:
                 self.save()
-
-            # log information
-            if episode % self.log_interval == 0:
-                end = time.time()
-                print(
-                    "\n Environ {} Algo {} Exp {} updates {}/{} episodes, total num timesteps {}/{}, FPS {}.\n".format(
-                        self.all_args.scenario_name,
-                        self.algorithm_name,
-                        self.experiment_name,
-                        episode,
-                        episodes,
-                        total_num_steps,
-                        self.num_env_steps,
-                        int(total_num_steps / (end - start)),
-                    )
+                self.checkpoints.submit(state)
+
+        if self.rank != 0:
+            return
+
+        # log information
+        if episode % self.log_interval == 0:
+            end = time.time()
+            print(
+                "\n Environ {} Algo {} Exp {} updates {}/{} episodes, total num timesteps {}/{}, FPS {}.\n".format(
+                    self.all_args.scenario_name,
+                    self.algorithm_name,
+                    self.experiment_name,
+                    episode,
+                    episodes,
+                    total_num_steps,
+                    self.num_env_steps,
+                    int((total_num_steps - start_steps) / (end - start)),
                 )
+            )
 
-                train_infos["average_episode_rewards"] = np.mean(self.buffer.rewards) * self.episode_length
-                print("average episode rewards is {}".format(train_infos["average_episode_rewards"]))
-                self.log_train(train_infos, total_num_steps)
-                # self.log_env(env_infos, total_num_steps)
-
-            # eval
-            if episode % self.eval_interval == 0 and self.use_eval:
-                self.eval(total_num_steps)
+            train_infos["average_episode_rewards"] = np.mean(self.buffer.rewards) * self.episode_length
+            print("average episode rewards is {}".format(train_infos["average_episode_rewards"]))
+            # mean seconds per episode of the phases since the last log
+            train_infos.update(self.timer.pop())
+            self.log_train(train_infos, total_num_steps)
+            # self.log_env(env_infos, total_num_steps)
+
+        # eval
+        if episode % self.eval_interval == 0 and self.use_eval:
+            self.eval(total_num_steps)
+
+    def finish(self):
+        """Write the pending checkpoint, the profile and the phase timings of the run."""
+        self.checkpoints.close()
+        self.profiler.close()
+        if self.timer.enabled and self.rank == 0:
+            with open(os.path.join(self.log_dir, "timings.json"), "w") as f:
+                json.dump(self.timer.summary(), f, indent=2)
 
     def warmup(self):
         # reset env
@@ -97,44 +150,47 @@ class EnvRunner(Runner):
 
         # replay buffer
         if self.use_centralized_V:
-            share_obs = obs.reshape(self.n_rollout_threads, -1)  # shape = [env_num, agent_num * obs_dim]
-            share_obs = np.expand_dims(share_obs, 1).repeat(
-                self.num_agents, axis=1
-            )  # shape = shape = [env_num, agent_num， agent_num * obs_dim]
+            # the buffer stores it once per env and broadcasts it to the agents
+            share_obs = obs.reshape(self.n_rollout_threads, 1, -1)  # shape = [env_num, 1, agent_num * obs_dim]
         else:
             share_obs = obs
 
-        self.buffer.share_obs[0] = share_obs.copy()
-        self.buffer.obs[0] = obs.copy()
+        self.buffer.share_obs[0] = share_obs
+        self.buffer.obs[0] = obs
 
     @torch.no_grad()
     def collect(self, step):
         self.trainer.prep_rollout()
-        (
-            value,
-            action,
-            action_log_prob,
-            rnn_states,
-            rnn_states_critic,
-        ) = self.trainer.policy.get_actions(
-            np.concatenate(self.buffer.share_obs[step]),
-            np.concatenate(self.buffer.obs[step]),
-            np.concatenate(self.buffer.rnn_states[step]),
-            np.concatenate(self.buffer.rnn_states_critic[step]),
-            np.concatenate(self.buffer.masks[step]),
-        )
-        # [self.envs, agents, dim]
-        values = np.array(np.split(_t2n(value), self.n_rollout_threads))  # [env_num, agent_num, 1]
-        actions = np.array(np.split(_t2n(action), self.n_rollout_threads))  # [env_num, agent_num, action_dim]
-        action_log_probs = np.array(
-            np.split(_t2n(action_log_prob), self.n_rollout_threads)
-        )  # [env_num, agent_num, 1]
-        rnn_states = np.array(
-            np.split(_t2n(rnn_states), self.n_rollout_threads)
-        )  # [env_num, agent_num, 1, hidden_size]
-        rnn_states_critic = np.array(
-            np.split(_t2n(rnn_states_critic), self.n_rollout_threads)
-        )  # [env_num, agent_num, 1, hidden_size]
+        if self.recurrent:
+            rnn_states = np.concatenate(self.buffer.rnn_states[step])
+            rnn_states_critic = np.concatenate(self.buffer.rnn_states_critic[step])
+            masks = _merge(self.buffer.masks[step])
+        else:
+            # None is passed through and returned by feed-forward policies
+            rnn_states = rnn_states_critic = masks = None
+        with self.trainer.autocast():
+            (
+                value,
+                action,
+                action_log_prob,
+                rnn_states,
+                rnn_states_critic,
+            ) = self.trainer.policy.get_actions(
+                self.critic_obs(step),
+                _merge(self.buffer.obs[step]),
+                rnn_states,
+                rnn_states_critic,
+                masks,
+            )
+        # [self.envs, agents, dim], views of the outputs, insert copies them into the buffer once
+        values = _split(_t2n(value), self.n_rollout_threads)  # [env_num, agent_num, 1]
+        actions = _split(_t2n(action), self.n_rollout_threads)  # [env_num, agent_num, action_dim]
+        action_log_probs = _split(_t2n(action_log_prob), self.n_rollout_threads)  # [env_num, agent_num, 1]
+        if self.recurrent:
+            rnn_states = _split(_t2n(rnn_states), self.n_rollout_threads)  # [env_num, agent_num, 1, hidden_size]
+            rnn_states_critic = _split(
+                _t2n(rnn_states_critic), self.n_rollout_threads
+            )  # [env_num, agent_num, 1, hidden_size]
         # rearrange action
         if self.envs.action_space[0].__class__.__name__ == "MultiDiscrete":
             for i in range(self.envs.action_space[0].shape):
@@ -171,20 +227,17 @@ class EnvRunner(Runner):
             rnn_states_critic,
         ) = data
 
-        rnn_states[dones == True] = np.zeros(
-            ((dones == True).sum(), self.recurrent_N, self.hidden_size),
-            dtype=np.float32,
-        )
-        rnn_states_critic[dones == True] = np.zeros(
-            ((dones == True).sum(), *self.buffer.rnn_states_critic.shape[3:]),
-            dtype=np.float32,
-        )
-        masks = np.ones((self.n_rollout_threads, self.num_agents, 1), dtype=np.float32)
-        masks[dones == True] = np.zeros(((dones == True).sum(), 1), dtype=np.float32)
+        # reset the finished agents in place, and write the masks into the next slot of the buffer directly
+        dones = dones == True
+        if self.recurrent:
+            rnn_states[dones] = 0.0
+            rnn_states_critic[dones] = 0.0
+        masks = self.buffer.masks[self.buffer.step + 1]
+        masks.fill(1.0)
+        masks[dones] = 0.0
 
         if self.use_centralized_V:
-            share_obs = obs.reshape(self.n_rollout_threads, -1)
-            share_obs = np.expand_dims(share_obs, 1).repeat(self.num_agents, axis=1)
+            share_obs = obs.reshape(self.n_rollout_threads, 1, -1)
         else:
             share_obs = obs
 
@@ -213,14 +266,15 @@ class EnvRunner(Runner):
 
         for eval_step in range(self.episode_length):
             self.trainer.prep_rollout()
-            eval_action, eval_rnn_states = self.trainer.policy.act(
+            eval_action, recurrent_states = self.trainer.policy.act(
                 np.concatenate(eval_obs),
-                np.concatenate(eval_rnn_states),
-                np.concatenate(eval_masks),
+                np.concatenate(eval_rnn_states) if self.recurrent else None,
+                np.concatenate(eval_masks) if self.recurrent else None,
                 deterministic=True,
             )
             eval_actions = np.array(np.split(_t2n(eval_action), self.n_eval_rollout_threads))
-            eval_rnn_states = np.array(np.split(_t2n(eval_rnn_states), self.n_eval_rollout_threads))
+            if self.recurrent:
+                eval_rnn_states = np.array(np.split(_t2n(recurrent_states), self.n_eval_rollout_threads))
 
             if self.eval_envs.action_space[0].__class__.__name__ == "MultiDiscrete":
                 for i in range(self.eval_envs.action_space[0].shape):
@@ -240,10 +294,7 @@ class EnvRunner(Runner):
             eval_obs, eval_rewards, eval_dones, eval_infos = self.eval_envs.step(eval_actions_env)
             eval_episode_rewards.append(eval_rewards)
 
-            eval_rnn_states[eval_dones == True] = np.zeros(
-                ((eval_dones == True).sum(), self.recurrent_N, self.hidden_size),
-                dtype=np.float32,
-            )
+            eval_rnn_states[eval_dones == True] = 0.0
             eval_masks = np.ones((self.n_eval_rollout_threads, self.num_agents, 1), dtype=np.float32)
             eval_masks[eval_dones == True] = np.zeros(((eval_dones == True).sum(), 1), dtype=np.float32)
 
@@ -285,14 +336,15 @@ class EnvRunner(Runner):
                 calc_start = time.time()
 
                 self.trainer.prep_rollout()
-                action, rnn_states = self.trainer.policy.act(
+                action, recurrent_states = self.trainer.policy.act(
                     np.concatenate(obs),
-                    np.concatenate(rnn_states),
-                    np.concatenate(masks),
+                    np.concatenate(rnn_states) if self.recurrent else None,
+                    np.concatenate(masks) if self.recurrent else None,
                     deterministic=True,
                 )
                 actions = np.array(np.split(_t2n(action), self.n_rollout_threads))
-                rnn_states = np.array(np.split(_t2n(rnn_states), self.n_rollout_threads))
+                if self.recurrent:
+                    rnn_states = np.array(np.split(_t2n(recurrent_states), self.n_rollout_threads))
 
                 if envs.action_space[0].__class__.__name__ == "MultiDiscrete":
                     for i in range(envs.action_space[0].shape):
@@ -4,11 +4,14 @@ from pathlib import Path
 import numpy as np
 import setproctitle
 import torch
+import torch.distributed as dist
 
 from mappo.config import get_config
 from mappo.envs.env_continuous import ContinuousActionEnv
 from mappo.envs.env_wrappers import DummyVecEnv
+from mappo.runner.async_runner import AsyncEnvRunner
 from mappo.runner.env_runner import EnvRunner
+from mappo.utils.distributed import broadcast_object, get_rank
 
 
 def make_train_env(all_args):
@@ -45,6 +48,42 @@ def parse_args(args, parser):
     return all_args
 
 
+def make_run_dir(all_args):
+    """
+    Create the directory of a new run of the experiment, or find the latest one with --resume.
+    :param all_args: (argparse.Namespace) arguments of the run.
+
+    :return run_dir: (Path) directory of the run.
+    """
+    run_dir = (
+            Path(os.path.split(os.path.dirname(os.path.abspath(__file__)))[0] + "/results")
+            / all_args.env_name
+            / all_args.scenario_name
+            / all_args.algorithm_name
+            / all_args.experiment_name
+    )
+    if not run_dir.exists():
+        os.makedirs(str(run_dir))
+
+    if not run_dir.exists():
+        curr_run = "run1"
+    else:
+        exst_run_nums = [
+            int(str(folder.name).split("run")[1])
+            for folder in run_dir.iterdir()
+            if str(folder.name).startswith("run")
+        ]
+        if len(exst_run_nums) == 0:
+            curr_run = "run1"
+        else:
+            # a resumed run continues in the directory of the latest run
+            curr_run = "run%i" % (max(exst_run_nums) + (0 if all_args.resume else 1))
+    run_dir = run_dir / curr_run
+    if not run_dir.exists():
+        os.makedirs(str(run_dir))
+    return run_dir
+
+
 def main(args):
     parser = get_config()
     all_args = parse_args(args, parser)
@@ -75,32 +114,13 @@ def main(args):
         device = torch.device("cpu")
         torch.set_num_threads(all_args.n_training_threads)
 
-    # run dir
-    run_dir = (
-            Path(os.path.split(os.path.dirname(os.path.abspath(__file__)))[0] + "/results")
-            / all_args.env_name
-            / all_args.scenario_name
-            / all_args.algorithm_name
-            / all_args.experiment_name
-    )
-    if not run_dir.exists():
-        os.makedirs(str(run_dir))
+    # data parallel training, launched by torchrun, which sets the rank and world size of every process
+    if all_args.use_distributed:
+        dist.init_process_group("gloo")
+    rank = get_rank()
 
-    if not run_dir.exists():
-        curr_run = "run1"
-    else:
-        exst_run_nums = [
-            int(str(folder.name).split("run")[1])
-            for folder in run_dir.iterdir()
-            if str(folder.name).startswith("run")
-        ]
-        if len(exst_run_nums) == 0:
-            curr_run = "run1"
-        else:
-            curr_run = "run%i" % (max(exst_run_nums) + 1)
-    run_dir = run_dir / curr_run
-    if not run_dir.exists():
-        os.makedirs(str(run_dir))
+    # run dir, chosen by rank 0 for all ranks
+    run_dir = broadcast_object(make_run_dir(all_args) if rank == 0 else None)
 
     setproctitle.setproctitle(
         str(all_args.algorithm_name)
@@ -112,7 +132,8 @@ def main(args):
         + str(all_args.user_name)
     )
 
-    # seed
+    # seed, the ranks collect different rollouts, the networks of rank 0 are broadcast to the others
+    all_args.seed += 100000 * rank
     torch.manual_seed(all_args.seed)
     torch.cuda.manual_seed_all(all_args.seed)
     np.random.seed(all_args.seed)
@@ -131,7 +152,8 @@ def main(args):
         "run_dir": run_dir,
     }
 
-    runner = EnvRunner(config)
+    # the updates run while worker processes collect the rollouts with num_rollout_workers
+    runner = AsyncEnvRunner(config) if all_args.num_rollout_workers > 0 else EnvRunner(config)
     runner.run()
 
     # post process
@@ -139,5 +161,8 @@ def main(args):
     if all_args.use_eval and eval_envs is not envs:
         eval_envs.close()
 
-    runner.writer.export_scalars_to_json(str(runner.log_dir + "/summary.json"))
-    runner.writer.close()
+    if rank == 0:
+        runner.writer.export_scalars_to_json(str(runner.log_dir + "/summary.json"))
+        runner.writer.close()
+    if all_args.use_distributed:
+        dist.destroy_process_group()
@@ -0,0 +1,93 @@
+import copy
+import os
+import queue
+import threading
+
+import numpy as np
+import torch
+
+
+def snapshot(obj):
+    """
+    Copy a checkpoint state, so that it can be written while training goes on.
+    Tensors are copied to the CPU, numpy arrays are copied, containers are copied recursively and other objects,
+    e.g. envs, are deep copied.
+    :param obj: the state to copy.
+
+    :return copied: the copied state.
+    """
+    if isinstance(obj, torch.Tensor):
+        return obj.detach().to("cpu", copy=True)
+    if isinstance(obj, np.ndarray):
+        return np.array(obj)
+    if isinstance(obj, dict):
+        return {k: snapshot(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(snapshot(v) for v in obj)
+    return copy.deepcopy(obj)
+
+
+def save_atomic(state, path):
+    """
+    Save a state with torch.save, so that path holds either the previous or the new file, even if interrupted.
+    :param state: the state to save.
+    :param path: (str) destination file path.
+    """
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        torch.save(state, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+class CheckpointWriter(object):
+    """
+    Writes checkpoints atomically from a background thread, so that training does not wait for the disk.
+    A checkpoint submitted while the previous one is still being written waits for it, at most one is pending.
+    :param path: (str) path of the checkpoint file, overwritten by every checkpoint.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.error = None
+        self._queue = queue.Queue(maxsize=1)
+        self._thread = threading.Thread(target=self._work, name="checkpoint-writer", daemon=True)
+        self._thread.start()
+
+    def _work(self):
+        while True:
+            state = self._queue.get()
+            try:
+                if state is None:
+                    return
+                save_atomic(state, self.path)
+            except Exception as e:
+                self.error = e
+            finally:
+                self._queue.task_done()
+
+    def _check(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise RuntimeError("writing checkpoint {} failed".format(self.path)) from error
+
+    def submit(self, state):
+        """
+        Write a checkpoint in the background.
+        :param state: (dict) the state to save, it is copied before this returns, see snapshot.
+        """
+        self._check()
+        self._queue.put(snapshot(state))
+
+    def wait(self):
+        """Wait until the submitted checkpoints are written."""
+        self._queue.join()
+        self._check()
+
+    def close(self):
+        """Write the submitted checkpoints and stop the thread."""
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+        self._check()
@@ -0,0 +1,155 @@
+import numpy as np
+
+from mappo.utils.shared_buffer import SharedReplayBuffer
+
+# the observation of a vehicle, see environ.core.Environ: itself, the other 6 vehicles and the 6 humans
+# offline vehicles and humans, as well as offline observers, are zero filled slots
+OBS_SLOTS = (5,) + (8,) * 6 + (4,) * 6
+OBS_DIM = sum(OBS_SLOTS)
+
+
+class CompactObs(object):
+    """
+    Observations stored as a presence mask of their slots and the values of the present slots only, so the memory
+    follows the occupancy of the scenarios. A slot is absent when all of its values are zero, which makes the
+    encoding lossless. Steps are read and written like the dense array of shape (steps, threads, agents, dim) it
+    replaces, and writing step 0 starts a new rollout, which recycles the storage of the previous one.
+    :param shape: (tuple) shape of the dense array.
+    :param slots: (tuple) sizes of the slots of the last dimension.
+    """
+
+    def __init__(self, shape, slots):
+        assert sum(slots) == shape[-1], "slots ({}) do not add up to the dimension {}".format(slots, shape[-1])
+        self.shape = tuple(shape)
+        self._starts = np.cumsum((0, *slots[:-1]))
+        # slot of each value of an observation
+        self._slot_of = np.repeat(np.arange(len(slots)), slots)
+
+        self.presence = np.zeros((*self.shape[:-1], len(slots)), dtype=bool)
+        # start of the values of each observation, the observations of a step are contiguous
+        self.offsets = np.zeros(self.shape[:-1], dtype=np.int64)
+        self.values = np.zeros(0, dtype=np.float32)
+        self.size = 0
+
+    def __len__(self):
+        return self.shape[0]
+
+    @property
+    def nbytes(self):
+        return self.presence.nbytes + self.offsets.nbytes + self.values.nbytes
+
+    def __setitem__(self, step, obs):
+        step = range(len(self))[step]
+        obs = np.broadcast_to(np.asarray(obs, dtype=np.float32), self.shape[1:])
+        if step == 0:
+            self.size = 0
+
+        present = np.logical_or.reduceat(obs != 0, self._starts, axis=-1)
+        keep = present[..., self._slot_of]
+        packed = obs[keep]
+        counts = keep.sum(axis=-1)
+
+        if self.size + len(packed) > len(self.values):
+            # grows by a quarter, the storage of later rollouts is recycled
+            values = np.zeros(max(len(self.values) + len(self.values) // 4, self.size + len(packed)), dtype=np.float32)
+            values[:self.size] = self.values[:self.size]
+            self.values = values
+        self.values[self.size:self.size + len(packed)] = packed
+        self.presence[step] = present
+        self.offsets[step] = self.size + np.cumsum(counts).reshape(counts.shape) - counts
+        self.size += len(packed)
+
+    def _decode(self, step):
+        keep = self.presence[step][..., self._slot_of]
+        start = self.offsets[step].flat[0]
+        dense = np.zeros(self.shape[1:], dtype=np.float32)
+        dense[keep] = self.values[start:start + np.count_nonzero(keep)]
+        return dense
+
+    def __getitem__(self, index):
+        """
+        Decode a step, or a slice of steps, to new dense observations. The generators gather rows instead, see rows.
+        :param index: (int or slice) the step or steps.
+
+        :return obs: (np.ndarray) dense observations.
+        """
+        if not isinstance(index, slice):
+            return self._decode(range(len(self))[index])
+        return np.stack([self._decode(step) for step in range(*index.indices(len(self)))])
+
+    def rows(self, steps):
+        """
+        The observations of the first steps flattened to rows, decoded only when gathered.
+        :param steps: (int) number of steps.
+
+        :return rows: (CompactRows) the rows.
+        """
+        return CompactRows(self, steps)
+
+
+class CompactRows(object):
+    """
+    Observations of the first steps of a CompactObs flattened to rows of (steps, threads, agents), the counterpart
+    of a dense field flattened for the generators. Only the gathered rows are decoded, see take.
+    :param obs: (CompactObs) the observations.
+    :param steps: (int) number of steps.
+    """
+
+    # rows decoded at once, which bounds the temporary index arrays
+    block = 4096
+
+    def __init__(self, obs, steps):
+        self.obs = obs
+        self.presence = obs.presence[:steps].reshape(-1, obs.presence.shape[-1])
+        self.offsets = obs.offsets[:steps].reshape(-1)
+        self.shape = (len(self.offsets), obs.shape[-1])
+
+    def __len__(self):
+        return self.shape[0]
+
+    def take(self, indices, out):
+        """
+        Decode rows into an array.
+        :param indices: (np.ndarray) the rows.
+        :param out: (np.ndarray) destination of shape (len(indices), dim).
+
+        :return out: (np.ndarray) out.
+        """
+        for start in range(0, len(indices), self.block):
+            rows = indices[start:start + self.block]
+            keep = self.presence[rows][:, self.obs._slot_of]
+            # the values of an observation are contiguous from its offset, in the order of its kept entries
+            positions = self.offsets[rows][:, None] + np.cumsum(keep, axis=1) - 1
+            dense = out[start:start + len(rows)]
+            dense.fill(0.0)
+            dense[keep] = self.obs.values[positions[keep]]
+        return out
+
+
+class CompactReplayBuffer(SharedReplayBuffer):
+    """
+    SharedReplayBuffer that stores obs and share_obs as CompactObs, the other fields are dense.
+    The generators decode only the gathered minibatch rows, the rollout is never decoded as a whole.
+    :param args: (argparse.Namespace) arguments containing relevant model, policy, and env information.
+    :param num_agents: (int) number of agents in the env.
+    :param obs_space: (gym.Space) observation space of agents.
+    :param cent_obs_space: (gym.Space) centralized observation space of agents.
+    :param act_space: (gym.Space) action space for agents.
+    """
+
+    def _allocate(self, name, shape, fill=0.0):
+        if name in ("obs", "share_obs") and shape[-1] % OBS_DIM == 0:
+            # a centralized observation is the concatenation of the observations of all agents
+            return CompactObs(shape, OBS_SLOTS * (shape[-1] // OBS_DIM))
+        return super(CompactReplayBuffer, self)._allocate(name, shape, fill)
+
+    @staticmethod
+    def _rows(field):
+        if isinstance(field, CompactObs):
+            return field.rows(len(field) - 1)
+        return SharedReplayBuffer._rows(field)
+
+    def _stage(self, name, source, indices):
+        if isinstance(source, CompactRows):
+            return source.take(indices, self._staging_array(name, (len(indices), *source.shape[1:])))
+        return super(CompactReplayBuffer, self)._stage(name, source, indices)
@@ -0,0 +1,98 @@
+import torch
+import torch.distributed as dist
+
+
+def get_rank():
+    """Rank of this process, 0 without distributed training."""
+    return dist.get_rank() if dist.is_available() and dist.is_initialized() else 0
+
+
+def get_world_size():
+    """Number of processes training together, 1 without distributed training."""
+    return dist.get_world_size() if dist.is_available() and dist.is_initialized() else 1
+
+
+def broadcast_object(obj, src=0):
+    """
+    Send a picklable object from a rank to all ranks.
+    :param obj: the object on src, ignored on the other ranks.
+    :param src: (int) rank of the object.
+
+    :return obj: the object of src.
+    """
+    if get_world_size() == 1:
+        return obj
+    objects = [obj]
+    dist.broadcast_object_list(objects, src=src)
+    return objects[0]
+
+
+def gather_object(obj, dst=0):
+    """
+    Collect a picklable object of every rank on a rank.
+    :param obj: the object of this rank.
+    :param dst: (int) rank collecting the objects.
+
+    :return objects: (list) the objects by rank on dst, None on the other ranks.
+    """
+    if get_world_size() == 1:
+        return [obj]
+    objects = [None] * get_world_size() if get_rank() == dst else None
+    dist.gather_object(obj, objects, dst=dst)
+    return objects
+
+
+@torch.no_grad()
+def broadcast_module(module, src=0):
+    """
+    Overwrite the parameters and buffers of a module with the ones of a rank, in place.
+    :param module: (nn.Module) a module of the same architecture on every rank.
+    :param src: (int) rank of the values.
+    """
+    if get_world_size() == 1:
+        return
+    for tensor in module.state_dict().values():
+        dist.broadcast(tensor, src=src)
+
+
+@torch.no_grad()
+def all_reduce_gradients(parameters):
+    """
+    Average the gradients over the ranks in place, with a single all-reduce of their concatenation.
+    :param parameters: (iterable) parameters, the ones without gradient are skipped on every rank alike.
+    """
+    if get_world_size() == 1:
+        return
+    grads = [p.grad for p in parameters if p.grad is not None]
+    if len(grads) == 0:
+        return
+    flat = torch.cat([grad.reshape(-1) for grad in grads])
+    dist.all_reduce(flat)
+    flat /= get_world_size()
+    for grad, reduced in zip(grads, flat.split([grad.numel() for grad in grads])):
+        grad.copy_(reduced.view_as(grad))
+
+
+@torch.no_grad()
+def all_reduce_moments(x, mask, mean, mean_sq, axes):
+    """
+    Mean and mean of squares over the batches of all ranks, from the moments of each batch, see masked_moments.
+    The batches are weighted by the number of their included entries.
+    :param x: (torch.Tensor) the batch of this rank.
+    :param mask: (torch.Tensor) broadcastable to x, zero for the excluded entries, None includes all.
+    :param mean: (torch.Tensor) mean of the included entries of x.
+    :param mean_sq: (torch.Tensor) mean of the squares of the included entries of x.
+    :param axes: (tuple) the reduced axes.
+
+    :return mean: (torch.Tensor) mean over all ranks.
+    :return mean_sq: (torch.Tensor) mean of the squares over all ranks.
+    """
+    if get_world_size() == 1:
+        return mean, mean_sq
+    if mask is None:
+        count = torch.full_like(mean, float(torch.Size(x.shape[i] for i in axes).numel()))
+    else:
+        count = (mask != 0).to(x.dtype).expand_as(x).sum(axes)
+    totals = torch.stack([mean * count, mean_sq * count, count])
+    dist.all_reduce(totals)
+    return totals[0] / totals[2], totals[1] / totals[2]
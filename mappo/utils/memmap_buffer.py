@@ -0,0 +1,57 @@
+import mmap
+import os
+
+import numpy as np
+
+from mappo.utils.distributed import get_rank, get_world_size
+from mappo.utils.shared_buffer import SharedReplayBuffer
+
+
+class MemmapReplayBuffer(SharedReplayBuffer):
+    """
+    SharedReplayBuffer whose arrays are memory-mapped from a file, so the rollout is paged by the OS instead of
+    being held in RAM. Every field starts at a page aligned offset of the file, which grows sparsely as fields are
+    allocated.
+    :param args: (argparse.Namespace) arguments containing relevant model, policy, and env information.
+    :param num_agents: (int) number of agents in the env.
+    :param obs_space: (gym.Space) observation space of agents.
+    :param cent_obs_space: (gym.Space) centralized observation space of agents.
+    :param act_space: (gym.Space) action space for agents.
+    :param directory: (str) directory of the buffer file, buffer.bin or buffer_rank<rank>.bin with distributed
+                      training, an existing buffer file is overwritten.
+    """
+
+    def __init__(self, args, num_agents, obs_space, cent_obs_space, act_space, directory):
+        os.makedirs(directory, exist_ok=True)
+        # the ranks of a distributed run share the directory, each maps its own file
+        name = "buffer.bin" if get_world_size() == 1 else "buffer_rank{}.bin".format(get_rank())
+        self.path = os.path.join(directory, name)
+        # name -> (offset, shape) of each field in the file
+        self.layout = {}
+        open(self.path, "wb").close()
+        super(MemmapReplayBuffer, self).__init__(args, num_agents, obs_space, cent_obs_space, act_space)
+
+    def _allocate(self, name, shape, fill=0.0):
+        """
+        Map the float32 array of a field from the next page aligned offset of the file.
+        :param name: (str) name of the field.
+        :param shape: (tuple) shape of the array.
+        :param fill: (float) initial value of the array.
+
+        :return array: (np.memmap) the mapped array.
+        """
+        size = os.path.getsize(self.path)
+        offset = -(-size // mmap.ALLOCATIONGRANULARITY) * mmap.ALLOCATIONGRANULARITY
+        nbytes = int(np.prod(shape)) * np.dtype(np.float32).itemsize
+        if nbytes == 0:
+            # an empty region can not be mapped
+            return np.zeros(shape, dtype=np.float32)
+
+        with open(self.path, "r+b") as f:
+            # the extension is a hole in the file, read as zeros without using disk space
+            f.truncate(offset + nbytes)
+        array = np.memmap(self.path, dtype=np.float32, mode="r+", offset=offset, shape=shape)
+        if fill:
+            array.fill(fill)
+        self.layout[name] = (offset, shape)
+        return array
@@ -0,0 +1,166 @@
+import cProfile
+import os
+import time
+from collections import defaultdict
+
+import torch
+
+
+class _Phase(object):
+    """Context of a phase of PhaseTimer."""
+
+    def __init__(self, timer, name):
+        self.timer = timer
+        self.name = name
+        self.record = None
+
+    def __enter__(self):
+        if self.timer.record:
+            self.record = torch.profiler.record_function(self.name)
+            self.record.__enter__()
+        if self.timer.synchronize:
+            torch.cuda.synchronize()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        if self.timer.synchronize:
+            torch.cuda.synchronize()
+        self.timer.add(self.name, time.perf_counter() - self.start)
+        if self.record is not None:
+            self.record.__exit__(*exc)
+        return False
+
+
+class _NullPhase(object):
+    """Context of a phase of a disabled PhaseTimer, it does nothing."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_PHASE = _NullPhase()
+
+
+class PhaseTimer(object):
+    """
+    Accumulates the wall time of the named phases of the episodes, e.g. collect and backward.
+    The phases may nest, e.g. the backward phases of an update are part of its train phase, and a phase may be
+    entered several times per episode, its times are summed.
+    :param enabled: (bool) whether to time the phases, a disabled timer costs a method call per phase.
+    :param device: (torch.device) the device is synchronized around the phases if it is a GPU, so that the times
+                   include its work.
+    """
+
+    def __init__(self, enabled=False, device=torch.device("cpu")):
+        self.enabled = enabled
+        self.synchronize = enabled and device.type == "cuda"
+        # label the phases in a torch profiler trace, see EpisodeProfiler
+        self.record = False
+        self.episodes = 0
+        self.totals = defaultdict(float)
+        self._interval_episodes = 0
+        self._interval_totals = defaultdict(float)
+
+    def phase(self, name):
+        """
+        Time a phase with a with statement.
+        :param name: (str) name of the phase.
+        """
+        if not (self.enabled or self.record):
+            return _NULL_PHASE
+        return _Phase(self, name)
+
+    def add(self, name, seconds):
+        if self.enabled:
+            self.totals[name] += seconds
+            self._interval_totals[name] += seconds
+
+    def step(self):
+        """Finish an episode."""
+        if self.enabled:
+            self.episodes += 1
+            self._interval_episodes += 1
+
+    def pop(self):
+        """
+        Mean times of the episodes finished since the last call.
+
+        :return times: (dict) mean seconds per episode of each phase, keyed by time_<phase>.
+        """
+        times = {"time_" + name: seconds / max(self._interval_episodes, 1)
+                 for name, seconds in self._interval_totals.items()}
+        self._interval_episodes = 0
+        self._interval_totals = defaultdict(float)
+        return times
+
+    def summary(self):
+        """
+        Times of all finished episodes.
+
+        :return summary: (dict) number of episodes, and the total and mean seconds per episode of each phase.
+        """
+        return {
+            "episodes": self.episodes,
+            "phases": {name: {"total_seconds": seconds, "seconds_per_episode": seconds / max(self.episodes, 1)}
+                       for name, seconds in sorted(self.totals.items())},
+        }
+
+
+class EpisodeProfiler(object):
+    """
+    Captures a profile of a range of episodes, with torch.profiler or cProfile.
+    torch.profiler writes a chrome trace to trace.json and a table of the slowest operators to profile.txt, where
+    the phases of a PhaseTimer are labelled. cProfile writes pstats to profile.prof.
+    :param kind: (str) "torch" or "cprofile".
+    :param episodes: (tuple) first and last captured episode, None captures nothing.
+    :param directory: (str) directory of the output files.
+    :param timer: (PhaseTimer) timer whose phases are labelled in the torch trace.
+    """
+
+    def __init__(self, kind, episodes, directory, timer=None):
+        self.kind = kind
+        self.start, self.stop = episodes if episodes is not None else (None, None)
+        self.directory = directory
+        self.timer = timer
+        self.profile = None
+
+    def begin(self, episode):
+        """Start capturing if the episode is the first captured one."""
+        if episode != self.start:
+            return
+        if self.kind == "torch":
+            activities = [torch.profiler.ProfilerActivity.CPU]
+            if torch.cuda.is_available():
+                activities.append(torch.profiler.ProfilerActivity.CUDA)
+            self.profile = torch.profiler.profile(activities=activities)
+            self.profile.__enter__()
+            if self.timer is not None:
+                self.timer.record = True
+        else:
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+
+    def end(self, episode):
+        """Stop capturing and write the profile if the episode is the last captured one."""
+        if episode == self.stop:
+            self.close()
+
+    def close(self):
+        """Stop capturing and write the profile, if capturing."""
+        if self.profile is None:
+            return
+        if self.kind == "torch":
+            self.profile.__exit__(None, None, None)
+            if self.timer is not None:
+                self.timer.record = False
+            self.profile.export_chrome_trace(os.path.join(self.directory, "trace.json"))
+            with open(os.path.join(self.directory, "profile.txt"), "w") as f:
+                f.write(self.profile.key_averages().table(sort_by="self_cpu_time_total", row_limit=50))
+        else:
+            self.profile.disable()
+            self.profile.dump_stats(os.path.join(self.directory, "profile.prof"))
+        self.profile = None
@@ -1,7 +1,7 @@
 import numpy as np
 import torch
 
-from mappo.utils.util import get_shape_from_obs_space, get_shape_from_act_space
+from mappo.utils.util import get_shape_from_obs_space, get_shape_from_act_space, reverse_discounted_sum
 
 
 def _flatten(T, N, x):
@@ -64,112 +64,83 @@ class SeparatedReplayBuffer(object):
 
     def insert(self, share_obs, obs, rnn_states, rnn_states_critic, actions, action_log_probs,
                value_preds, rewards, masks, bad_masks=None, active_masks=None, available_actions=None):
-        self.share_obs[self.step + 1] = share_obs.copy()
-        self.obs[self.step + 1] = obs.copy()
-        self.rnn_states[self.step + 1] = rnn_states.copy()
-        self.rnn_states_critic[self.step + 1] = rnn_states_critic.copy()
-        self.actions[self.step] = actions.copy()
-        self.action_log_probs[self.step] = action_log_probs.copy()
-        self.value_preds[self.step] = value_preds.copy()
-        self.rewards[self.step] = rewards.copy()
-        self.masks[self.step + 1] = masks.copy()
+        self.share_obs[self.step + 1] = share_obs
+        self.obs[self.step + 1] = obs
+        self.rnn_states[self.step + 1] = rnn_states
+        self.rnn_states_critic[self.step + 1] = rnn_states_critic
+        self.actions[self.step] = actions
+        self.action_log_probs[self.step] = action_log_probs
+        self.value_preds[self.step] = value_preds
+        self.rewards[self.step] = rewards
+        self.masks[self.step + 1] = masks
         if bad_masks is not None:
-            self.bad_masks[self.step + 1] = bad_masks.copy()
+            self.bad_masks[self.step + 1] = bad_masks
         if active_masks is not None:
-            self.active_masks[self.step + 1] = active_masks.copy()
+            self.active_masks[self.step + 1] = active_masks
         if available_actions is not None:
-            self.available_actions[self.step + 1] = available_actions.copy()
+            self.available_actions[self.step + 1] = available_actions
 
         self.step = (self.step + 1) % self.episode_length
 
     def chooseinsert(self, share_obs, obs, rnn_states, rnn_states_critic, actions, action_log_probs,
                      value_preds, rewards, masks, bad_masks=None, active_masks=None, available_actions=None):
-        self.share_obs[self.step] = share_obs.copy()
-        self.obs[self.step] = obs.copy()
-        self.rnn_states[self.step + 1] = rnn_states.copy()
-        self.rnn_states_critic[self.step + 1] = rnn_states_critic.copy()
-        self.actions[self.step] = actions.copy()
-        self.action_log_probs[self.step] = action_log_probs.copy()
-        self.value_preds[self.step] = value_preds.copy()
-        self.rewards[self.step] = rewards.copy()
-        self.masks[self.step + 1] = masks.copy()
+        self.share_obs[self.step] = share_obs
+        self.obs[self.step] = obs
+        self.rnn_states[self.step + 1] = rnn_states
+        self.rnn_states_critic[self.step + 1] = rnn_states_critic
+        self.actions[self.step] = actions
+        self.action_log_probs[self.step] = action_log_probs
+        self.value_preds[self.step] = value_preds
+        self.rewards[self.step] = rewards
+        self.masks[self.step + 1] = masks
         if bad_masks is not None:
-            self.bad_masks[self.step + 1] = bad_masks.copy()
+            self.bad_masks[self.step + 1] = bad_masks
         if active_masks is not None:
-            self.active_masks[self.step] = active_masks.copy()
+            self.active_masks[self.step] = active_masks
         if available_actions is not None:
-            self.available_actions[self.step] = available_actions.copy()
+            self.available_actions[self.step] = available_actions
 
         self.step = (self.step + 1) % self.episode_length
 
     def after_update(self):
-        self.share_obs[0] = self.share_obs[-1].copy()
-        self.obs[0] = self.obs[-1].copy()
-        self.rnn_states[0] = self.rnn_states[-1].copy()
-        self.rnn_states_critic[0] = self.rnn_states_critic[-1].copy()
-        self.masks[0] = self.masks[-1].copy()
-        self.bad_masks[0] = self.bad_masks[-1].copy()
-        self.active_masks[0] = self.active_masks[-1].copy()
+        self.share_obs[0] = self.share_obs[-1]
+        self.obs[0] = self.obs[-1]
+        self.rnn_states[0] = self.rnn_states[-1]
+        self.rnn_states_critic[0] = self.rnn_states_critic[-1]
+        self.masks[0] = self.masks[-1]
+        self.bad_masks[0] = self.bad_masks[-1]
+        self.active_masks[0] = self.active_masks[-1]
         if self.available_actions is not None:
-            self.available_actions[0] = self.available_actions[-1].copy()
+            self.available_actions[0] = self.available_actions[-1]
 
     def chooseafter_update(self):
-        self.rnn_states[0] = self.rnn_states[-1].copy()
-        self.rnn_states_critic[0] = self.rnn_states_critic[-1].copy()
-        self.masks[0] = self.masks[-1].copy()
-        self.bad_masks[0] = self.bad_masks[-1].copy()
+        self.rnn_states[0] = self.rnn_states[-1]
+        self.rnn_states_critic[0] = self.rnn_states_critic[-1]
+        self.masks[0] = self.masks[-1]
+        self.bad_masks[0] = self.bad_masks[-1]
 
     def compute_returns(self, next_value, value_normalizer=None):
-        if self._use_proper_time_limits:
-            if self._use_gae:
-                self.value_preds[-1] = next_value
-                gae = 0
-                for step in reversed(range(self.rewards.shape[0])):
-                    if self._use_popart or self._use_valuenorm:
-                        delta = self.rewards[step] + self.gamma * value_normalizer.denormalize(self.value_preds[
-                                                                                                   step + 1]) * \
-                                self.masks[step + 1] - value_normalizer.denormalize(self.value_preds[step])
-                        gae = delta + self.gamma * self.gae_lambda * self.masks[step + 1] * gae
-                        gae = gae * self.bad_masks[step + 1]
-                        self.returns[step] = gae + value_normalizer.denormalize(self.value_preds[step])
-                    else:
-                        delta = self.rewards[step] + self.gamma * self.value_preds[step + 1] * self.masks[step + 1] - \
-                                self.value_preds[step]
-                        gae = delta + self.gamma * self.gae_lambda * self.masks[step + 1] * gae
-                        gae = gae * self.bad_masks[step + 1]
-                        self.returns[step] = gae + self.value_preds[step]
-            else:
-                self.returns[-1] = next_value
-                for step in reversed(range(self.rewards.shape[0])):
-                    if self._use_popart:
-                        self.returns[step] = (self.returns[step + 1] * self.gamma * self.masks[step + 1] + self.rewards[
-                            step]) * self.bad_masks[step + 1] \
-                                             + (1 - self.bad_masks[step + 1]) * value_normalizer.denormalize(
-                            self.value_preds[step])
-                    else:
-                        self.returns[step] = (self.returns[step + 1] * self.gamma * self.masks[step + 1] + self.rewards[
-                            step]) * self.bad_masks[step + 1] \
-                                             + (1 - self.bad_masks[step + 1]) * self.value_preds[step]
+        if self._use_gae:
+            self.value_preds[-1] = next_value
+            # denormalize all steps at once instead of twice per step
+            values = value_normalizer.denormalize(self.value_preds) if self._use_popart or self._use_valuenorm \
+                else self.value_preds
+            deltas = self.rewards + self.gamma * values[1:] * self.masks[1:] - values[:-1]
+            discounts = self.gamma * self.gae_lambda * self.masks[1:]
+            if self._use_proper_time_limits:
+                deltas *= self.bad_masks[1:]
+                discounts = discounts * self.bad_masks[1:]
+            self.returns[:-1] = reverse_discounted_sum(deltas, discounts) + values[:-1]
         else:
-            if self._use_gae:
-                self.value_preds[-1] = next_value
-                gae = 0
-                for step in reversed(range(self.rewards.shape[0])):
-                    if self._use_popart or self._use_valuenorm:
-                        delta = self.rewards[step] + self.gamma * value_normalizer.denormalize(
-                            self.value_preds[step + 1]) * self.masks[step + 1] - value_normalizer.denormalize(
-                            self.value_preds[step])
-                        gae = delta + self.gamma * self.gae_lambda * self.masks[step + 1] * gae
-                        self.returns[step] = gae + value_normalizer.denormalize(self.value_preds[step])
-                    else:
-                        delta = self.rewards[step] + self.gamma * self.value_preds[step + 1] * self.masks[step + 1] - \
-                                self.value_preds[step]
-                        gae = delta + self.gamma * self.gae_lambda * self.masks[step + 1] * gae
-                        self.returns[step] = gae + self.value_preds[step]
-            else:
-                self.returns[-1] = next_value
-                for step in reversed(range(self.rewards.shape[0])):
-                    self.returns[step] = self.returns[step + 1] * self.gamma * self.masks[step + 1] + self.rewards[step]
+            self.returns[-1] = next_value
+            deltas = self.rewards
+            discounts = self.gamma * self.masks[1:]
+            if self._use_proper_time_limits:
+                values = value_normalizer.denormalize(self.value_preds[:-1]) if self._use_popart \
+                    else self.value_preds[:-1]
+                deltas = self.rewards * self.bad_masks[1:] + (1 - self.bad_masks[1:]) * values
+                discounts = discounts * self.bad_masks[1:]
+            self.returns[:-1] = reverse_discounted_sum(deltas, discounts, self.returns[-1])
 
     def feed_forward_generator(self, advantages, num_mini_batch=None, mini_batch_size=None):
         episode_length, n_rollout_threads = self.rewards.shape[0:2]
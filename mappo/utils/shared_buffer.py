@@ -1,15 +1,7 @@
 import numpy as np
 import torch
 
-from mappo.utils.util import get_shape_from_obs_space, get_shape_from_act_space
-
-
-def _flatten(T, N, x):
-    return x.reshape(T * N, *x.shape[2:])
-
-
-def _cast(x):
-    return x.transpose(1, 2, 0, 3).reshape(-1, *x.shape[3:])
+from mappo.utils.util import get_shape_from_obs_space, get_shape_from_act_space, reverse_discounted_sum
 
 
 class SharedReplayBuffer(object):
@@ -33,6 +25,9 @@ class SharedReplayBuffer(object):
         self._use_popart = args.use_popart
         self._use_valuenorm = args.use_valuenorm
         self._use_proper_time_limits = args.use_proper_time_limits
+        self._use_shared_critic = args.use_shared_critic
+        self._recurrent = args.use_recurrent_policy or args.use_naive_recurrent_policy
+        self.num_agents = num_agents
 
         obs_shape = get_shape_from_obs_space(obs_space)
         share_obs_shape = get_shape_from_obs_space(cent_obs_space)
@@ -43,48 +38,69 @@ class SharedReplayBuffer(object):
         if type(share_obs_shape[-1]) == list:
             share_obs_shape = share_obs_shape[:1]
 
-        self.share_obs = np.zeros((self.episode_length + 1, self.n_rollout_threads, num_agents, *share_obs_shape),
-                                  dtype=np.float32)
-        self.obs = np.zeros((self.episode_length + 1, self.n_rollout_threads, num_agents, *obs_shape), dtype=np.float32)
+        # a centralized observation is identical for all agents of a thread, so it is stored once per thread
+        # and broadcast to the agents when read, see agent_share_obs
+        share_obs_agents = 1 if args.use_centralized_V else num_agents
+        self.share_obs = self._allocate(
+            "share_obs", (self.episode_length + 1, self.n_rollout_threads, share_obs_agents, *share_obs_shape))
+        self.obs = self._allocate("obs", (self.episode_length + 1, self.n_rollout_threads, num_agents, *obs_shape))
 
-        self.rnn_states = np.zeros(
-            (self.episode_length + 1, self.n_rollout_threads, num_agents, self.recurrent_N, self.hidden_size),
-            dtype=np.float32)
-        self.rnn_states_critic = np.zeros_like(self.rnn_states)
+        # feed-forward policies do not use rnn states, so they are stored with zero width
+        self.rnn_states = self._allocate(
+            "rnn_states", (self.episode_length + 1, self.n_rollout_threads, num_agents, self.recurrent_N,
+                           self.hidden_size if self._recurrent else 0))
+        self.rnn_states_critic = self._allocate("rnn_states_critic", self.rnn_states.shape)
 
-        self.value_preds = np.zeros(
-            (self.episode_length + 1, self.n_rollout_threads, num_agents, 1), dtype=np.float32)
-        self.returns = np.zeros_like(self.value_preds)
+        self.value_preds = self._allocate(
+            "value_preds", (self.episode_length + 1, self.n_rollout_threads, num_agents, 1))
+        self.returns = self._allocate("returns", self.value_preds.shape)
 
         if act_space.__class__.__name__ == 'Discrete':
-            self.available_actions = np.ones((self.episode_length + 1, self.n_rollout_threads, num_agents, act_space.n),
-                                             dtype=np.float32)
+            self.available_actions = self._allocate(
+                "available_actions", (self.episode_length + 1, self.n_rollout_threads, num_agents, act_space.n), 1.0)
         else:
             self.available_actions = None
 
         act_shape = get_shape_from_act_space(act_space)
 
-        self.actions = np.zeros(
-            (self.episode_length, self.n_rollout_threads, num_agents, act_shape), dtype=np.float32)
-        self.action_log_probs = np.zeros(
-            (self.episode_length, self.n_rollout_threads, num_agents, act_shape), dtype=np.float32)
-        self.rewards = np.zeros(
-            (self.episode_length, self.n_rollout_threads, num_agents, 1), dtype=np.float32)
+        self.actions = self._allocate("actions", (self.episode_length, self.n_rollout_threads, num_agents, act_shape))
+        self.action_log_probs = self._allocate(
+            "action_log_probs", (self.episode_length, self.n_rollout_threads, num_agents, act_shape))
+        self.rewards = self._allocate("rewards", (self.episode_length, self.n_rollout_threads, num_agents, 1))
 
-        self.masks = np.ones((self.episode_length + 1, self.n_rollout_threads, num_agents, 1), dtype=np.float32)
-        self.bad_masks = np.ones_like(self.masks)
-        self.active_masks = np.ones_like(self.masks)
+        self.masks = self._allocate("masks", (self.episode_length + 1, self.n_rollout_threads, num_agents, 1), 1.0)
+        self.bad_masks = self._allocate("bad_masks", self.masks.shape, 1.0)
+        self.active_masks = self._allocate("active_masks", self.masks.shape, 1.0)
+
+        # gathered minibatch data reused across epochs, see _stage
+        self._staging = {}
+        # data_chunk_length -> index tables of recurrent_generator, see _chunk_tables
+        self._chunk_table_cache = {}
 
         self.step = 0
 
+    def _allocate(self, name, shape, fill=0.0):
+        """
+        Allocate the float32 array of a field.
+        :param name: (str) name of the field.
+        :param shape: (tuple) shape of the array.
+        :param fill: (float) initial value of the array.
+
+        :return array: (np.ndarray) the allocated array.
+        """
+        array = np.zeros(shape, dtype=np.float32)
+        if fill:
+            array.fill(fill)
+        return array
+
     def insert(self, share_obs, obs, rnn_states_actor, rnn_states_critic, actions, action_log_probs,
                value_preds, rewards, masks, bad_masks=None, active_masks=None, available_actions=None):
         """
         Insert data into the buffer.
-        :param share_obs: (argparse.Namespace) arguments containing relevant model, policy, and env information.
+        :param share_obs: (np.ndarray) centralized observations, only the first agent is kept when use_centralized_V.
         :param obs: (np.ndarray) local agent observations.
-        :param rnn_states_actor: (np.ndarray) RNN states for actor network.
-        :param rnn_states_critic: (np.ndarray) RNN states for critic network.
+        :param rnn_states_actor: (np.ndarray) RNN states for actor network, None for feed-forward policies.
+        :param rnn_states_critic: (np.ndarray) RNN states for critic network, None for feed-forward policies.
         :param actions:(np.ndarray) actions taken by agents.
         :param action_log_probs:(np.ndarray) log probs of actions taken by agents
         :param value_preds: (np.ndarray) value function prediction at each step.
@@ -94,21 +110,23 @@ class SharedReplayBuffer(object):
         :param active_masks: (np.ndarray) denotes whether an agent is active or dead in the env.
         :param available_actions: (np.ndarray) actions available to each agent. If None, all actions are available.
         """
-        self.share_obs[self.step + 1] = share_obs.copy()
-        self.obs[self.step + 1] = obs.copy()
-        self.rnn_states[self.step + 1] = rnn_states_actor.copy()
-        self.rnn_states_critic[self.step + 1] = rnn_states_critic.copy()
-        self.actions[self.step] = actions.copy()
-        self.action_log_probs[self.step] = action_log_probs.copy()
-        self.value_preds[self.step] = value_preds.copy()
-        self.rewards[self.step] = rewards.copy()
-        self.masks[self.step + 1] = masks.copy()
+        self.share_obs[self.step + 1] = share_obs[:, :self.share_obs.shape[2]]
+        self.obs[self.step + 1] = obs
+        if rnn_states_actor is not None:
+            self.rnn_states[self.step + 1] = rnn_states_actor
+        if rnn_states_critic is not None:
+            self.rnn_states_critic[self.step + 1] = rnn_states_critic
+        self.actions[self.step] = actions
+        self.action_log_probs[self.step] = action_log_probs
+        self.value_preds[self.step] = value_preds
+        self.rewards[self.step] = rewards
+        self.masks[self.step + 1] = masks
         if bad_masks is not None:
-            self.bad_masks[self.step + 1] = bad_masks.copy()
+            self.bad_masks[self.step + 1] = bad_masks
         if active_masks is not None:
-            self.active_masks[self.step + 1] = active_masks.copy()
+            self.active_masks[self.step + 1] = active_masks
         if available_actions is not None:
-            self.available_actions[self.step + 1] = available_actions.copy()
+            self.available_actions[self.step + 1] = available_actions
 
         self.step = (self.step + 1) % self.episode_length
 
@@ -116,7 +134,7 @@ class SharedReplayBuffer(object):
                      value_preds, rewards, masks, bad_masks=None, active_masks=None, available_actions=None):
         """
         Insert data into the buffer. This insert function is used specifically for Hanabi, which is turn based.
-        :param share_obs: (argparse.Namespace) arguments containing relevant model, policy, and env information.
+        :param share_obs: (np.ndarray) centralized observations, only the first agent is kept when use_centralized_V.
         :param obs: (np.ndarray) local agent observations.
         :param rnn_states_actor: (np.ndarray) RNN states for actor network.
         :param rnn_states_critic: (np.ndarray) RNN states for critic network.
@@ -129,42 +147,61 @@ class SharedReplayBuffer(object):
         :param active_masks: (np.ndarray) denotes whether an agent is active or dead in the env.
         :param available_actions: (np.ndarray) actions available to each agent. If None, all actions are available.
         """
-        self.share_obs[self.step] = share_obs.copy()
-        self.obs[self.step] = obs.copy()
-        self.rnn_states[self.step + 1] = rnn_states.copy()
-        self.rnn_states_critic[self.step + 1] = rnn_states_critic.copy()
-        self.actions[self.step] = actions.copy()
-        self.action_log_probs[self.step] = action_log_probs.copy()
-        self.value_preds[self.step] = value_preds.copy()
-        self.rewards[self.step] = rewards.copy()
-        self.masks[self.step + 1] = masks.copy()
+        self.share_obs[self.step] = share_obs[:, :self.share_obs.shape[2]]
+        self.obs[self.step] = obs
+        self.rnn_states[self.step + 1] = rnn_states
+        self.rnn_states_critic[self.step + 1] = rnn_states_critic
+        self.actions[self.step] = actions
+        self.action_log_probs[self.step] = action_log_probs
+        self.value_preds[self.step] = value_preds
+        self.rewards[self.step] = rewards
+        self.masks[self.step + 1] = masks
         if bad_masks is not None:
-            self.bad_masks[self.step + 1] = bad_masks.copy()
+            self.bad_masks[self.step + 1] = bad_masks
         if active_masks is not None:
-            self.active_masks[self.step] = active_masks.copy()
+            self.active_masks[self.step] = active_masks
         if available_actions is not None:
-            self.available_actions[self.step] = available_actions.copy()
+            self.available_actions[self.step] = available_actions
 
         self.step = (self.step + 1) % self.episode_length
 
+    def agent_share_obs(self, step):
+        """
+        Per-agent centralized observations of a step.
+        :param step: (int) index of the step.
+
+        :return share_obs: (np.ndarray) read-only view of shape (n_rollout_threads, num_agents, *share_obs_shape).
+        """
+        share_obs = self.share_obs[step]
+        return np.broadcast_to(share_obs, (share_obs.shape[0], self.num_agents, *share_obs.shape[2:]))
+
+    def _share_obs_index(self, indices):
+        """
+        Map indices of flattened per-agent data to indices of flattened share_obs.
+        :param indices: (np.ndarray) indices into data flattened as (..., threads, agents).
+        """
+        if self.share_obs.shape[2] == self.num_agents:
+            return indices
+        return indices // self.num_agents
+
     def after_update(self):
         """Copy last timestep data to first index. Called after update to model."""
-        self.share_obs[0] = self.share_obs[-1].copy()
-        self.obs[0] = self.obs[-1].copy()
-        self.rnn_states[0] = self.rnn_states[-1].copy()
-        self.rnn_states_critic[0] = self.rnn_states_critic[-1].copy()
-        self.masks[0] = self.masks[-1].copy()
-        self.bad_masks[0] = self.bad_masks[-1].copy()
-        self.active_masks[0] = self.active_masks[-1].copy()
+        self.share_obs[0] = self.share_obs[-1]
+        self.obs[0] = self.obs[-1]
+        self.rnn_states[0] = self.rnn_states[-1]
+        self.rnn_states_critic[0] = self.rnn_states_critic[-1]
+        self.masks[0] = self.masks[-1]
+        self.bad_masks[0] = self.bad_masks[-1]
+        self.active_masks[0] = self.active_masks[-1]
         if self.available_actions is not None:
-            self.available_actions[0] = self.available_actions[-1].copy()
+            self.available_actions[0] = self.available_actions[-1]
 
     def chooseafter_update(self):
         """Copy last timestep data to first index. This method is used for Hanabi."""
-        self.rnn_states[0] = self.rnn_states[-1].copy()
-        self.rnn_states_critic[0] = self.rnn_states_critic[-1].copy()
-        self.masks[0] = self.masks[-1].copy()
-        self.bad_masks[0] = self.bad_masks[-1].copy()
+        self.rnn_states[0] = self.rnn_states[-1]
+        self.rnn_states_critic[0] = self.rnn_states_critic[-1]
+        self.masks[0] = self.masks[-1]
+        self.bad_masks[0] = self.bad_masks[-1]
 
     def compute_returns(self, next_value, value_normalizer=None):
         """
@@ -172,61 +209,133 @@ class SharedReplayBuffer(object):
         :param next_value: (np.ndarray) value predictions for the step after the last episode step.
         :param value_normalizer: (PopArt) If not None, PopArt value normalizer instance.
         """
-        if self._use_proper_time_limits:
-            if self._use_gae:
-                self.value_preds[-1] = next_value
-                gae = 0
-                for step in reversed(range(self.rewards.shape[0])):
-                    if self._use_popart or self._use_valuenorm:
-                        # step + 1
-                        delta = self.rewards[step] + self.gamma * value_normalizer.denormalize(
-                            self.value_preds[step + 1]) * self.masks[step + 1] \
-                                - value_normalizer.denormalize(self.value_preds[step])
-                        gae = delta + self.gamma * self.gae_lambda * gae * self.masks[step + 1]
-                        gae = gae * self.bad_masks[step + 1]
-                        self.returns[step] = gae + value_normalizer.denormalize(self.value_preds[step])
-                    else:
-                        delta = self.rewards[step] + self.gamma * self.value_preds[step + 1] * self.masks[step + 1] - \
-                                self.value_preds[step]
-                        gae = delta + self.gamma * self.gae_lambda * self.masks[step + 1] * gae
-                        gae = gae * self.bad_masks[step + 1]
-                        self.returns[step] = gae + self.value_preds[step]
-            else:
-                self.returns[-1] = next_value
-                for step in reversed(range(self.rewards.shape[0])):
-                    if self._use_popart or self._use_valuenorm:
-                        self.returns[step] = (self.returns[step + 1] * self.gamma * self.masks[step + 1] + self.rewards[
-                            step]) * self.bad_masks[step + 1] \
-                                             + (1 - self.bad_masks[step + 1]) * value_normalizer.denormalize(
-                            self.value_preds[step])
-                    else:
-                        self.returns[step] = (self.returns[step + 1] * self.gamma * self.masks[step + 1] + self.rewards[
-                            step]) * self.bad_masks[step + 1] \
-                                             + (1 - self.bad_masks[step + 1]) * self.value_preds[step]
+        use_normalizer = self._use_popart or self._use_valuenorm
+        if self._use_gae:
+            self.value_preds[-1] = next_value
+            # denormalize all steps at once instead of twice per step
+            values = value_normalizer.denormalize(self.value_preds) if use_normalizer else self.value_preds
+            deltas = self.rewards + self.gamma * values[1:] * self.masks[1:] - values[:-1]
+            discounts = self.gamma * self.gae_lambda * self.masks[1:]
+            if self._use_proper_time_limits:
+                deltas *= self.bad_masks[1:]
+                discounts = discounts * self.bad_masks[1:]
+            self.returns[:-1] = reverse_discounted_sum(deltas, discounts) + values[:-1]
         else:
-            if self._use_gae:
-                self.value_preds[-1] = next_value
-                gae = 0
-                for step in reversed(range(self.rewards.shape[0])):
-                    if self._use_popart or self._use_valuenorm:
-                        delta = self.rewards[step] + self.gamma * value_normalizer.denormalize(
-                            self.value_preds[step + 1]) * self.masks[step + 1] \
-                                - value_normalizer.denormalize(self.value_preds[step])
-                        gae = delta + self.gamma * self.gae_lambda * self.masks[step + 1] * gae
-                        self.returns[step] = gae + value_normalizer.denormalize(self.value_preds[step])
-                    else:
-                        delta = self.rewards[step] + self.gamma * self.value_preds[step + 1] * self.masks[step + 1] - \
-                                self.value_preds[step]
-                        gae = delta + self.gamma * self.gae_lambda * self.masks[step + 1] * gae
-                        self.returns[step] = gae + self.value_preds[step]
-            else:
-                self.returns[-1] = next_value
-                for step in reversed(range(self.rewards.shape[0])):
-                    self.returns[step] = self.returns[step + 1] * self.gamma * self.masks[step + 1] + self.rewards[step]
+            self.returns[-1] = next_value
+            deltas = self.rewards
+            discounts = self.gamma * self.masks[1:]
+            if self._use_proper_time_limits:
+                values = value_normalizer.denormalize(self.value_preds[:-1]) if use_normalizer \
+                    else self.value_preds[:-1]
+                deltas = self.rewards * self.bad_masks[1:] + (1 - self.bad_masks[1:]) * values
+                discounts = discounts * self.bad_masks[1:]
+            self.returns[:-1] = reverse_discounted_sum(deltas, discounts, self.returns[-1])
+
+    def _stage(self, name, source, indices):
+        """
+        Gather rows of a flattened field into a staging array that is reused across epochs.
+        :param name: (str) name of the staging array.
+        :param source: (np.ndarray) the field flattened to rows.
+        :param indices: (np.ndarray) rows to gather, all minibatches of an epoch in order.
+
+        :return staged: (np.ndarray) the gathered rows, each minibatch is a contiguous slice of it.
+        """
+        staged = self._staging_array(name, (len(indices), *source.shape[1:]))
+        # the indices are valid, and clip avoids the buffering of the default mode
+        return np.take(source, indices, axis=0, out=staged, mode='clip')
+
+    def _staging_array(self, name, shape):
+        """
+        The staging array of a field, allocated once and reused while its shape does not change.
+        :param name: (str) name of the staging array.
+        :param shape: (tuple) shape of the staging array.
+
+        :return staged: (np.ndarray) the uninitialized staging array.
+        """
+        staged = self._staging.get(name)
+        if staged is None or staged.shape != shape:
+            staged = self._staging[name] = np.empty(shape, dtype=np.float32)
+        return staged
+
+    @staticmethod
+    def _rows(field):
+        """
+        The steps of a field but the last, flattened to rows of (T, threads, agents).
+        :param field: (np.ndarray) the field, of shape (T + 1, threads, agents, ...).
+
+        :return rows: (np.ndarray) a view of the rows.
+        """
+        return field[:-1].reshape(-1, *field.shape[3:])
+
+    def _flat_fields(self):
+        """
+        Views of the per step fields flattened to rows of (T, threads, agents), without the rnn states.
+
+        :return data: (dict) the flattened fields, available_actions is only included for discrete actions.
+        """
+        data = {
+            "share_obs": self._rows(self.share_obs),
+            "obs": self._rows(self.obs),
+            "actions": self.actions.reshape(-1, self.actions.shape[-1]),
+            "value_preds": self.value_preds[:-1].reshape(-1, 1),
+            "returns": self.returns[:-1].reshape(-1, 1),
+            "masks": self.masks[:-1].reshape(-1, 1),
+            "active_masks": self.active_masks[:-1].reshape(-1, 1),
+            "action_log_probs": self.action_log_probs.reshape(-1, self.action_log_probs.shape[-1]),
+        }
+        if self.available_actions is not None:
+            data["available_actions"] = self.available_actions[:-1].reshape(-1, self.available_actions.shape[-1])
+        return data
+
+    def _stage_all(self, advantages, rows, share_obs_rows, rnn_rows, data, data_rnn):
+        """
+        Stage all fields of an epoch.
+        :param advantages: (np.ndarray) advantage estimates flattened to rows.
+        :param rows: (np.ndarray) rows of the per step fields.
+        :param share_obs_rows: (np.ndarray) rows of share_obs.
+        :param rnn_rows: (np.ndarray) rows of the rnn states.
+        :param data: (dict) per step fields flattened to rows, with share_obs.
+        :param data_rnn: (dict) rnn states flattened to rows.
+
+        :return staged: (dict) staged fields, None for the fields missing from data and data_rnn.
+        """
+        staged = {"available_actions": None, "masks": None, "rnn_states": None, "rnn_states_critic": None}
+        for name, source in data.items():
+            staged[name] = self._stage(name, source, share_obs_rows if name == "share_obs" else rows)
+        for name, source in data_rnn.items():
+            staged[name] = self._stage(name, source, rnn_rows)
+        staged["advantages"] = self._stage("advantages", advantages, rows)
+        return staged
+
+    @staticmethod
+    def _minibatches(staged, num_mini_batch, rows_per_batch, rnn_rows_per_batch, share_obs_rows_per_batch=None):
+        """
+        Yield the minibatches of staged fields as views.
+        :param staged: (dict) staged fields, see _stage_all.
+        :param num_mini_batch: (int) number of minibatches.
+        :param rows_per_batch: (int) number of rows of each minibatch.
+        :param rnn_rows_per_batch: (int) number of rnn state rows of each minibatch.
+        :param share_obs_rows_per_batch: (int) number of share_obs rows of each minibatch, rows_per_batch if None.
+        """
+        if share_obs_rows_per_batch is None:
+            share_obs_rows_per_batch = rows_per_batch
+        def view(name, batch):
+            return None if staged[name] is None else staged[name][batch]
+
+        for i in range(num_mini_batch):
+            batch = slice(i * rows_per_batch, (i + 1) * rows_per_batch)
+            rnn_batch = slice(i * rnn_rows_per_batch, (i + 1) * rnn_rows_per_batch)
+            share_obs_batch = slice(i * share_obs_rows_per_batch, (i + 1) * share_obs_rows_per_batch)
+            yield staged["share_obs"][share_obs_batch], staged["obs"][batch], view("rnn_states", rnn_batch), \
+                view("rnn_states_critic", rnn_batch), staged["actions"][batch], staged["value_preds"][batch], \
+                staged["returns"][batch], view("masks", batch), staged["active_masks"][batch], \
+                staged["action_log_probs"][batch], staged["advantages"][batch], view("available_actions", batch)
 
     def feed_forward_generator(self, advantages, num_mini_batch=None, mini_batch_size=None):
         """
         Yield training data for MLP policies.
+        The fields are gathered once per epoch in minibatch order, and the minibatches are views into the staging
+        arrays, so they are only valid until the next epoch starts.
         :param advantages: (np.ndarray) advantage estimates.
         :param num_mini_batch: (int) number of minibatches to split the batch into.
         :param mini_batch_size: (int) number of samples in each minibatch.
@@ -244,51 +353,39 @@ class SharedReplayBuffer(object):
                           num_mini_batch))
             mini_batch_size = batch_size // num_mini_batch
 
-        rand = torch.randperm(batch_size).numpy()
-        sampler = [rand[i * mini_batch_size:(i + 1) * mini_batch_size] for i in range(num_mini_batch)]
+        if self._use_shared_critic:
+            # a minibatch holds all agents of its (step, thread) groups, whose share_obs row is staged once
+            groups_per_batch = mini_batch_size // num_agents
+            assert groups_per_batch > 0, (
+                "use_shared_critic requires minibatches of at least the number of agents ({})".format(num_agents))
+            groups = torch.randperm(episode_length * n_rollout_threads).numpy()[:num_mini_batch * groups_per_batch]
+            rows = (groups[:, None] * num_agents + np.arange(num_agents)).reshape(-1)
+            share_obs_rows, mini_batch_size = groups, groups_per_batch * num_agents
+        else:
+            rand = torch.randperm(batch_size).numpy()
+            rows = rand[:num_mini_batch * mini_batch_size]
+            share_obs_rows, groups_per_batch = self._share_obs_index(rows), None
+
+        # obs size [T+1 N M Dim]-->[T N M Dim]-->[T*N*M,Dim]-->[index,Dim]
+        data = self._flat_fields()
+        if self._recurrent:
+            data_rnn = {
+                "rnn_states": self.rnn_states[:-1].reshape(batch_size, *self.rnn_states.shape[3:]),
+                "rnn_states_critic": self.rnn_states_critic[:-1].reshape(batch_size,
+                                                                          *self.rnn_states_critic.shape[3:]),
+            }
+        else:
+            # feed-forward policies do not read rnn states and masks, the minibatches hold None instead
+            del data["masks"]
+            data_rnn = {}
 
-        share_obs = self.share_obs[:-1].reshape(-1, *self.share_obs.shape[3:])
-        obs = self.obs[:-1].reshape(-1, *self.obs.shape[3:])
-        rnn_states = self.rnn_states[:-1].reshape(-1, *self.rnn_states.shape[3:])
-        rnn_states_critic = self.rnn_states_critic[:-1].reshape(-1, *self.rnn_states_critic.shape[3:])
-        actions = self.actions.reshape(-1, self.actions.shape[-1])
-        if self.available_actions is not None:
-            available_actions = self.available_actions[:-1].reshape(-1, self.available_actions.shape[-1])
-        value_preds = self.value_preds[:-1].reshape(-1, 1)
-        returns = self.returns[:-1].reshape(-1, 1)
-        masks = self.masks[:-1].reshape(-1, 1)
-        active_masks = self.active_masks[:-1].reshape(-1, 1)
-        action_log_probs = self.action_log_probs.reshape(-1, self.action_log_probs.shape[-1])
-        advantages = advantages.reshape(-1, 1)
-
-        for indices in sampler:
-            # obs size [T+1 N M Dim]-->[T N M Dim]-->[T*N*M,Dim]-->[index,Dim]
-            share_obs_batch = share_obs[indices]
-            obs_batch = obs[indices]
-            rnn_states_batch = rnn_states[indices]
-            rnn_states_critic_batch = rnn_states_critic[indices]
-            actions_batch = actions[indices]
-            if self.available_actions is not None:
-                available_actions_batch = available_actions[indices]
-            else:
-                available_actions_batch = None
-            value_preds_batch = value_preds[indices]
-            return_batch = returns[indices]
-            masks_batch = masks[indices]
-            active_masks_batch = active_masks[indices]
-            old_action_log_probs_batch = action_log_probs[indices]
-            if advantages is None:
-                adv_targ = None
-            else:
-                adv_targ = advantages[indices]
-
-            yield share_obs_batch, obs_batch, rnn_states_batch, rnn_states_critic_batch, actions_batch, \
-                value_preds_batch, return_batch, masks_batch, active_masks_batch, old_action_log_probs_batch, \
-                adv_targ, available_actions_batch
+        staged = self._stage_all(advantages.reshape(-1, 1), rows, share_obs_rows, rows, data, data_rnn)
+        return self._minibatches(staged, num_mini_batch, mini_batch_size, mini_batch_size, groups_per_batch)
 
     def naive_recurrent_generator(self, advantages, num_mini_batch):
         """
         Yield training data for non-chunked RNN training.
+        The minibatches are views into staging arrays, see feed_forward_generator.
         :param advantages: (np.ndarray) advantage estimates.
         :param num_mini_batch: (int) number of minibatches to split the batch into.
         """
@@ -301,91 +398,47 @@ class SharedReplayBuffer(object):
         num_envs_per_batch = batch_size // num_mini_batch
         perm = torch.randperm(batch_size).numpy()
 
-        share_obs = self.share_obs.reshape(-1, batch_size, *self.share_obs.shape[3:])
-        obs = self.obs.reshape(-1, batch_size, *self.obs.shape[3:])
-        rnn_states = self.rnn_states.reshape(-1, batch_size, *self.rnn_states.shape[3:])
-        rnn_states_critic = self.rnn_states_critic.reshape(-1, batch_size, *self.rnn_states_critic.shape[3:])
-        actions = self.actions.reshape(-1, batch_size, self.actions.shape[-1])
-        if self.available_actions is not None:
-            available_actions = self.available_actions.reshape(-1, batch_size, self.available_actions.shape[-1])
-        value_preds = self.value_preds.reshape(-1, batch_size, 1)
-        returns = self.returns.reshape(-1, batch_size, 1)
-        masks = self.masks.reshape(-1, batch_size, 1)
-        active_masks = self.active_masks.reshape(-1, batch_size, 1)
-        action_log_probs = self.action_log_probs.reshape(-1, batch_size, self.action_log_probs.shape[-1])
-        advantages = advantages.reshape(-1, batch_size, 1)
-
-        for start_ind in range(0, batch_size, num_envs_per_batch):
-            share_obs_batch = []
-            obs_batch = []
-            rnn_states_batch = []
-            rnn_states_critic_batch = []
-            actions_batch = []
-            available_actions_batch = []
-            value_preds_batch = []
-            return_batch = []
-            masks_batch = []
-            active_masks_batch = []
-            old_action_log_probs_batch = []
-            adv_targ = []
-
-            for offset in range(num_envs_per_batch):
-                ind = perm[start_ind + offset]
-                share_obs_batch.append(share_obs[:-1, ind])
-                obs_batch.append(obs[:-1, ind])
-                rnn_states_batch.append(rnn_states[0:1, ind])
-                rnn_states_critic_batch.append(rnn_states_critic[0:1, ind])
-                actions_batch.append(actions[:, ind])
-                if self.available_actions is not None:
-                    available_actions_batch.append(available_actions[:-1, ind])
-                value_preds_batch.append(value_preds[:-1, ind])
-                return_batch.append(returns[:-1, ind])
-                masks_batch.append(masks[:-1, ind])
-                active_masks_batch.append(active_masks[:-1, ind])
-                old_action_log_probs_batch.append(action_log_probs[:, ind])
-                adv_targ.append(advantages[:, ind])
-
-            # [N[T, dim]]
-            T, N = self.episode_length, num_envs_per_batch
-            # These are all from_numpys of size (T, N, -1)
-            share_obs_batch = np.stack(share_obs_batch, 1)
-            obs_batch = np.stack(obs_batch, 1)
-            actions_batch = np.stack(actions_batch, 1)
-            if self.available_actions is not None:
-                available_actions_batch = np.stack(available_actions_batch, 1)
-            value_preds_batch = np.stack(value_preds_batch, 1)
-            return_batch = np.stack(return_batch, 1)
-            masks_batch = np.stack(masks_batch, 1)
-            active_masks_batch = np.stack(active_masks_batch, 1)
-            old_action_log_probs_batch = np.stack(old_action_log_probs_batch, 1)
-            adv_targ = np.stack(adv_targ, 1)
-
-            # States is just a (N, dim) from_numpy [N[1,dim]]
-            rnn_states_batch = np.stack(rnn_states_batch).reshape(N, *self.rnn_states.shape[3:])
-            rnn_states_critic_batch = np.stack(rnn_states_critic_batch).reshape(N, *self.rnn_states_critic.shape[3:])
-
-            # Flatten the (T, N, ...) from_numpys to (T * N, ...)
-            share_obs_batch = _flatten(T, N, share_obs_batch)
-            obs_batch = _flatten(T, N, obs_batch)
-            actions_batch = _flatten(T, N, actions_batch)
-            if self.available_actions is not None:
-                available_actions_batch = _flatten(T, N, available_actions_batch)
-            else:
-                available_actions_batch = None
-            value_preds_batch = _flatten(T, N, value_preds_batch)
-            return_batch = _flatten(T, N, return_batch)
-            masks_batch = _flatten(T, N, masks_batch)
-            active_masks_batch = _flatten(T, N, active_masks_batch)
-            old_action_log_probs_batch = _flatten(T, N, old_action_log_probs_batch)
-            adv_targ = _flatten(T, N, adv_targ)
-
-            yield share_obs_batch, obs_batch, rnn_states_batch, rnn_states_critic_batch, actions_batch, \
-                value_preds_batch, return_batch, masks_batch, active_masks_batch, old_action_log_probs_batch, \
-                adv_targ, available_actions_batch
+        # a minibatch holds all steps of num_envs_per_batch (thread, agent) columns, flattened as (T, N)
+        T, N = self.episode_length, num_envs_per_batch
+        columns = perm[:num_mini_batch * N].reshape(num_mini_batch, 1, N)
+        steps = np.arange(T).reshape(1, T, 1)
+        rows = (steps * batch_size + columns).reshape(-1)
+        share_obs_columns = n_rollout_threads * self.share_obs.shape[2]
+        share_obs_rows = (steps * share_obs_columns + self._share_obs_index(columns)).reshape(-1)
+
+        data = self._flat_fields()
+        # States is just a (N, dim) array of the first step
+        data_rnn = {
+            "rnn_states": self.rnn_states[0].reshape(batch_size, *self.rnn_states.shape[3:]),
+            "rnn_states_critic": self.rnn_states_critic[0].reshape(batch_size, *self.rnn_states_critic.shape[3:]),
+        }
+
+        staged = self._stage_all(advantages.reshape(-1, 1), rows, share_obs_rows, columns.reshape(-1), data, data_rnn)
+        return self._minibatches(staged, num_mini_batch, T * N, N)
+
+    def _chunk_tables(self, data_chunk_length):
+        """
+        Index tables of the data chunks, computed once and reused across epochs.
+        A chunk is data_chunk_length consecutive steps of one (thread, agent), and the chunks are numbered along
+        (thread, agent, T) like the transposed rollout.
+        :param data_chunk_length: (int) length of sequence chunks with which to train RNN.
+
+        :return rows: (np.ndarray) (num_chunks, data_chunk_length) rows of the per step fields flattened as (T, N, M).
+        :return share_obs_rows: (np.ndarray) the same rows of share_obs.
+        """
+        if data_chunk_length not in self._chunk_table_cache:
+            episode_length, n_rollout_threads, num_agents = self.rewards.shape[0:3]
+            data_chunks = n_rollout_threads * episode_length * num_agents // data_chunk_length
+            transposed = np.arange(data_chunks * data_chunk_length).reshape(data_chunks, data_chunk_length)
+            # row (n * M + m) * T + t of the transposed rollout is row t * N * M + n * M + m of the rollout
+            rows = transposed % episode_length * (n_rollout_threads * num_agents) + transposed // episode_length
+            self._chunk_table_cache[data_chunk_length] = rows, self._share_obs_index(rows)
+        return self._chunk_table_cache[data_chunk_length]
 
     def recurrent_generator(self, advantages, num_mini_batch, data_chunk_length):
         """
         Yield training data for chunked RNN training.
+        The minibatches are views into staging arrays, see feed_forward_generator.
         :param advantages: (np.ndarray) advantage estimates.
         :param num_mini_batch: (int) number of minibatches to split the batch into.
         :param data_chunk_length: (int) length of sequence chunks with which to train RNN.
@@ -396,100 +449,22 @@ class SharedReplayBuffer(object):
         mini_batch_size = data_chunks // num_mini_batch
 
         rand = torch.randperm(data_chunks).numpy()
-        sampler = [rand[i * mini_batch_size:(i + 1) * mini_batch_size] for i in range(num_mini_batch)]
 
-        if len(self.share_obs.shape) > 4:
-            share_obs = self.share_obs[:-1].transpose(1, 2, 0, 3, 4, 5).reshape(-1, *self.share_obs.shape[3:])
-            obs = self.obs[:-1].transpose(1, 2, 0, 3, 4, 5).reshape(-1, *self.obs.shape[3:])
-        else:
-            share_obs = _cast(self.share_obs[:-1])
-            obs = _cast(self.obs[:-1])
-
-        actions = _cast(self.actions)
-        action_log_probs = _cast(self.action_log_probs)
-        advantages = _cast(advantages)
-        value_preds = _cast(self.value_preds[:-1])
-        returns = _cast(self.returns[:-1])
-        masks = _cast(self.masks[:-1])
-        active_masks = _cast(self.active_masks[:-1])
-        # rnn_states = _cast(self.rnn_states[:-1])
-        # rnn_states_critic = _cast(self.rnn_states_critic[:-1])
-        rnn_states = self.rnn_states[:-1].transpose(1, 2, 0, 3, 4).reshape(-1, *self.rnn_states.shape[3:])
-        rnn_states_critic = self.rnn_states_critic[:-1].transpose(1, 2, 0, 3, 4).reshape(-1,
-                                                                                         *self.rnn_states_critic.shape[
-                                                                                          3:])
-
-        if self.available_actions is not None:
-            available_actions = _cast(self.available_actions[:-1])
-
-        for indices in sampler:
-            share_obs_batch = []
-            obs_batch = []
-            rnn_states_batch = []
-            rnn_states_critic_batch = []
-            actions_batch = []
-            available_actions_batch = []
-            value_preds_batch = []
-            return_batch = []
-            masks_batch = []
-            active_masks_batch = []
-            old_action_log_probs_batch = []
-            adv_targ = []
-
-            for index in indices:
-
-                ind = index * data_chunk_length
-                # size [T+1 N M Dim]-->[T N M Dim]-->[N,M,T,Dim]-->[N*M*T,Dim]-->[L,Dim]
-                share_obs_batch.append(share_obs[ind:ind + data_chunk_length])
-                obs_batch.append(obs[ind:ind + data_chunk_length])
-                actions_batch.append(actions[ind:ind + data_chunk_length])
-                if self.available_actions is not None:
-                    available_actions_batch.append(available_actions[ind:ind + data_chunk_length])
-                value_preds_batch.append(value_preds[ind:ind + data_chunk_length])
-                return_batch.append(returns[ind:ind + data_chunk_length])
-                masks_batch.append(masks[ind:ind + data_chunk_length])
-                active_masks_batch.append(active_masks[ind:ind + data_chunk_length])
-                old_action_log_probs_batch.append(action_log_probs[ind:ind + data_chunk_length])
-                adv_targ.append(advantages[ind:ind + data_chunk_length])
-                # size [T+1 N M Dim]-->[T N M Dim]-->[N M T Dim]-->[N*M*T,Dim]-->[1,Dim]
-                rnn_states_batch.append(rnn_states[ind])
-                rnn_states_critic_batch.append(rnn_states_critic[ind])
-
-            L, N = data_chunk_length, mini_batch_size
-
-            # These are all from_numpys of size (L, N, Dim)           
-            share_obs_batch = np.stack(share_obs_batch, axis=1)
-            obs_batch = np.stack(obs_batch, axis=1)
-
-            actions_batch = np.stack(actions_batch, axis=1)
-            if self.available_actions is not None:
-                available_actions_batch = np.stack(available_actions_batch, axis=1)
-            value_preds_batch = np.stack(value_preds_batch, axis=1)
-            return_batch = np.stack(return_batch, axis=1)
-            masks_batch = np.stack(masks_batch, axis=1)
-            active_masks_batch = np.stack(active_masks_batch, axis=1)
-            old_action_log_probs_batch = np.stack(old_action_log_probs_batch, axis=1)
-            adv_targ = np.stack(adv_targ, axis=1)
-
-            # States is just a (N, -1) from_numpy
-            rnn_states_batch = np.stack(rnn_states_batch).reshape(N, *self.rnn_states.shape[3:])
-            rnn_states_critic_batch = np.stack(rnn_states_critic_batch).reshape(N, *self.rnn_states_critic.shape[3:])
-
-            # Flatten the (L, N, ...) from_numpys to (L * N, ...)
-            share_obs_batch = _flatten(L, N, share_obs_batch)
-            obs_batch = _flatten(L, N, obs_batch)
-            actions_batch = _flatten(L, N, actions_batch)
-            if self.available_actions is not None:
-                available_actions_batch = _flatten(L, N, available_actions_batch)
-            else:
-                available_actions_batch = None
-            value_preds_batch = _flatten(L, N, value_preds_batch)
-            return_batch = _flatten(L, N, return_batch)
-            masks_batch = _flatten(L, N, masks_batch)
-            active_masks_batch = _flatten(L, N, active_masks_batch)
-            old_action_log_probs_batch = _flatten(L, N, old_action_log_probs_batch)
-            adv_targ = _flatten(L, N, adv_targ)
-
-            yield share_obs_batch, obs_batch, rnn_states_batch, rnn_states_critic_batch, actions_batch, \
-                value_preds_batch, return_batch, masks_batch, active_masks_batch, old_action_log_probs_batch, \
-                adv_targ, available_actions_batch
+        # size [T+1 N M Dim]-->[T N M Dim]-->[T*N*M,Dim], the chunks are gathered by the index tables
+        data = self._flat_fields()
+        data_rnn = {
+            "rnn_states": self.rnn_states[:-1].reshape(batch_size, *self.rnn_states.shape[3:]),
+            "rnn_states_critic": self.rnn_states_critic[:-1].reshape(batch_size, *self.rnn_states_critic.shape[3:]),
+        }
+
+        # a minibatch holds mini_batch_size chunks of data_chunk_length steps, flattened as (L, N)
+        L, N = data_chunk_length, mini_batch_size
+        table, share_obs_table = self._chunk_tables(data_chunk_length)
+        chunks = rand[:num_mini_batch * N].reshape(num_mini_batch, N)
+        rows = table[chunks].transpose(0, 2, 1).reshape(-1)
+        share_obs_rows = share_obs_table[chunks].transpose(0, 2, 1).reshape(-1)
+        # the rnn states at the start of each chunk
+        rnn_rows = table[chunks, 0].reshape(-1)
+
+        staged = self._stage_all(advantages.reshape(-1, 1), rows, share_obs_rows, rnn_rows, data, data_rnn)
+        return self._minibatches(staged, num_mini_batch, L * N, N)
@@ -0,0 +1,120 @@
+import numpy as np
+import torch
+
+from mappo.utils.shared_buffer import SharedReplayBuffer
+
+
+class TensorReplayBuffer(SharedReplayBuffer):
+    """
+    SharedReplayBuffer that samples the minibatches from torch tensors on the training device, allocated once.
+    Only the sampling changes: collection, insert and return computation still go through the numpy attributes of
+    SharedReplayBuffer. On CPU the tensors are views of them. On GPU the numpy attributes are pinned, and insert
+    copies the steps it stores to the device tensors, so the generators gather the minibatches on the device
+    without copying the rollout there every epoch.
+    :param args: (argparse.Namespace) arguments containing relevant model, policy, and env information.
+    :param num_agents: (int) number of agents in the env.
+    :param obs_space: (gym.Space) observation space of agents.
+    :param cent_obs_space: (gym.Space) centralized observation space of agents.
+    :param act_space: (gym.Space) action space for agents.
+    :param device: (torch.device) specifies the device to sample minibatches on (cpu/gpu).
+    """
+
+    fields = ("share_obs", "obs", "rnn_states", "rnn_states_critic", "value_preds", "returns", "available_actions",
+              "actions", "action_log_probs", "rewards", "masks", "bad_masks", "active_masks")
+
+    def __init__(self, args, num_agents, obs_space, cent_obs_space, act_space, device=torch.device("cpu")):
+        self.device = device
+        self.mirrored = device.type != "cpu"
+        super(TensorReplayBuffer, self).__init__(args, num_agents, obs_space, cent_obs_space, act_space)
+        self.tensors = {}
+        for name in self.fields:
+            array = getattr(self, name)
+            if array is not None:
+                self.tensors[name] = torch.from_numpy(array).to(device)
+
+    def _allocate(self, name, shape, fill=0.0):
+        """
+        Allocate the float32 array of a field, in pinned memory when it is copied to a GPU.
+        :param name: (str) name of the field.
+        :param shape: (tuple) shape of the array.
+        :param fill: (float) initial value of the array.
+
+        :return array: (np.ndarray) the allocated array.
+        """
+        if self.device.type != "cuda":
+            return super(TensorReplayBuffer, self)._allocate(name, shape, fill)
+        return torch.full(shape, fill, dtype=torch.float32, pin_memory=True).numpy()
+
+    def _mirror(self, index, names=None):
+        """
+        Copy steps of the numpy fields to their device tensors.
+        :param index: (int / slice) steps to copy.
+        :param names: (tuple) fields to copy, all fields if None.
+        """
+        if not self.mirrored:
+            return
+        for name in self.tensors if names is None else names:
+            self.tensors[name][index].copy_(torch.from_numpy(getattr(self, name)[index]))
+
+    def insert(self, *args, **kwargs):
+        step = self.step
+        super(TensorReplayBuffer, self).insert(*args, **kwargs)
+        # the first insert of an episode also copies the first step, which the runner writes directly, e.g. the
+        # reset observations and the ones carried over by after_update
+        self._mirror(slice(step, step + 2))
+
+    def chooseinsert(self, *args, **kwargs):
+        step = self.step
+        super(TensorReplayBuffer, self).chooseinsert(*args, **kwargs)
+        self._mirror(slice(step, step + 2))
+
+    def compute_returns(self, next_value, value_normalizer=None):
+        super(TensorReplayBuffer, self).compute_returns(next_value, value_normalizer)
+        self._mirror(slice(None), ("value_preds", "returns"))
+
+    def _device_field(self, name, source):
+        """
+        The device tensor of a field viewed like a numpy view of the field.
+        :param name: (str) name of the field.
+        :param source: (np.ndarray) a view of the numpy field.
+
+        :return tensor: (torch.Tensor) the view of the device tensor, None if source is not a view of the field.
+        """
+        tensor = self.tensors.get(name)
+        if tensor is None:
+            return None
+        array = getattr(self, name)
+        offset = source.__array_interface__["data"][0] - array.__array_interface__["data"][0]
+        if not np.may_share_memory(source, array) or offset % array.itemsize:
+            return None
+        # the numpy field and its tensor are both contiguous, so a view has the same strides in elements
+        return tensor.as_strided(source.shape, [stride // array.itemsize for stride in source.strides],
+                                 offset // array.itemsize)
+
+    def _stage_all(self, advantages, rows, share_obs_rows, rnn_rows, data, data_rnn):
+        # each index array is shared by several fields, it is copied to the device once
+        def indices(array):
+            return torch.from_numpy(np.ascontiguousarray(array, dtype=np.int64)).to(self.device)
+
+        return super(TensorReplayBuffer, self)._stage_all(advantages, indices(rows), indices(share_obs_rows),
+                                                          indices(rnn_rows), data, data_rnn)
+
+    def _stage(self, name, source, indices):
+        """
+        Gather rows of a flattened field on the training device into a staging tensor reused across epochs.
+        :param name: (str) name of the field.
+        :param source: (np.ndarray) the field flattened to rows, a view of a numpy field except for the advantages.
+        :param indices: (torch.Tensor) rows to gather on the device, all minibatches of an epoch in order.
+
+        :return staged: (torch.Tensor) the gathered rows, each minibatch is a contiguous slice of it.
+        """
+        rows = self._device_field(name, source)
+        if rows is None:
+            # the advantages are computed per update, they are the only rows copied to the device per epoch
+            rows = torch.from_numpy(np.ascontiguousarray(source)).to(self.device)
+        staged = self._staging.get(name)
+        shape = (len(indices), *rows.shape[1:])
+        if staged is None or staged.shape != shape:
+            staged = self._staging[name] = torch.empty(shape, dtype=rows.dtype, device=self.device)
+        # index_select is several times faster than advanced indexing for a single dimension
+        return torch.index_select(rows, 0, indices, out=staged)
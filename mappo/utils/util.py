@@ -1,21 +1,82 @@
-import math
-
 import numpy as np
 import torch
 
 
 def check(input):
-    if type(input) == np.ndarray:
+    if isinstance(input, np.ndarray):
         return torch.from_numpy(input)
 
 
 def get_gard_norm(it):
-    sum_grad = 0
-    for x in it:
-        if x.grad is None:
-            continue
-        sum_grad += x.grad.norm() ** 2
-    return math.sqrt(sum_grad)
+    # a tensor, so that reading the norm does not synchronize with the device
+    norms = [x.grad.norm() for x in it if x.grad is not None]
+    return torch.stack(norms).norm() if norms else torch.zeros(())
+
+
+def reverse_discounted_sum(deltas, discounts, last=None):
+    """
+    Solve x[t] = deltas[t] + discounts[t] * x[t + 1] backwards along the first axis, with x[T] = last.
+    Every step is a whole-array operation, so the python loop only runs over time.
+    :param deltas: (np.ndarray) per step increments of shape (T, ...).
+    :param discounts: (np.ndarray) per step discounts, broadcastable to deltas.
+    :param last: (np.ndarray) value after the last step, zero if None.
+
+    :return x: (np.ndarray) the discounted sums of shape (T, ...).
+    """
+    out = np.empty(np.broadcast_shapes(deltas.shape, np.shape(discounts)), dtype=deltas.dtype)
+    T = out.shape[0]
+    if last is None:
+        out[T - 1] = deltas[T - 1]
+    else:
+        np.multiply(discounts[T - 1], last, out=out[T - 1])
+        out[T - 1] += deltas[T - 1]
+    for t in reversed(range(T - 1)):
+        np.multiply(discounts[t], out[t + 1], out=out[t])
+        out[t] += deltas[t]
+    return out
+
+
+def masked_moments(x, mask=None, axes=None):
+    """
+    Mean and mean of squares of x over the entries where mask is nonzero, without copying x to mask it out.
+    Works on numpy arrays, accumulated in float64, and on torch tensors, on their device.
+    :param x: (np.ndarray or torch.Tensor) the values.
+    :param mask: (np.ndarray or torch.Tensor) broadcastable to x, zero for the excluded entries, None includes all.
+    :param axes: (tuple) axes to reduce, all of them if None.
+
+    :return mean: mean of the included entries.
+    :return mean_sq: mean of the squares of the included entries.
+    """
+    if isinstance(x, np.ndarray):
+        weights = np.broadcast_to(True if mask is None else mask != 0, x.shape)
+        count = np.count_nonzero(weights, axis=axes)
+        total = x.sum(axes, dtype=np.float64, where=weights)
+        # a single buffered pass over x, x and the mask, the squares are never stored
+        subscripts = "".join(chr(ord("a") + i) for i in range(x.ndim))
+        summed = range(x.ndim) if axes is None else [axis % x.ndim for axis in np.atleast_1d(axes)]
+        kept = "".join(c for i, c in enumerate(subscripts) if i not in summed)
+        total_sq = np.einsum("{0},{0},{0}->{1}".format(subscripts, kept), x, x, weights, dtype=np.float64)
+        return total / count, total_sq / count
+    if mask is None:
+        return x.mean(axes), (x ** 2).mean(axes)
+    weights = (mask != 0).to(x.dtype).expand_as(x)
+    count = weights.sum(axes)
+    weighted = x * weights
+    return weighted.sum(axes) / count, (weighted * x).sum(axes) / count
+
+
+def masked_mean_std(x, mask=None, axes=None):
+    """
+    Mean and standard deviation of x over the entries where mask is nonzero, see masked_moments.
+
+    :return mean: mean of the included entries, of the dtype of x.
+    :return std: standard deviation of the included entries, of the dtype of x.
+    """
+    mean, mean_sq = masked_moments(x, mask, axes)
+    if isinstance(x, np.ndarray):
+        std = np.sqrt(np.maximum(mean_sq - mean ** 2, 0.0))
+        return np.asarray(mean, dtype=x.dtype), np.asarray(std, dtype=x.dtype)
+    return mean, (mean_sq - mean ** 2).clamp(min=0.0).sqrt()
 
 
 def update_linear_schedule(optimizer, epoch, total_num_epochs, initial_lr):
@@ -3,6 +3,9 @@ import numpy as np
 import torch
 import torch.nn as nn
 
+from mappo.utils.distributed import all_reduce_moments
+from mappo.utils.util import masked_moments
+
 
 class ValueNorm(nn.Module):
     """ Normalize a vector of observations - across the first norm_axes dimensions"""
@@ -36,13 +39,21 @@ class ValueNorm(nn.Module):
         return debiased_mean, debiased_var
 
     @torch.no_grad()
-    def update(self, input_vector):
-        if type(input_vector) == np.ndarray:
+    def update(self, input_vector, mask=None):
+        if isinstance(input_vector, np.ndarray):
             input_vector = torch.from_numpy(input_vector)
         input_vector = input_vector.to(**self.tpdv)
 
-        batch_mean = input_vector.mean(dim=tuple(range(self.norm_axes)))
-        batch_sq_mean = (input_vector ** 2).mean(dim=tuple(range(self.norm_axes)))
+        if isinstance(mask, np.ndarray):
+            mask = torch.from_numpy(mask)
+        if mask is not None:
+            mask = mask.to(**self.tpdv)
+
+        # the excluded entries, e.g. of inactive agents, do not contribute to the statistics
+        axes = tuple(range(self.norm_axes))
+        batch_mean, batch_sq_mean = masked_moments(input_vector, mask, axes)
+        # with distributed training, every rank keeps the statistics of the batches of all ranks
+        batch_mean, batch_sq_mean = all_reduce_moments(input_vector, mask, batch_mean, batch_sq_mean, axes)
 
         if self.per_element_update:
             batch_size = np.prod(input_vector.size()[:self.norm_axes])
@@ -54,9 +65,24 @@ class ValueNorm(nn.Module):
         self.running_mean_sq.mul_(weight).add_(batch_sq_mean * (1.0 - weight))
         self.debiasing_term.mul_(weight).add_(1.0 * (1.0 - weight))
 
+    def update_and_normalize(self, input_vector, mask=None):
+        """
+        Update the statistics with a batch, then normalize the batch with the updated statistics.
+        :param input_vector: (np.ndarray or torch.Tensor) the batch.
+        :param mask: (np.ndarray or torch.Tensor) zero for the entries excluded from the statistics, None includes all.
+
+        :return out: (torch.Tensor) the normalized batch, on the device of the statistics.
+        """
+        if isinstance(input_vector, np.ndarray):
+            input_vector = torch.from_numpy(input_vector)
+        input_vector = input_vector.to(**self.tpdv)
+
+        self.update(input_vector, mask)
+        return self.normalize(input_vector)
+
     def normalize(self, input_vector):
         # Make sure input is float32
-        if type(input_vector) == np.ndarray:
+        if isinstance(input_vector, np.ndarray):
             input_vector = torch.from_numpy(input_vector)
         input_vector = input_vector.to(**self.tpdv)
 
@@ -67,13 +93,13 @@ class ValueNorm(nn.Module):
 
     def denormalize(self, input_vector):
         """ Transform normalized data back into original distribution """
-        if type(input_vector) == np.ndarray:
+        from_numpy = isinstance(input_vector, np.ndarray)
+        if from_numpy:
             input_vector = torch.from_numpy(input_vector)
         input_vector = input_vector.to(**self.tpdv)
 
         mean, var = self.running_mean_var()
         out = input_vector * torch.sqrt(var)[(None,) * self.norm_axes] + mean[(None,) * self.norm_axes]
 
-        out = out.cpu().numpy()
-
-        return out
+        # tensors stay on the device, numpy arrays are returned as numpy arrays
+        return out.cpu().numpy() if from_numpy else out
@@ -4,35 +4,88 @@ from pathlib import Path
 sys.path.append(str(Path(__file__).parent.parent))
 
 
+import logging
 from contextlib import asynccontextmanager
+from time import perf_counter
 
-import gymnasium as gym
 import numpy as np
-import torch as th
-from fastapi import FastAPI
+from fastapi import FastAPI, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.exceptions import RequestValidationError
 from fastapi.middleware.cors import CORSMiddleware
-
-from mappo.algorithms.algorithm.r_actor_critic import R_Actor
-from mappo.config import get_config
-
-from pydantic import BaseModel, Field, RootModel
-
-models: dict[str, R_Actor] = {}
+from fastapi.responses import PlainTextResponse
+
+from mappo.algorithms.algorithm.inference import CachedActor, load_actor
+from server.metrics import Counter, Gauge, Histogram, Registry
+
+from pydantic import BaseModel, Field, RootModel, TypeAdapter, ValidationError
+
+logger = logging.getLogger(__name__)
+
+# the unit time of the environment, a prediction slower than this misses the tick
+TICK = 0.1
+
+# model name -> (path, backend, cache), requests select a model by its name
+# actor.npz is exported next to actor.pt during training, the numpy backend does not import torch
+# the "float16" and "int8" backends trade a little accuracy for memory and latency, see benches.accuracy
+# cache holds the CachedActor arguments, idle vehicles send identical observations, None disables it
+model_configs: dict[str, tuple[str, str, dict | None]] = {
+    "mappo": (
+        "results/environ/all/mappo/check/run3/models/actor.npz",
+        "numpy",
+        dict(maxsize=4096, ttl=60.0, precision=3),
+    ),
+    # "mappo-int8": ("results/environ/all/mappo/check/run3/models/actor.pt", "int8", None),
+}
+
+models: dict = {}
+
+registry = Registry()
+phase_seconds = registry.register(Histogram(
+    "pharos_predict_phase_seconds",
+    "Time spent in each phase of /predict.",
+    (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0),
+    ("model", "phase"),
+))
+batch_size = registry.register(Histogram(
+    "pharos_predict_batch_size",
+    "Number of observations per /predict request.",
+    (1, 2, 4, 7, 8, 16, 32, 64, 128, 256, 512, 1024),
+    ("model",),
+))
+requests_total = registry.register(Counter(
+    "pharos_predict_requests_total",
+    "Number of /predict requests.",
+    ("model",),
+))
+missed_ticks_total = registry.register(Counter(
+    "pharos_predict_missed_ticks_total",
+    "Number of /predict requests slower than a tick.",
+    ("model",),
+))
+cache_hits_total = registry.register(Counter(
+    "pharos_cache_hits_total",
+    "Number of observations answered by the cache.",
+    ("model",),
+))
+cache_misses_total = registry.register(Counter(
+    "pharos_cache_misses_total",
+    "Number of observations of cached models evaluated by the model.",
+    ("model",),
+))
+registry.register(Gauge(
+    "pharos_cache_hit_ratio",
+    "Fraction of observations answered by the cache.",
+    lambda: [((k,), v.hit_rate) for k, v in models.items() if isinstance(v, CachedActor)],
+    ("model",),
+))
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    model_path = "results/environ/all/mappo/check/run3/models/actor.pt"
-    model = R_Actor(
-        get_config().parse_known_args()[0],
-        gym.spaces.Box(-np.inf, np.inf, [77], dtype=np.float32),
-        gym.spaces.Box(0, 1.4, [6], dtype=np.float32),
-    )
-
-    policy_actor_state_dict = th.load(model_path, weights_only=True)
-    model.load_state_dict(policy_actor_state_dict)
-
-    models["mappo"] = model
+    for name, (model_path, backend, cache) in model_configs.items():
+        model = load_actor(model_path, backend)
+        models[name] = model if cache is None else CachedActor(model, **cache)
     yield
     models.clear()
 
@@ -48,8 +101,9 @@ app.add_middleware(
 )
 
 
+# the length is checked against the model of the request, an entity encoder takes any number of vehicle slots
 class Observation(RootModel):
-    root: list[float] = Field(min_length=77, max_length=77)
+    root: list[float] = Field(min_length=1)
 
 
 class ModelInput(BaseModel):
@@ -67,18 +121,100 @@ class ModelOutput(BaseModel):
     zones: list[ZoneSchema]
 
 
-@app.post("/predict")
-def model_predict(data: ModelInput) -> list[ZoneSchema]:
-    model = models[data.model_name]
+class CacheStats(BaseModel):
+    hits: int
+    misses: int
+    hit_rate: float
+    size: int
 
-    zones: list[ZoneSchema] = []
-    for each in data.obs:
-        # np.zeros(0) are used to fill rnn states which is not used
-        action, _, _ = model(
-            np.array(each.model_dump()), np.zeros(0), np.zeros(0), deterministic=True
+
+@app.get("/cache")
+def cache_stats() -> dict[str, CacheStats]:
+    return {
+        name: CacheStats(hits=model.hits, misses=model.misses, hit_rate=model.hit_rate, size=len(model))
+        for name, model in models.items()
+        if isinstance(model, CachedActor)
+    }
+
+
+@app.get("/metrics")
+def metrics() -> PlainTextResponse:
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+
+zone_list = TypeAdapter(list[ZoneSchema])
+
+
+def forward(model, obs: np.ndarray, submitted: float) -> tuple[np.ndarray, float, float | None, int]:
+    """evaluate the model in the thread pool, and measure the queue wait and the forward time, None if the cache
+    answered every observation and the model did not run, and count the observations the model evaluated"""
+    started = perf_counter()
+    if isinstance(model, CachedActor):
+        actions, evaluated = model.evaluate(obs)
+    else:
+        actions, evaluated = model(obs), len(obs)
+    return actions, started - submitted, perf_counter() - started if evaluated else None, evaluated
+
+
+# the body is parsed by hand so that each phase can be timed
+@app.post(
+    "/predict",
+    response_model=list[ZoneSchema],
+    openapi_extra={
+        "requestBody": {
+            "content": {"application/json": {"schema": ModelInput.model_json_schema()}},
+            "required": True,
+        },
+    },
+)
+async def model_predict(request: Request) -> Response:
+    start = perf_counter()
+    try:
+        data = ModelInput.model_validate_json(await request.body())
+    except ValidationError as e:
+        raise RequestValidationError(
+            [{**error, "loc": ("body", *error["loc"])} for error in e.errors(include_url=False)]
         )
-        action = action.detach().cpu().numpy()[0, 0, 0]
-        action = 0.7 * (np.tanh(action) + 1)
-        zones.append(ZoneSchema(x=action[:2], y=action[2:4], z=action[4:6]))
+    model = models[data.model_name]
+    dims = sorted({len(each.root) for each in data.obs})
+    if len(dims) > 1 or any(not model.accepts(dim) for dim in dims):
+        raise RequestValidationError([{
+            "type": "value_error",
+            "loc": ("body", "obs"),
+            "msg": "observations of lengths {} do not fit the model {}".format(dims, data.model_name),
+            "input": dims,
+        }])
+    obs = np.array([each.root for each in data.obs], dtype=np.float32)
+    parsed = perf_counter()
 
-    return zones
+    zones: list[ZoneSchema] = []
+    queue = compute = None
+    if len(obs):
+        # all observations are evaluated in a single batch
+        actions, queue, compute, evaluated = await run_in_threadpool(forward, model, obs, perf_counter())
+        if isinstance(model, CachedActor):
+            cache_hits_total.inc(data.model_name, amount=len(obs) - evaluated)
+            cache_misses_total.inc(data.model_name, amount=evaluated)
+        actions = 0.7 * (np.tanh(actions) + 1)
+        for action in actions.tolist():
+            zones.append(ZoneSchema(x=action[:2], y=action[2:4], z=action[4:6]))
+
+    serializing = perf_counter()
+    body = zone_list.dump_json(zones)
+    end = perf_counter()
+
+    name = data.model_name
+    phase_seconds.observe(parsed - start, name, "parse")
+    # empty and cached batches do not run the model, they would skew the queue and forward times towards zero
+    if compute is not None:
+        phase_seconds.observe(queue, name, "queue")
+        phase_seconds.observe(compute, name, "forward")
+    phase_seconds.observe(end - serializing, name, "serialize")
+    phase_seconds.observe(end - start, name, "total")
+    batch_size.observe(len(obs), name)
+    requests_total.inc(name)
+    if end - start > TICK:
+        missed_ticks_total.inc(name)
+        logger.warning("predict of %d observations by %s took %.3fs, exceeding the tick", len(obs), name, end - start)
+
+    return Response(body, media_type="application/json")
@@ -0,0 +1,121 @@
+import threading
+from bisect import bisect_left
+from typing import Iterable, Callable
+
+
+def _labels(names: tuple[str, ...], values: tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{k}="{v}"' for k, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Counter:
+    def __init__(self, name: str, doc: str, labelnames: Iterable[str] = ()) -> None:
+        """
+        a monotonically increasing counter in prometheus style
+        :param name: metric name
+        :param doc: help text
+        :param labelnames: names of the labels
+        """
+        self.name = name
+        self.doc = doc
+        self.labelnames = tuple(labelnames)
+        self.__values: dict[tuple[str, ...], float] = {}
+        self.__lock = threading.Lock()
+
+    def inc(self, *labels: str, amount: float = 1.0) -> None:
+        with self.__lock:
+            self.__values[labels] = self.__values.get(labels, 0.0) + amount
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} counter"]
+        with self.__lock:
+            values = list(self.__values.items())
+        for labels, value in values:
+            lines.append(f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, doc: str, buckets: Iterable[float], labelnames: Iterable[str] = ()) -> None:
+        """
+        a cumulative histogram in prometheus style, observing is a bisect and two additions
+        :param name: metric name
+        :param doc: help text
+        :param buckets: upper bounds of the buckets, +Inf is appended automatically
+        :param labelnames: names of the labels
+        """
+        self.name = name
+        self.doc = doc
+        self.buckets = tuple(sorted(buckets))
+        self.labelnames = tuple(labelnames)
+        # per label values: counts of each bucket (not cumulative), sum
+        self.__values: dict[tuple[str, ...], tuple[list[int], list[float]]] = {}
+        self.__lock = threading.Lock()
+
+    def observe(self, value: float, *labels: str) -> None:
+        i = bisect_left(self.buckets, value)
+        with self.__lock:
+            state = self.__values.get(labels)
+            if state is None:
+                state = self.__values[labels] = ([0] * (len(self.buckets) + 1), [0.0])
+            state[0][i] += 1
+            state[1][0] += value
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} histogram"]
+        with self.__lock:
+            values = [(labels, list(counts), total[0]) for labels, (counts, total) in self.__values.items()]
+        for labels, counts, total in values:
+            cumulative = 0
+            for bound, count in zip((*self.buckets, float("inf")), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else _number(bound)
+                extra = 'le="' + le + '"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, extra)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+class Gauge:
+    def __init__(self, name: str, doc: str, collect: Callable[[], Iterable[tuple[tuple[str, ...], float]]],
+                 labelnames: Iterable[str] = ()) -> None:
+        """
+        a gauge whose values are collected at scrape time
+        :param name: metric name
+        :param doc: help text
+        :param collect: a function that returns pairs of label values and the value
+        :param labelnames: names of the labels
+        """
+        self.name = name
+        self.doc = doc
+        self.collect = collect
+        self.labelnames = tuple(labelnames)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} gauge"]
+        for labels, value in self.collect():
+            lines.append(f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}")
+        return lines
+
+
+class Registry:
+    def __init__(self) -> None:
+        """a collection of metrics rendered together in the prometheus text format"""
+        self.metrics: list[Counter | Histogram | Gauge] = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,71 @@
+import numpy as np
+import pytest
+import torch
+from gymnasium import spaces
+
+from mappo.algorithms.algorithm.inference import load_actor, quantize_actor, save_actor
+from mappo.algorithms.algorithm.numpy_actor import NumpyActor, actor_meta
+from mappo.algorithms.algorithm.r_actor_critic import R_Actor
+from mappo.config import get_config
+from mappo.train import parse_args
+from mappo.utils.compact_buffer import OBS_DIM, OBS_SLOTS
+
+ACTION_DIM = 6
+
+
+def sparse_obs(rng, n):
+    """observations with a random half of the vehicle and human slots absent"""
+    obs = rng.standard_normal((n, OBS_DIM)).astype(np.float32)
+    present = rng.random((n, len(OBS_SLOTS))) < 0.5
+    present[:, 0] = True
+    return obs * np.repeat(present, OBS_SLOTS, axis=-1)
+
+
+@pytest.mark.parametrize("argv", [[], ["--use_entity_encoder"], ["--use_entity_encoder", "--hidden_size", "32"]])
+def test_save_load_predict(tmp_path, argv):
+    torch.manual_seed(0)
+    args = parse_args(argv, get_config())
+    actor = R_Actor(args, spaces.Box(-np.inf, np.inf, (OBS_DIM,), np.float32),
+                    spaces.Box(0.0, 1.4, (ACTION_DIM,), np.float32))
+    actor.eval()
+    save_actor(actor, str(tmp_path), actor_meta(args, OBS_DIM, ACTION_DIM))
+
+    obs = sparse_obs(np.random.default_rng(0), 32)
+    with torch.no_grad():
+        expected = actor(obs, None, None, deterministic=True)[0].numpy()
+
+    for path, backend in ((tmp_path / "actor.npz", "numpy"), (tmp_path / "actor.pt", "numpy"),
+                          (tmp_path / "actor.pt", "torch")):
+        model = load_actor(str(path), backend)
+        assert model.accepts(OBS_DIM)
+        np.testing.assert_allclose(model(obs), expected, rtol=1e-4, atol=1e-5)
+
+
+def test_entity_actor_accepts_vehicle_slots(tmp_path):
+    args = parse_args(["--use_entity_encoder"], get_config())
+    actor = R_Actor(args, spaces.Box(-np.inf, np.inf, (OBS_DIM,), np.float32),
+                    spaces.Box(0.0, 1.4, (ACTION_DIM,), np.float32))
+    save_actor(actor, str(tmp_path), actor_meta(args, OBS_DIM, ACTION_DIM))
+    model = NumpyActor.load(str(tmp_path / "actor.npz"))
+    assert model.accepts(OBS_DIM + 8) and not model.accepts(OBS_DIM + 1)
+    assert model(np.zeros((3, OBS_DIM + 16), dtype=np.float32)).shape == (3, ACTION_DIM)
+
+
+def test_legacy_npz_loads_as_mlp(tmp_path):
+    args = parse_args([], get_config())
+    actor = R_Actor(args, spaces.Box(-np.inf, np.inf, (OBS_DIM,), np.float32),
+                    spaces.Box(0.0, 1.4, (ACTION_DIM,), np.float32))
+    np.savez(tmp_path / "actor.npz", **{k: v.numpy() for k, v in actor.state_dict().items()})
+    model = NumpyActor.load(str(tmp_path / "actor.npz"))
+    assert model.meta["encoder"] == "mlp" and not model.accepts(OBS_DIM + 8)
+
+
+def test_unknown_backend_raises(tmp_path):
+    args = parse_args([], get_config())
+    actor = R_Actor(args, spaces.Box(-np.inf, np.inf, (OBS_DIM,), np.float32),
+                    spaces.Box(0.0, 1.4, (ACTION_DIM,), np.float32))
+    save_actor(actor, str(tmp_path), actor_meta(args, OBS_DIM, ACTION_DIM))
+    with pytest.raises(ValueError, match="unknown backend 'int4', expected one of numpy, torch, float16, int8"):
+        load_actor(str(tmp_path / "actor.pt"), "int4")
+    with pytest.raises(ValueError, match="unknown backend 'int4'"):
+        quantize_actor(actor, "int4")
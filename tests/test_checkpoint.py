@@ -0,0 +1,14 @@
+import pytest
+
+from mappo.runner.base_runner import Runner
+
+
+@pytest.mark.parametrize("ranks, world_size", [(2, 1), (2, 4), (None, 2)])
+def test_resume_with_other_world_size_raises(ranks, world_size):
+    runner = Runner.__new__(Runner)
+    runner.rank, runner.world_size = 0, world_size
+    state = {"episode": 3}
+    if ranks is not None:
+        state["ranks"] = [{} for _ in range(ranks)]
+    with pytest.raises(ValueError, match="written by {} ranks".format(ranks or 1)):
+        runner.load_checkpoint(state)
@@ -0,0 +1,77 @@
+import numpy as np
+import pytest
+import torch
+from gymnasium import spaces
+
+from mappo.config import get_config
+from mappo.train import parse_args
+from mappo.utils.compact_buffer import OBS_DIM, OBS_SLOTS, CompactObs, CompactReplayBuffer
+from mappo.utils.shared_buffer import SharedReplayBuffer
+
+STEPS, THREADS, AGENTS = 6, 2, 7
+
+
+def sparse_obs(rng):
+    """observations of a step with a random half of the slots absent, like offline vehicles and humans"""
+    obs = rng.standard_normal((THREADS, AGENTS, OBS_DIM)).astype(np.float32)
+    present = np.repeat(rng.random((THREADS, AGENTS, len(OBS_SLOTS))) < 0.5, OBS_SLOTS, axis=-1)
+    return obs * present
+
+
+def fill(buffer, rng):
+    obs = sparse_obs(rng)
+    buffer.share_obs[0] = obs.reshape(THREADS, 1, -1)
+    buffer.obs[0] = obs
+    for _ in range(STEPS):
+        obs = sparse_obs(rng)
+        buffer.insert(obs.reshape(THREADS, 1, -1), obs, None, None,
+                      rng.standard_normal((THREADS, AGENTS, 2)), rng.standard_normal((THREADS, AGENTS, 2)),
+                      rng.standard_normal((THREADS, AGENTS, 1)), rng.standard_normal((THREADS, AGENTS, 1)),
+                      np.ones((THREADS, AGENTS, 1)))
+
+
+@pytest.fixture
+def buffers():
+    args = parse_args(["--episode_length", str(STEPS), "--n_rollout_threads", str(THREADS)], get_config())
+    obs_space = spaces.Box(-np.inf, np.inf, (OBS_DIM,), np.float32)
+    share_obs_space = spaces.Box(-np.inf, np.inf, (OBS_DIM * AGENTS,), np.float32)
+    act_space = spaces.Box(0.0, 1.4, (2,), np.float32)
+    compact = CompactReplayBuffer(args, AGENTS, obs_space, share_obs_space, act_space)
+    dense = SharedReplayBuffer(args, AGENTS, obs_space, share_obs_space, act_space)
+    fill(compact, np.random.default_rng(0))
+    fill(dense, np.random.default_rng(0))
+    return compact, dense
+
+
+def test_minibatches_match_dense_buffer(buffers):
+    compact, dense = buffers
+    advantages = np.random.default_rng(1).standard_normal((STEPS, THREADS, AGENTS, 1)).astype(np.float32)
+    torch.manual_seed(0)
+    expected = [[None if x is None else np.array(x) for x in batch]
+                for batch in dense.feed_forward_generator(advantages, 4)]
+    torch.manual_seed(0)
+    for batch, expected_batch in zip(compact.feed_forward_generator(advantages, 4), expected):
+        for x, y in zip(batch, expected_batch):
+            if y is None:
+                assert x is None
+            else:
+                np.testing.assert_array_equal(x, y)
+
+
+def test_rollout_is_never_decoded_densely(buffers, monkeypatch):
+    compact, _ = buffers
+
+    def decode(self, step):
+        raise AssertionError("the generators must not decode whole steps")
+
+    monkeypatch.setattr(CompactObs, "_decode", decode)
+    advantages = np.zeros((STEPS, THREADS, AGENTS, 1), dtype=np.float32)
+    for _ in compact.feed_forward_generator(advantages, 4):
+        pass
+
+    dense_shapes = {(STEPS + 1, THREADS, AGENTS, OBS_DIM), (STEPS, THREADS, AGENTS, OBS_DIM),
+                    (STEPS + 1, THREADS, 1, OBS_DIM * AGENTS), (STEPS, THREADS, 1, OBS_DIM * AGENTS)}
+    held = [vars(compact), vars(compact.obs), vars(compact.share_obs), compact._staging]
+    for attributes in held:
+        for value in attributes.values():
+            assert not (isinstance(value, np.ndarray) and value.shape in dense_shapes)
@@ -0,0 +1,38 @@
+import tracemalloc
+
+import numpy as np
+import pytest
+import torch
+
+from mappo.utils.util import masked_moments
+
+
+@pytest.mark.parametrize("axes", [None, (0,), (0, 1), (-2,)])
+def test_matches_masked_copy(axes):
+    rng = np.random.default_rng(0)
+    x = rng.standard_normal((50, 7, 3)).astype(np.float32)
+    mask = rng.random((50, 7, 1)) < 0.6
+    masked = np.where(mask, x, 0.0).astype(np.float64)
+    count = np.broadcast_to(mask, x.shape).sum(axes)
+    mean, mean_sq = masked_moments(x, mask, axes)
+    np.testing.assert_allclose(mean, masked.sum(axes) / count, rtol=1e-6)
+    np.testing.assert_allclose(mean_sq, (masked ** 2).sum(axes) / count, rtol=1e-6)
+
+    torch_mean, torch_mean_sq = masked_moments(torch.from_numpy(x), torch.from_numpy(mask), axes)
+    np.testing.assert_allclose(torch_mean.numpy(), mean, rtol=1e-4, atol=1e-6)
+    np.testing.assert_allclose(torch_mean_sq.numpy(), mean_sq, rtol=1e-4, atol=1e-6)
+
+
+@pytest.mark.parametrize("masked", [False, True])
+def test_allocates_less_than_x(masked):
+    rng = np.random.default_rng(0)
+    x = rng.standard_normal((500000, 1)).astype(np.float32)
+    mask = rng.random(x.shape) < 0.6 if masked else None
+    tracemalloc.start()
+    try:
+        masked_moments(x, mask, (0,))
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    # the mask may be converted to booleans, a quarter of x, but no array of the size of x is allocated
+    assert peak < x.nbytes / 2
@@ -0,0 +1,23 @@
+import numpy as np
+from gymnasium import spaces
+
+import mappo.utils.memmap_buffer as memmap_buffer
+from mappo.config import get_config
+from mappo.train import parse_args
+from mappo.utils.memmap_buffer import MemmapReplayBuffer
+
+
+def test_ranks_map_their_own_files(tmp_path, monkeypatch):
+    args = parse_args(["--episode_length", "4", "--n_rollout_threads", "2"], get_config())
+    spaces_ = (spaces.Box(-np.inf, np.inf, (5,), np.float32), spaces.Box(-np.inf, np.inf, (15,), np.float32),
+               spaces.Box(0.0, 1.4, (2,), np.float32))
+    monkeypatch.setattr(memmap_buffer, "get_world_size", lambda: 2)
+    buffers = []
+    for rank in range(2):
+        monkeypatch.setattr(memmap_buffer, "get_rank", lambda rank=rank: rank)
+        buffers.append(MemmapReplayBuffer(args, 3, *spaces_, directory=str(tmp_path)))
+    buffers[0].obs[:] = 1.0
+    buffers[1].obs[:] = 2.0
+
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["buffer_rank0.bin", "buffer_rank1.bin"]
+    assert (buffers[0].obs == 1.0).all() and (buffers[1].obs == 2.0).all()
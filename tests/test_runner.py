@@ -0,0 +1,14 @@
+import pytest
+
+from mappo.config import get_config
+from mappo.runner.base_runner import Runner
+from mappo.train import parse_args
+
+
+@pytest.mark.parametrize("argv", [["--buffer_dir", "buffer", "--use_compact_obs"],
+                                  ["--use_tensor_buffer", "--use_compact_obs"],
+                                  ["--buffer_dir", "buffer", "--use_tensor_buffer", "--use_compact_obs"]])
+def test_combined_buffer_options_raise(argv):
+    config = {"all_args": parse_args(argv, get_config())}
+    with pytest.raises(ValueError, match="can not be combined"):
+        Runner(config)
@@ -0,0 +1,56 @@
+import re
+
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+from gymnasium import spaces
+
+import server.main as server
+from mappo.algorithms.algorithm.inference import save_actor
+from mappo.algorithms.algorithm.numpy_actor import actor_meta
+from mappo.algorithms.algorithm.r_actor_critic import R_Actor
+from mappo.config import get_config
+from mappo.train import parse_args
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    args = parse_args([], get_config())
+    actor = R_Actor(args, spaces.Box(-np.inf, np.inf, (77,), np.float32), spaces.Box(0.0, 1.4, (6,), np.float32))
+    save_actor(actor, str(tmp_path), actor_meta(args, 77, 6))
+    monkeypatch.setattr(server, "model_configs", {"test": (str(tmp_path / "actor.npz"), "numpy", dict(maxsize=16))})
+    with TestClient(server.app) as client:
+        yield client
+
+
+def phase_count(client, phase):
+    match = re.search(r'pharos_predict_phase_seconds_count\{model="test",phase="%s"\} (\d+)' % phase,
+                      client.get("/metrics").text)
+    return int(match.group(1)) if match else 0
+
+
+def test_forward_is_observed_only_when_the_model_runs(client):
+    before = {phase: phase_count(client, phase) for phase in ("queue", "forward", "total")}
+    for obs in ([[0.5] * 77], [[0.5] * 77], []):
+        assert client.post("/predict", json={"model_name": "test", "obs": obs}).status_code == 200
+    # the first request runs the model, the second one is cached and the third one is empty
+    assert phase_count(client, "queue") - before["queue"] == 1
+    assert phase_count(client, "forward") - before["forward"] == 1
+    assert phase_count(client, "total") - before["total"] == 3
+
+
+def test_cache_counters(client):
+    def counter(name):
+        match = re.search(r'%s\{model="test"\} (\d+)' % name, client.get("/metrics").text)
+        return int(match.group(1)) if match else 0
+
+    before = counter("pharos_cache_hits_total"), counter("pharos_cache_misses_total")
+    for obs in ([[0.25] * 77], [[0.25] * 77, [0.25] * 77]):
+        assert client.post("/predict", json={"model_name": "test", "obs": obs}).status_code == 200
+    assert counter("pharos_cache_hits_total") - before[0] == 2
+    assert counter("pharos_cache_misses_total") - before[1] == 1
+    assert "# TYPE pharos_cache_hits_total counter" in client.get("/metrics").text
+
+
+def test_observations_must_fit_the_model(client):
+    assert client.post("/predict", json={"model_name": "test", "obs": [[0.5] * 78]}).status_code == 422
@@ -0,0 +1,68 @@
+import numpy as np
+import pytest
+import torch
+from gymnasium import spaces
+
+from mappo.config import get_config
+from mappo.train import parse_args
+from mappo.utils.shared_buffer import SharedReplayBuffer
+from mappo.utils.tensor_buffer import TensorReplayBuffer
+from mappo.utils.valuenorm import ValueNorm
+
+STEPS, THREADS, AGENTS, OBS_DIM = 8, 2, 3, 5
+
+
+def fill(buffer, rng, episodes):
+    # written directly by the runner, like the reset observations of warmup
+    buffer.obs[0] = rng.standard_normal((THREADS, AGENTS, OBS_DIM))
+    buffer.share_obs[0] = buffer.obs[0].reshape(THREADS, 1, -1)
+    for episode in range(episodes):
+        if episode > 0:
+            buffer.after_update()
+        for _ in range(STEPS):
+            obs = rng.standard_normal((THREADS, AGENTS, OBS_DIM))
+            buffer.insert(obs.reshape(THREADS, 1, -1), obs,
+                          rng.standard_normal(buffer.rnn_states.shape[1:]),
+                          rng.standard_normal(buffer.rnn_states.shape[1:]),
+                          rng.standard_normal((THREADS, AGENTS, 2)), rng.standard_normal((THREADS, AGENTS, 2)),
+                          rng.standard_normal((THREADS, AGENTS, 1)), rng.standard_normal((THREADS, AGENTS, 1)),
+                          (rng.random((THREADS, AGENTS, 1)) < 0.9).astype(np.float32))
+        buffer.compute_returns(rng.standard_normal((THREADS, AGENTS, 1)), ValueNorm(1))
+
+
+@pytest.mark.parametrize("recurrent", [False, True])
+def test_device_tensors_match_numpy_buffer(recurrent):
+    args = parse_args(["--episode_length", str(STEPS), "--n_rollout_threads", str(THREADS), "--data_chunk_length",
+                       "4"], get_config())
+    # --use_recurrent_policy is store_false with a default of False, so it is set after parsing
+    args.use_recurrent_policy = recurrent
+    spaces_ = (spaces.Box(-np.inf, np.inf, (OBS_DIM,), np.float32),
+               spaces.Box(-np.inf, np.inf, (OBS_DIM * AGENTS,), np.float32),
+               spaces.Box(0.0, 1.4, (2,), np.float32))
+    tensor = TensorReplayBuffer(args, AGENTS, *spaces_)
+    # separate tensors stand in for the device copies of a GPU
+    tensor.tensors = {name: t.clone() for name, t in tensor.tensors.items()}
+    tensor.mirrored = True
+    dense = SharedReplayBuffer(args, AGENTS, *spaces_)
+    fill(tensor, np.random.default_rng(0), 2)
+    fill(dense, np.random.default_rng(0), 2)
+
+    for name, t in tensor.tensors.items():
+        np.testing.assert_array_equal(t.numpy(), getattr(dense, name))
+
+    advantages = np.random.default_rng(1).standard_normal((STEPS, THREADS, AGENTS, 1)).astype(np.float32)
+    batches = []
+    for buffer in (tensor, dense):
+        torch.manual_seed(0)
+        if recurrent:
+            generator = buffer.recurrent_generator(advantages, 2, 4)
+        else:
+            generator = buffer.feed_forward_generator(advantages, 2)
+        batches.append([[x.numpy() if torch.is_tensor(x) else x for x in batch] for batch in generator])
+    assert (tensor.rnn_states.shape[-1] > 0) == recurrent
+    for batch, expected in zip(*batches):
+        for x, y in zip(batch, expected):
+            if y is None:
+                assert x is None
+            else:
+                np.testing.assert_array_equal(x, y)